@@ -0,0 +1,131 @@
+"""
+HTTP API for the email processing pipeline; the Streamlit UI is a client of it.
+
+    POST /jobs                   upload one or more .eml files or an mbox (multipart field "files"),
+                                 optional form fields rules, request_type_defs and extraction_fields
+                                 (JSON list) -> {"job_id"}
+    GET  /jobs/{job_id}          job status and item counts
+    GET  /jobs/{job_id}/events   server-sent events with the job status and items (partial results
+                                 included) whenever they change, until the job is done
+    GET  /jobs/{job_id}/results  per-email results
+    GET  /metrics                pipeline stage timings and counters, Prometheus text format (see metrics.py)
+    GET  /health
+
+Work runs on the bounded worker pool of job_queue.py, not in the request handlers.
+Handlers that touch files or SQLite are plain functions, so FastAPI runs them in
+its threadpool instead of on the event loop serving the event streams.
+
+An upload larger than API_MAX_UPLOAD_BYTES in total is rejected with 413 before it
+is read into memory (FastAPI spools the files to disk while they arrive).
+
+Run from code/src with
+    uvicorn api:app --port 8000
+
+Configuration (environment variables):
+    API_MAX_UPLOAD_BYTES (default 100 MB, all files of one request together; 0 = no limit)
+"""
+import asyncio
+import contextlib
+import json
+import os
+
+from fastapi import FastAPI, File, Form, HTTPException, UploadFile
+from fastapi.responses import PlainTextResponse, StreamingResponse
+
+import metrics
+from createEmail import warm_up
+from job_queue import DONE, get_queue, split_upload
+
+EVENT_POLL_SECONDS = 0.25
+MAX_UPLOAD_BYTES = int(os.getenv("API_MAX_UPLOAD_BYTES", str(100 * 1024 * 1024)))
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load the OCR libraries, stores and model client before the first upload arrives.
+    warm_up()
+    get_queue()
+    yield
+
+
+app = FastAPI(title="Email request classification", lifespan=lifespan)
+
+
+def _job_status(job_id: str) -> dict:
+    status = get_queue().status(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}")
+    return status
+
+
+@app.get("/health")
+def health():
+    return {"status": "ok"}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+@app.post("/jobs")
+def create_job(files: list[UploadFile] = File(...), rules: str = Form(None),
+               request_type_defs: str = Form(None), extraction_fields: str = Form(None)):
+    fields = None
+    if extraction_fields:
+        try:
+            fields = json.loads(extraction_fields)
+        except ValueError:
+            fields = None
+        if not isinstance(fields, list) or not all(isinstance(field, str) for field in fields):
+            raise HTTPException(status_code=400, detail="extraction_fields must be a JSON list of strings")
+
+    emails = []
+    remaining = MAX_UPLOAD_BYTES
+    for upload in files:
+        # One byte past the limit is enough to tell that the upload is too large.
+        content = upload.file.read(remaining + 1) if MAX_UPLOAD_BYTES else upload.file.read()
+        if MAX_UPLOAD_BYTES:
+            if len(content) > remaining:
+                raise HTTPException(status_code=413, detail=f"Upload larger than {MAX_UPLOAD_BYTES} bytes")
+            remaining -= len(content)
+        try:
+            emails.extend(split_upload(upload.filename, content))
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Could not read {upload.filename}: {e}")
+    if not emails:
+        raise HTTPException(status_code=400, detail="No emails found in the upload")
+
+    job_id = get_queue().submit(emails, request_type_defs or None, fields, rules or None)
+    return {"job_id": job_id, "emails": len(emails)}
+
+
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    return _job_status(job_id)
+
+
+@app.get("/jobs/{job_id}/results")
+def job_results(job_id: str):
+    status = _job_status(job_id)
+    return {"status": status, "items": get_queue().items(job_id)}
+
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    await asyncio.to_thread(_job_status, job_id)
+
+    async def events():
+        last_update = None
+        while True:
+            # SQLite reads run in a thread so one stream never holds up the others.
+            status = await asyncio.to_thread(get_queue().status, job_id)
+            if status["updated_at"] != last_update or status["status"] == DONE:
+                last_update = status["updated_at"]
+                payload = {"status": status, "items": await asyncio.to_thread(get_queue().items, job_id)}
+                yield f"data: {json.dumps(payload)}\n\n"
+                if status["status"] == DONE:
+                    return
+            await asyncio.sleep(EVENT_POLL_SECONDS)
+
+    return StreamingResponse(events(), media_type="text/event-stream")
@@ -0,0 +1,274 @@
+"""
+Batch / mailbox ingestion for createEmail.
+
+Takes a directory of .eml files, an mbox file, or a glob of .eml files and fans
+the emails out over two pools:
+  - a process pool for the CPU bound part (MIME parsing + OCR, see prepare_email)
+  - a thread pool for the I/O bound part (LLM call + persistence)
+Results are yielded as soon as each email finishes.
+
+Emails whose raw bytes were processed before are recognised by their hash in
+the worker before they are parsed, so exact re-sends skip MIME parsing and OCR.
+
+Worker processes are started and warmed up (OCR libraries imported, OCR cache
+opened) before the first email is read, and this process opens its stores and
+LLM client up front, so no email pays for start-up.
+
+Stage timings and counters (see metrics.py) recorded in the worker processes are
+merged into this process; --metrics-port serves them for Prometheus while the batch
+runs and --profile DIR writes a cProfile (or pyinstrument) profile per email.
+
+Usage:
+    python batch.py <directory | mbox | "glob/*.eml"> [--workers N] [--llm-workers N] [--ocr-workers N]
+                    [--llm-batch-size N] [--metrics-port PORT] [--profile DIR]
+"""
+import argparse
+import glob
+import json
+import mailbox
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+import metrics
+import model_cascade
+import ocr
+from createEmail import (DEFAULT_EXTRACTION_FIELDS, DEFAULT_REQUEST_TYPE_DEFS, DEFAULT_RULES,
+                         prepare_email, process_prepared_email, process_prepared_emails, warm_up)
+
+
+def iter_email_sources(source: str):
+    """
+    Yield (name, payload) tuples for every email in `source`.
+    payload is a file path for .eml files (read inside the worker) and raw bytes
+    for messages taken out of an mbox.
+    """
+    if os.path.isdir(source):
+        for name in sorted(os.listdir(source)):
+            path = os.path.join(source, name)
+            if name.lower().endswith(".eml") and os.path.isfile(path):
+                yield path, path
+    elif os.path.isfile(source) and source.lower().endswith(".eml"):
+        yield source, source
+    elif os.path.isfile(source):
+        box = mailbox.mbox(source, create=False)
+        try:
+            for key in box.iterkeys():
+                yield f"{source}#{key}", box.get_bytes(key)
+        finally:
+            box.close()
+    else:
+        for path in sorted(glob.glob(source, recursive=True)):
+            if os.path.isfile(path):
+                yield path, path
+
+
+def _init_worker(ocr_workers: int):
+    # Runs once in each worker process, before its first email.
+    ocr.set_workers(ocr_workers)
+    warm_up(stores=False, llm=False)
+
+
+def _worker_ready():
+    return os.getpid()
+
+
+def _prepare(payload) -> dict:
+    # Runs in a worker process; its metrics travel back with the prepared email.
+    if isinstance(payload, str):
+        # Passed on as an open file, so large emails are parsed without reading them whole.
+        with open(payload, "rb") as f:
+            return _prepare(f)
+    with metrics.profiled() as profile:
+        # Exact re-sends are looked up by their raw hash here, before any parsing or OCR.
+        prepared = prepare_email(payload, skip_known=True)
+        profile["name"] = f"{prepared['hash']}.prepare"
+    prepared["metrics"] = metrics.drain()
+    return prepared
+
+
+def _process(prepared: dict, request_type_defs: str, extraction_fields: list, rules: str) -> dict:
+    with metrics.profiled(f"{prepared['hash']}.llm"):
+        return process_prepared_email(prepared, request_type_defs, extraction_fields, rules)
+
+
+class BatchStats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.total = 0
+        self.processed = 0
+        self.duplicates = 0
+        self.errors = 0
+        # Per-call stats of multi-email LLM batches (see createEmail.call_llm_for_batch).
+        self.llm_batches = []
+
+    def record(self, item: dict):
+        self.total += 1
+        if item["error"]:
+            self.errors += 1
+        elif item["duplicate"]:
+            self.duplicates += 1
+        else:
+            self.processed += 1
+
+    def summary(self) -> dict:
+        elapsed = time.perf_counter() - self.started
+        summary = {
+            "emails": self.total,
+            "processed": self.processed,
+            "duplicates": self.duplicates,
+            "errors": self.errors,
+            "elapsed_seconds": round(elapsed, 3),
+            "emails_per_second": round(self.total / elapsed, 3) if elapsed > 0 else 0.0,
+        }
+        if self.llm_batches:
+            batched = sum(batch["emails"] for batch in self.llm_batches)
+            summary["llm_batches"] = len(self.llm_batches)
+            summary["llm_batch_latency_seconds"] = round(
+                sum(batch["latency_seconds"] for batch in self.llm_batches) / len(self.llm_batches), 3)
+            summary["llm_seconds_per_email"] = round(
+                sum(batch["latency_seconds"] for batch in self.llm_batches) / batched, 3)
+            summary["llm_prompt_tokens_per_email"] = round(
+                sum(batch["prompt_tokens"] for batch in self.llm_batches) / batched, 1)
+        tiers = model_cascade.stats()
+        if tiers:
+            # Answers, escalation rate and latency per model tier (see model_cascade.py).
+            summary["llm_tiers"] = tiers
+        return summary
+
+
+def run_batch(source: str, request_type_defs=None, extraction_fields=None, rules=None,
+              workers: int = None, llm_workers: int = 8, ocr_workers: int = 1, llm_batch_size: int = 1,
+              stats: BatchStats = None):
+    """
+    Process every email in `source` and yield one result dictionary per email,
+    in completion order:
+        {"name", "hash", "result", "duplicate", "error", "seconds"}
+    `result` is the parsed result dictionary (the cached one for duplicates).
+    `ocr_workers` is the per-email page OCR pool size inside each worker process;
+    the default of 1 avoids oversubscribing the CPUs already used by `workers`.
+    With `llm_batch_size` > 1, up to that many emails share one LLM call
+    (see createEmail.call_llm_for_batch).
+    """
+    request_type_defs = request_type_defs or DEFAULT_REQUEST_TYPE_DEFS
+    extraction_fields = extraction_fields or DEFAULT_EXTRACTION_FIELDS
+    rules = rules or DEFAULT_RULES
+    stats = stats if stats is not None else BatchStats()
+
+    workers = workers or os.cpu_count() or 1
+    # Bound the number of emails held in memory at once.
+    max_in_flight = 2 * (workers + llm_workers)
+    sources = iter(iter_email_sources(source))
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(ocr_workers,)) as cpu_pool, \
+            ThreadPoolExecutor(max_workers=llm_workers) as llm_pool:
+        # Start (and warm up) every worker now; each submission finding no idle worker starts one.
+        wait([cpu_pool.submit(_worker_ready) for _ in range(workers)])
+        # After the workers are forked, so they do not inherit this process's SQLite connections.
+        warm_up(attachments=False)
+        # future -> (stage, [(name, started, email hash), ...])
+        pending = {}
+        # Prepared emails waiting for a full LLM batch.
+        ready = []
+
+        def fill():
+            while len(pending) + len(ready) < max_in_flight:
+                try:
+                    name, payload = next(sources)
+                except StopIteration:
+                    return
+                pending[cpu_pool.submit(_prepare, payload)] = ("prepare", [(name, time.perf_counter(), None)])
+
+        def submit_llm(batch):
+            entries = [(name, started, prepared["hash"]) for name, started, prepared in batch]
+            prepared_emails = [prepared for _, _, prepared in batch]
+            if llm_batch_size > 1:
+                future = llm_pool.submit(process_prepared_emails, prepared_emails, request_type_defs,
+                                         extraction_fields, rules, llm_batch_size, stats.llm_batches)
+            else:
+                future = llm_pool.submit(_process, prepared_emails[0], request_type_defs, extraction_fields, rules)
+            pending[future] = ("llm", entries)
+
+        fill()
+        while pending or ready:
+            if ready and (len(ready) >= llm_batch_size
+                          or not any(stage == "prepare" for stage, _ in pending.values())):
+                submit_llm(ready[:llm_batch_size])
+                del ready[:llm_batch_size]
+                continue
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, entries = pending.pop(future)
+                error = None
+                try:
+                    value = future.result()
+                except Exception as e:
+                    error = f"{type(e).__name__}: {e}"
+                    value = None
+
+                if stage == "prepare" and error is None:
+                    metrics.merge(value.pop("metrics", {}))
+                    name, started, _ = entries[0]
+                    ready.append((name, started, value))
+                    continue
+
+                if stage == "llm" and error is None and llm_batch_size == 1:
+                    value = [value]
+                for position, (name, started, email_hash) in enumerate(entries):
+                    outcome = value[position] if value else None
+                    item = {
+                        "name": name,
+                        "hash": email_hash,
+                        "result": outcome["result"] if outcome else None,
+                        "duplicate": bool(outcome and outcome["duplicate_info"]["flag"]),
+                        "error": error,
+                        "seconds": round(time.perf_counter() - started, 3),
+                    }
+                    stats.record(item)
+                    yield item
+            fill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Process a directory, mbox or glob of .eml files.")
+    parser.add_argument("source", help="directory of .eml files, mbox file, or glob pattern")
+    parser.add_argument("--workers", type=int, default=None, help="parse/OCR processes (default: CPU count)")
+    parser.add_argument("--llm-workers", type=int, default=8, help="concurrent LLM calls")
+    parser.add_argument("--llm-batch-size", type=int, default=1, help="emails packed into one LLM call")
+    parser.add_argument("--ocr-workers", type=int, default=1, help="page OCR processes per parse worker")
+    parser.add_argument("--rules", default=None)
+    parser.add_argument("--request-type-defs", default=None)
+    parser.add_argument("--extraction-fields", default=None, help="comma separated list of fields")
+    parser.add_argument("--metrics-port", type=int, default=None, help="serve Prometheus metrics on this port")
+    parser.add_argument("--profile", metavar="DIR", default=None,
+                        help="write a profile per email to DIR (PROFILER=pyinstrument for pyinstrument)")
+    args = parser.parse_args()
+
+    if args.profile:
+        # Read by metrics.profiled, in this process and the worker processes.
+        os.environ["PROFILE_DIR"] = args.profile
+    if args.metrics_port:
+        metrics.start_http_server(args.metrics_port)
+
+    extraction_fields = None
+    if args.extraction_fields:
+        extraction_fields = [field.strip() for field in args.extraction_fields.split(",") if field.strip()]
+
+    stats = BatchStats()
+    for item in run_batch(args.source, args.request_type_defs, extraction_fields, args.rules,
+                          workers=args.workers, llm_workers=args.llm_workers, ocr_workers=args.ocr_workers,
+                          llm_batch_size=args.llm_batch_size, stats=stats):
+        print(json.dumps(item), flush=True)
+
+    summary = stats.summary()
+    print(f"Processed {summary['emails']} emails in {summary['elapsed_seconds']}s "
+          f"({summary['emails_per_second']} emails/s): {summary['processed']} processed, "
+          f"{summary['duplicates']} duplicates, {summary['errors']} errors")
+    if "llm_batches" in summary:
+        print(f"{summary['llm_batches']} LLM batches: {summary['llm_batch_latency_seconds']}s per batch, "
+              f"{summary['llm_seconds_per_email']}s and {summary['llm_prompt_tokens_per_email']} prompt tokens per email")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,193 +1,740 @@
-import email
 import hashlib
-import io
 import json
 import os
+import time
 from email import policy
 from email.parser import BytesParser
-import base64
-import os
-from google import genai
-from pdf2image import convert_from_bytes
-import pytesseract
-import google as genai
-from PIL import Image
 from dotenv import load_dotenv
-import google.generativeai as genai
-import pandas as pd
-# Load environment variables from the .env file
+import metrics
+import mime_stream
+import model_cascade
+from llm_client import DEFAULT_TIER, FAST_TIER, get_client as get_llm_client
+from result_cache import get_cache as get_result_cache, make_cache_key
+from results_store import get_store as get_results_store
+import ocr
+from ocr import extract_pdf_text, ocr_image
+from rule_extractor import extract_fields as extract_rule_fields
+from response_parser import (IncrementalJSONParser, batch_result_schema, classification_of, extracted_fields_of,
+                             extraction_schema, load_result, merge_extracted_fields, normalize_result, parse_llm_json,
+                             parse_llm_json_array, result_schema)
+from prompt_builder import build_batch_prompt, build_extraction_prompt, build_prompt, count_tokens
+from defaults import DEFAULT_EXTRACTION_FIELDS, DEFAULT_REQUEST_TYPE_DEFS, DEFAULT_RULES
+# Load environment variables from the .env file (GEMINI_API_KEY etc.).
+# The Gemini SDK and the OCR libraries are imported on first use (see llm_client.py, ocr.py),
+# as are the numpy based near-duplicate index, semantic cache and pre-classifier (below).
 load_dotenv()
-# Configure the Gemini API key (from Google AI Studio)
 
+def get_near_duplicate_index():
+    from near_duplicates import get_index
+    return get_index()
+
+def get_semantic_cache():
+    from semantic_cache import get_cache
+    return get_cache()
+
+def get_preclassifier():
+    from preclassifier import get_preclassifier
+    return get_preclassifier()
+
+def preclassify(email_text: str, attachment_text: str, request_type_defs: str):
+    from preclassifier import classify
+    return classify(email_text, attachment_text, request_type_defs)
 
-# In-memory store for duplicate detection (based on email hash)
-PROCESSED_EMAIL_HASHES = set()
+def build_local_result(request_type: str, sub_type: str, confidence: float, extraction_fields: list) -> dict:
+    from preclassifier import build_result
+    return build_result(request_type, sub_type, confidence, extraction_fields)
 
 class EmailProcessor:
-    def __init__(self, raw_email: bytes):
+    def __init__(self, raw_email, streaming: bool = None):
+        # Any bytes-like object (bytes, bytearray, memoryview), read in place, or a binary
+        # file object (e.g. an open .eml file), read in chunks and never held whole.
+        # `streaming` picks the parser (see mime_stream.py); None decides from the size.
         self.raw_email = raw_email
+        self.streaming = streaming
         self.message = None
         self.subject = ""
         self.from_addr = ""
         self.to_addr = ""
         self.body = ""
-        self.attachments = []  # List of tuples: (filename, content bytes)
+        self.attachments = []  # List of tuples: (filename, content memoryview)
+        self.attachment_info = []  # How each attachment's text was obtained (see extract_text_from_attachment)
+        self.email_hash = None
+        self.truncated = False
+        self._parsed = None
+
+    def _is_file(self) -> bool:
+        return hasattr(self.raw_email, "read")
+
+    def _size(self) -> int:
+        if self._is_file():
+            return os.fstat(self.raw_email.fileno()).st_size if hasattr(self.raw_email, "fileno") else 0
+        return memoryview(self.raw_email).nbytes
 
     def parse_email(self):
-        self.message = BytesParser(policy=policy.default).parsebytes(self.raw_email)
-        self.subject = self.message.get('subject', '')
-        self.from_addr = self.message.get('from', '')
-        self.to_addr = self.message.get('to', '')
-        if self.message.is_multipart():
-            for part in self.message.walk():
-                content_type = part.get_content_type()
-                disposition = part.get_content_disposition()
-                if disposition == 'attachment':
-                    filename = part.get_filename()
-                    payload = part.get_payload(decode=True)
-                    self.attachments.append((filename, payload))
-                elif content_type == 'text/plain':
-                    self.body += part.get_content()
+        with metrics.span("parse") as attributes:
+            streaming = self.streaming
+            if streaming is None:
+                streaming = mime_stream.should_stream(self._size())
+            attributes["streaming"] = streaming
+            if streaming:
+                self._parse_streaming()
+                return
+            if self._is_file():
+                self.raw_email.seek(0)
+                self.raw_email = self.raw_email.read()
+            raw_email = self.raw_email if isinstance(self.raw_email, bytes) else bytes(self.raw_email)
+            self.message = BytesParser(policy=policy.default).parsebytes(raw_email)
+            self.subject = self.message.get('subject', '')
+            self.from_addr = self.message.get('from', '')
+            self.to_addr = self.message.get('to', '')
+            if self.message.is_multipart():
+                body = []
+                for part in self.message.walk():
+                    content_type = part.get_content_type()
+                    disposition = part.get_content_disposition()
+                    if disposition == 'attachment':
+                        filename = part.get_filename()
+                        payload = part.get_payload(decode=True) or b""
+                        if mime_stream.MAX_PART_BYTES and len(payload) > mime_stream.MAX_PART_BYTES:
+                            self._skip_attachment(filename, len(payload))
+                            continue
+                        # Passed on as a view so OCR and hashing do not copy the decoded payload.
+                        self.attachments.append((filename, memoryview(payload)))
+                    elif content_type == 'text/plain':
+                        body.append(part.get_content())
+                self.body = "".join(body)
+            else:
+                self.body = self.message.get_content()
+
+    def _parse_streaming(self):
+        if self._is_file():
+            self.raw_email.seek(0)
+            stream = self.raw_email
         else:
-            self.body = self.message.get_content()
+            stream = ocr._stream(self.raw_email)
+        parsed = self._parsed = mime_stream.parse(stream)
+        self.subject = parsed.headers.get('subject', '')
+        self.from_addr = parsed.headers.get('from', '')
+        self.to_addr = parsed.headers.get('to', '')
+        self.truncated = parsed.truncated
+        if parsed.truncated:
+            print(f"Email larger than {mime_stream.MAX_EMAIL_BYTES} bytes; parts after that were skipped")
+        body = []
+        multipart = parsed.headers.get_content_maintype() == 'multipart'
+        for part in parsed.parts:
+            if part.disposition == 'attachment':
+                if part.truncated:
+                    self._skip_attachment(part.filename, part.size)
+                    continue
+                # File backed (mmap) once the part spilled to disk.
+                self.attachments.append((part.filename, part.content()))
+            elif part.content_type == 'text/plain' or (not multipart and part.headers.get_content_maintype() == 'text'):
+                body.append(part.text())
+        self.body = "".join(body)
+
+    def _skip_attachment(self, filename: str, size: int):
+        print(f"Attachment {filename} is larger than {mime_stream.MAX_PART_BYTES} bytes; skipped")
+        self.attachment_info.append({"path": "skipped", "filename": filename, "bytes": size,
+                                     "reason": f"larger than {mime_stream.MAX_PART_BYTES} bytes"})
+
+    def close(self):
+        """Release attachment buffers (and the temporary files of a streamed parse)."""
+        self.attachments = []
+        self.message = None
+        if self._parsed is not None:
+            self._parsed.close()
+            self._parsed = None
 
     def get_email_hash(self) -> str:
-        hash_obj = hashlib.sha256()
-        hash_obj.update(self.raw_email)
-        return hash_obj.hexdigest()
+        if self.email_hash is None:
+            with metrics.span("hash"):
+                hash_obj = hashlib.sha256()
+                if self._is_file():
+                    self.raw_email.seek(0)
+                    for chunk in iter(lambda: self.raw_email.read(mime_stream.MB), b""):
+                        hash_obj.update(chunk)
+                else:
+                    hash_obj.update(self.raw_email)
+                self.email_hash = hash_obj.hexdigest()
+        return self.email_hash
 
     def get_email_content(self) -> str: 
         return self.body
     
-    def extract_text_from_attachment(self, filename: str, content: bytes) -> str:
+    def extract_text_from_attachment(self, filename: str, content: memoryview) -> str:
         """
         Extract text from an attachment.
         Supports PDFs, JPG/JPEG images, and text-based files.
+        The extraction path taken is recorded in self.attachment_info.
         """
+        with metrics.span("attachment", filename=filename or "") as attributes:
+            extracted_text = self._extract_attachment_text(filename, content)
+            info = self.attachment_info[-1]
+            attributes["path"] = info["path"]
+        metrics.increment("attachments_total", path=info["path"])
+        if info["path"] != "cache" and info.get("ocr_pages"):
+            metrics.increment("ocr_pages_total", info["ocr_pages"])
+        return extracted_text
+
+    def _extract_attachment_text(self, filename: str, content: memoryview) -> str:
         extracted_text = ""
-        lower_filename = filename.lower()
+        info = {"path": "none"}
+        started = time.perf_counter()
+        lower_filename = (filename or "").lower()
         if lower_filename.endswith(".pdf"):
             try:
-                images = convert_from_bytes(content)
-                for image in images:
-                    extracted_text += pytesseract.image_to_string(image)
+                # Embedded text layer first, OCR only for pages without one (see ocr.py).
+                extracted_text, info = extract_pdf_text(content)
             except Exception as e:
                 print(f"Error processing PDF attachment {filename}: {e}")
         elif lower_filename.endswith((".jpg", ".jpeg")):
             try:
-                # Open image from bytes and extract text with pytesseract.
-                image = Image.open(io.BytesIO(content))
-                extracted_text = pytesseract.image_to_string(image)
+                # Open image from bytes and extract text with the OCR engine (see ocr_engine.py).
+                extracted_text = ocr_image(content)
+                info = {"path": "ocr", "pages": 1, "ocr_pages": 1}
             except Exception as e:
                 print(f"Error processing image attachment {filename}: {e}")
         elif lower_filename.endswith((".txt", ".csv", ".json")):
             try:
-                extracted_text = content.decode('utf-8')
+                extracted_text = str(content, 'utf-8')
+                info = {"path": "text"}
             except Exception as e:
                 print(f"Error decoding attachment {filename}: {e}")
         else:
             # Extend with other file types if needed.
             extracted_text = ""
+        info = dict(info, filename=filename)
+        info.setdefault("seconds", round(time.perf_counter() - started, 4))
+        self.attachment_info.append(info)
         return extracted_text
 
 # ------------------------------------------------------------------------------
 # Function to call the LLM with all necessary inputs.
 def call_llm_for_processing(email_text: str, attachment_text: str,
                             rules: str, request_type_defs: str,
-                     extraction_fields:list ) -> dict:
-    input = f"""
-    You are an expert in processing loan service requests at Wells Fargo .As part of Commerical Bank Lending Service team you daily get a significant volume of servicing requests through emails which may contain attachments as well . Given input you have to extract key fields, classify the email into its request type and sub request types along with the confidence score strictly based on the rules in the input. The input would contain email content in text form along with attachment in pdf, jpeg, txt or jpg  etc. 
-    
-    given input is of the form - 
-    
-    rules: {rules},
-    extraction_fields: {extraction_fields} , 
-    Email Content:
-    {email_text}
+                     extraction_fields:list, prompt_stats: dict = None, stream: bool = False, cascade: bool = True) -> dict:
+    """
+    Send the prompt (see prompt_builder.py) through the shared LLM client (see
+    llm_client.py), which reuses one configured model and applies concurrency /
+    rate limits and retries. The model is asked for JSON matching result_schema.
+    With a fast model configured the prompt goes through the model cascade (see
+    model_cascade.py) unless cascade=False.
+    Prompt token counts (and the model tier that answered) are written into `prompt_stats`.
+    With stream=True a generator of response text chunks is returned instead of
+    the response; streamed answers come from the tuned model, since text already
+    shown cannot be taken back on escalation.
+    """
+    with metrics.span("prompt"):
+        prompt = build_prompt(email_text, attachment_text, rules, request_type_defs, extraction_fields)
+    metrics.increment("llm_prompt_tokens_total", prompt.stats["prompt_tokens"])
+    if prompt_stats is not None:
+        prompt_stats.update(prompt.stats)
+    if stream:
+        return get_llm_client().stream(prompt.text, response_schema=result_schema(extraction_fields))
+    with metrics.span("llm", emails=1) as attributes:
+        prompt_stats = {} if prompt_stats is None else prompt_stats
+        response = model_cascade.generate(prompt.text, result_schema(extraction_fields), prompt_stats, cascade=cascade)
+        attributes["tier"] = prompt_stats["model_tier"]
+        return response
+
+def call_llm_for_extraction(email_text: str, attachment_text: str, extraction_fields: list,
+                            prompt_stats: dict = None):
+    """
+    Ask the tuned model for the extraction_fields alone (see
+    prompt_builder.build_extraction_prompt), for emails whose classification is
+    reused from the semantic cache. Prompt token counts go into `prompt_stats`.
+    """
+    with metrics.span("prompt"):
+        prompt = build_extraction_prompt(email_text, attachment_text, extraction_fields)
+    metrics.increment("llm_prompt_tokens_total", prompt.stats["prompt_tokens"])
+    if prompt_stats is not None:
+        prompt_stats.update(prompt.stats)
+    with metrics.span("llm", emails=1, tier=DEFAULT_TIER, extraction=True):
+        return get_llm_client().generate(prompt.text, response_schema=extraction_schema(extraction_fields))
 
-    Attachment content:
-    {attachment_text}
+# ------------------------------------------------------------------------------
+# Several emails in one LLM call: per-call overhead dominates for short emails.
+def call_llm_for_batch(emails: list, rules: str, request_type_defs: str, batch_stats: list = None) -> dict:
+    """
+    `emails` is a list of {"id", "email_text", "attachment_text", "extraction_fields"}.
+    The model is asked for a JSON array with one object per email carrying its id.
+    Emails whose object is missing or malformed are retried one by one. With the
+    model cascade on, the batch goes to the fast model and emails whose answer it
+    would escalate (see model_cascade.escalation_reason) are sent to the tuned model
+    one by one.
+    Returns {id: (result text, prompt stats)}; per-batch latency and amortized cost
+    are printed and appended to `batch_stats`.
+    """
+    if len(emails) == 1:
+        email = emails[0]
+        prompt_stats = {}
+        output = call_llm_for_processing(email["email_text"], email["attachment_text"], rules, request_type_defs, email["extraction_fields"], prompt_stats=prompt_stats)
+        return {email["id"]: (output.text, prompt_stats)}
 
-    Rules:
-    {json.dumps(rules, indent=2)}
+    # Short, stable ids (hash prefixes) keep the prompt small; made unique within the batch.
+    short_ids = {}
+    for email in emails:
+        short_id = str(email["id"])[:12]
+        while short_id in short_ids:
+            short_id += "x"
+        short_ids[short_id] = email["id"]
 
-    Request type description:
-    {json.dumps(request_type_defs, indent=2)}
+    with metrics.span("prompt"):
+        prompt = build_batch_prompt([dict(email, id=short_id) for short_id, email in zip(short_ids, emails)], rules, request_type_defs)
+    metrics.increment("llm_prompt_tokens_total", prompt.stats["prompt_tokens"])
+    fields = list(dict.fromkeys(field for email in emails for field in email["extraction_fields"]))
+    tier = FAST_TIER if model_cascade.enabled() else DEFAULT_TIER
+    started = time.perf_counter()
+    with metrics.span("llm", emails=len(emails), tier=tier):
+        output = get_llm_client(tier).generate(prompt.text, response_schema=batch_result_schema(fields))
+    latency = time.perf_counter() - started
 
-    output should be of the form -
-    
-        "extracted fields" ,
-        "primary request types",
-        "request types": "sub request types" , "confidence score", "reason for the classification"
-    
-     
+    results = {}
+    escalated = {}
+    amortized = {"batch_size": len(emails), "batch_prompt_tokens": prompt.stats["prompt_tokens"],
+                 "prompt_tokens": round(prompt.stats["prompt_tokens"] / len(emails), 1), "model_tier": tier}
+    for item in parse_llm_json_array(output.text) or []:
+        if not isinstance(item, dict):
+            continue
+        email_id = short_ids.get(str(item.pop("id", "")))
+        if email_id is not None and email_id not in results and email_id not in escalated and len(item) > 0:
+            text = json.dumps(item)
+            reason = model_cascade.escalation_reason(text) if tier == FAST_TIER else None
+            if reason is None:
+                results[email_id] = (text, amortized)
+            else:
+                escalated[email_id] = reason
+    answered = len(results) + len(escalated)
+    if tier == FAST_TIER:
+        model_cascade.record(tier, latency * len(results) / len(emails), "accepted", emails=len(results))
+        for reason in escalated.values():
+            model_cascade.record(tier, latency / len(emails), "escalated", reason)
+    else:
+        model_cascade.record(tier, latency * answered / len(emails), "answered", emails=answered)
+
+    retried = [email for email in emails if email["id"] not in results]
+    for email in retried:
+        prompt_stats = {}
+        if email["id"] in escalated:
+            print(f"Fast model answer for {email['id']} escalated to the tuned model ({escalated[email['id']]})")
+            prompt_stats["escalation"] = escalated[email["id"]]
+        else:
+            print(f"Batch response missing a valid result for {email['id']}; retrying individually")
+        single = call_llm_for_processing(email["email_text"], email["attachment_text"], rules, request_type_defs, email["extraction_fields"], prompt_stats=prompt_stats, cascade=email["id"] not in escalated)
+        results[email["id"]] = (single.text, prompt_stats)
+
+    stats = {
+        "emails": len(emails),
+        "latency_seconds": round(latency, 3),
+        "seconds_per_email": round(latency / len(emails), 3),
+        "prompt_tokens": prompt.stats["prompt_tokens"],
+        "prompt_tokens_per_email": amortized["prompt_tokens"],
+        "retried_individually": len(retried) - len(escalated),
+        "escalated": len(escalated),
+    }
+    print(f"LLM batch of {stats['emails']}: {stats['latency_seconds']}s ({stats['seconds_per_email']}s/email), "
+          f"{stats['prompt_tokens']} prompt tokens ({stats['prompt_tokens_per_email']}/email), "
+          f"{stats['retried_individually']} retried individually, {stats['escalated']} escalated")
+    if batch_stats is not None:
+        batch_stats.append(stats)
+    return results
+
+# ------------------------------------------------------------------------------
+# Warm start: pay the one-off costs before the first email instead of during it.
+def warm_up(attachments: bool = True, stores: bool = True, llm: bool = True):
+    """
+    Called once per process by long-lived services and worker pools:
+      attachments  import the lazily loaded OCR libraries and open the OCR cache
+      stores       open the result cache, results store, near-duplicate index and semantic cache, load the pre-classifier
+      llm          configure the shared LLM clients' models (the fast tier too, when configured)
     """
-    genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+    if attachments:
+        ocr.warm_up()
+    if stores:
+        get_result_cache()
+        get_results_store()
+        get_near_duplicate_index()
+        get_semantic_cache()
+        get_preclassifier()
+    if llm:
+        get_llm_client().backend
+        if model_cascade.enabled():
+            get_llm_client(FAST_TIER).backend
+
+# ------------------------------------------------------------------------------
+# Parsing stage: CPU bound (MIME parsing + OCR), safe to run in a worker process.
+def prepare_email(raw_email: bytes, skip_known: bool = False) -> dict:
+    """
+    Parse a raw email and extract the text of all its attachments.
+    Returns a plain (picklable) dictionary so it can cross process boundaries.
+    With `skip_known`, an email whose raw bytes were processed before is neither
+    parsed nor OCRed: the dictionary holds only its "hash" and the cached result
+    under "known_result", answered by process_prepared_email as an exact duplicate.
+    """
+    processor = EmailProcessor(raw_email)
+    try:
+        if skip_known:
+            email_hash = processor.get_email_hash()
+            cached = _lookup_exact_duplicate(email_hash)
+            if cached is not None:
+                return {"hash": email_hash, "known_result": cached}
+        processor.parse_email()
+        return _prepared_from_processor(processor)
+    finally:
+        processor.close()
 
-    # Create the model
-    generation_config = {
-    "temperature": 1,
-    "top_p": 0.95,
-    "top_k": 40,
-    "max_output_tokens": 8192,
-    "response_mime_type": "text/plain",
+def _prepared_from_processor(processor: "EmailProcessor") -> dict:
+    attachment_texts = []
+    for filename, content in processor.attachments:
+        attachment_texts.append(f"\n--- Text from {filename} ---\n")
+        attachment_texts.append(processor.extract_text_from_attachment(filename, content))
+
+    return {
+        "hash": processor.get_email_hash(),
+        "email_text": processor.get_email_content(),
+        "attachment_text": "".join(attachment_texts),
+        "attachment_info": processor.attachment_info,
     }
 
-    model = genai.GenerativeModel(
-    model_name="tunedModels/finetunedgemini25proexp03252-n29d3ndtniu",
-    generation_config=generation_config,
-    )
+# ------------------------------------------------------------------------------
+# Persist one processed email to the results store (see results_store.py).
+# Only the parsed result object is stored, as compact JSON.
+def _save_result(email_hash: str, result: dict, duplicate_info: dict, meta: dict = None):
+    with metrics.span("persist"):
+        get_results_store().append(email_hash, json.dumps(result), duplicate_info["flag"],
+                                   meta=dict(meta or {}, duplicate_reason=duplicate_info["reason"]))
+
+# ------------------------------------------------------------------------------
+# LLM stage, split so several emails can share one LLM call (process_prepared_emails).
+def _begin_processing(prepared: dict, request_type_defs: str, extraction_fields: list, rules: str) -> dict:
+    """
+    Everything before the LLM call: duplicate checks, rule based extraction, the
+    semantic cache and the local pre-classifier. Returns a context for
+    _finish_processing; when the email is fully answered already, the context holds
+    the final result under "outcome".
+    """
+    if "known_result" in prepared:
+        return {"outcome": _exact_duplicate_outcome(prepared["hash"], prepared["known_result"])}
+    with metrics.span("dedup"):
+        email_hash = prepared["hash"]
+        cache = get_result_cache()
+        cache_key = make_cache_key(prepared["email_text"], prepared["attachment_text"], rules, request_type_defs, extraction_fields)
+
+        cached = cache.get(cache_key)
+        metrics.increment("cache_lookups_total", kind="content", outcome="miss" if cached is None else "hit")
+        if cached is not None:
+            print("Duplicate email detected")
+            metrics.increment("duplicates_total", kind="content")
+            metrics.increment("emails_total", source="duplicate")
+            duplicate_info = {"flag": True, "reason": f"Duplicate email content detected based on cache key: {cache_key}"}
+            cache.put(cache_key, cached, email_hash)
+            result = load_result(cached)
+            _save_result(email_hash, result, duplicate_info)
+            return {"outcome": {"hash": email_hash, "result": result, "duplicate_info": duplicate_info}}
+
+        meta = {"attachments": prepared.get("attachment_info", [])}
+
+        # Fields stated in rigid patterns ("Effective date: 18-Dec-2023") are extracted
+        # deterministically; only the remaining ones are asked from the LLM.
+        rule_fields = extract_rule_fields(prepared["email_text"], extraction_fields)
+        meta["rule_fields"] = sorted(rule_fields)
+
+        # Forwards, re-sends with new headers and quoting replies: MinHash LSH lookup.
+        near_duplicates = get_near_duplicate_index()
+        signature = near_duplicates.signature(prepared["email_text"] + "\n" + prepared["attachment_text"])
+        match = near_duplicates.query(signature=signature, exclude=email_hash)
+        if match is not None:
+            matched_hash, similarity = match
+            duplicate_info = {"flag": True,
+                              "reason": f"Near-duplicate of email {matched_hash} (similarity {similarity:.2f})",
+                              "similarity": round(similarity, 4),
+                              "matched_hash": matched_hash}
+            matched = get_results_store().get(matched_hash)
+            if matched is not None and matched["info"]:
+                metrics.increment("duplicates_total", kind="near")
+                metrics.increment("emails_total", source="duplicate")
+                # A forward may restate the amount or date: this email's rule fields win.
+                result = merge_extracted_fields(load_result(matched["info"]), rule_fields)
+                cache.put(cache_key, json.dumps(result), email_hash)
+                _save_result(email_hash, result, duplicate_info, meta=dict(meta, matched_hash=matched_hash, similarity=similarity))
+                return {"outcome": {"hash": email_hash, "result": result, "duplicate_info": duplicate_info}}
+        else:
+            duplicate_info = {"flag": False, "reason": "Unique email hash"}
 
-    chat_session = model.start_chat(
-    history=[
-    ]
-    )
+        context = {
+            "prepared": prepared,
+            "cache_key": cache_key,
+            "signature": signature,
+            "duplicate_info": duplicate_info,
+            "meta": meta,
+            "rule_fields": rule_fields,
+            "missing_fields": [field for field in extraction_fields if field not in rule_fields],
+            "result": None,
+            "vector": None,
+        }
 
-    response = chat_session.send_message(input)
+        # Templated variations of an email the LLM classified before (same notice, other
+        # deal / amount / dates): its request type and sub type are reused, and the fields
+        # neither the rules nor the neighbour fill are extracted by a smaller LLM call.
+        semantic_cache = get_semantic_cache()
+        if semantic_cache is not None:
+            text = prepared["email_text"] + "\n" + prepared["attachment_text"]
+            vector = context["vector"] = semantic_cache.embed(text)
+            neighbour = semantic_cache.query(vector=vector, exclude=email_hash)
+            metrics.increment("cache_lookups_total", kind="semantic", outcome="miss" if neighbour is None else "hit")
+            if neighbour is not None and f'"{neighbour["request_type"]}"' in (request_type_defs or ""):
+                print(f"Semantic cache hit: classified like email {neighbour['email_hash']} "
+                      f"(similarity {neighbour['similarity']:.2f})")
+                context["result"] = merge_extracted_fields(_semantic_result(neighbour, text, extraction_fields), rule_fields)
+                filled = extracted_fields_of(context["result"])
+                context["extract_fields"] = [field for field in context["missing_fields"] if filled.get(field) is None]
+                meta.update(source="semantic-cache", matched_hash=neighbour["email_hash"],
+                            similarity=round(neighbour["similarity"], 4))
+                return context
 
-    return response 
+        # Routine notices: the local pre-classifier answers without the LLM when it is confident.
+        local = preclassify(prepared["email_text"], prepared["attachment_text"], request_type_defs)
+        if local is not None:
+            context["result"] = merge_extracted_fields(build_local_result(*local, extraction_fields), rule_fields)
+            # Only the classification is local: the fields the rules missed are extracted by a smaller LLM call.
+            context["extract_fields"] = context["missing_fields"]
+            meta["source"] = "local-classifier"
+        return context
+
+def _semantic_result(neighbour: dict, text: str, extraction_fields: list) -> dict:
+    """
+    Result for a semantic cache hit: the neighbour's classification and, of its
+    extracted fields, only values that also appear in this email (rule extracted
+    fields are merged on top by the caller).
+    """
+    result = build_local_result(neighbour["request_type"], neighbour["sub_type"], neighbour["confidence"] or 0.0,
+                                extraction_fields)
+    details = result["request type"]["Request Type"][0][neighbour["request_type"]]
+    details["Reason"] = (f"Same classification as email {neighbour['email_hash']} "
+                         f"(semantic similarity {neighbour['similarity']:.2f}).")
+    lowered = text.lower()
+    fields = result["extracted_fields"]
+    for field, value in neighbour["extracted_fields"].items():
+        if field in fields and isinstance(value, str) and value.strip() and value.strip().lower() in lowered:
+            fields[field] = value
+    return result
+
+def _finish_processing(context: dict, llm_text: str = None, prompt_stats: dict = None) -> dict:
+    """
+    Merge the LLM answer (if any) with the rule fields, then persist, cache and index.
+    For a semantic cache or pre-classifier hit the fields still missing are extracted here first.
+    """
+    prepared = context["prepared"]
+    email_hash = prepared["hash"]
+    meta = context["meta"]
+    result = context["result"]
+    if llm_text is None and context.get("extract_fields"):
+        extraction_stats = {}
+        output = call_llm_for_extraction(prepared["email_text"], prepared["attachment_text"],
+                                         context["extract_fields"], prompt_stats=extraction_stats)
+        metrics.increment("llm_response_tokens_total", count_tokens(output.text))
+        extracted = extracted_fields_of(parse_llm_json(output.text or "") or {})
+        merge_extracted_fields(result, {field: extracted[field] for field in context["extract_fields"]
+                                        if extracted.get(field) is not None})
+        meta["prompt"] = extraction_stats
+    if llm_text is not None:
+        metrics.increment("llm_response_tokens_total", count_tokens(llm_text))
+        # JSON mode should give a bare object; the tolerant parser also copes with
+        # fences, trailing remarks and truncation so those do not cost another call.
+        result = parse_llm_json(llm_text)
+        if result is None:
+            print("LLM output could not be parsed as JSON; storing the raw text")
+            result = {"raw_output": llm_text, "parse_error": True}
+        elif context["rule_fields"]:
+            merge_extracted_fields(result, context["rule_fields"])
+        meta["source"] = "llm"
+        meta["prompt"] = prompt_stats or {}
+        # Kept so the pre-classifier can be retrained from past results.
+        meta["email_text"] = prepared["email_text"][:4000]
+
+    metrics.increment("emails_total", source=meta.get("source", "llm"))
+    # Stored first: a failing cache or index must not lose the result.
+    _save_result(email_hash, result, context["duplicate_info"], meta=meta)
+    if not result.get("parse_error"):
+        # Unparseable answers are not reused, so the next copy gets another try.
+        with metrics.span("index"):
+            try:
+                get_result_cache().put(context["cache_key"], json.dumps(result), email_hash)
+                get_near_duplicate_index().add(email_hash, signature=context["signature"])
+                request_type, sub_type, confidence = classification_of(result)
+                semantic_cache = get_semantic_cache()
+                # Only LLM answers are indexed, so a reused classification is never reused again in turn.
+                if meta.get("source") == "llm" and request_type and semantic_cache is not None:
+                    semantic_cache.add(email_hash, (request_type, sub_type, confidence, extracted_fields_of(result)),
+                                       text=prepared["email_text"] + "\n" + prepared["attachment_text"],
+                                       vector=context.get("vector"))
+            except Exception as e:
+                print(f"Indexing email {email_hash} failed (its result is stored): {type(e).__name__}: {e}")
+    return {"hash": email_hash, "result": result, "duplicate_info": context["duplicate_info"]}
+
+# LLM stage: I/O bound, safe to run from concurrent threads.
+def process_prepared_email(prepared: dict, request_type_defs: str, extraction_fields: list, rules: str = DEFAULT_RULES) -> dict:
+    """
+    Run duplicate detection, the LLM call and persistence for an email that went
+    through prepare_email.
+    Returns {"hash", "result", "duplicate_info"} where result is the parsed result
+    dictionary (the stored one when the same content was already classified).
+    """
+    context = _begin_processing(prepared, request_type_defs, extraction_fields, rules)
+    if "outcome" in context:
+        return context["outcome"]
+    if context["result"] is not None:
+        return _finish_processing(context)
+
+    # Call the LLM to process and interpret the content.
+    prompt_stats = {}
+    output = call_llm_for_processing(email_text=prepared["email_text"] , attachment_text=prepared["attachment_text"], rules=rules, request_type_defs=request_type_defs, extraction_fields=context["missing_fields"], prompt_stats=prompt_stats)
+    return _finish_processing(context, output.text, prompt_stats)
+
+def process_prepared_emails(prepared_emails: list, request_type_defs: str, extraction_fields: list,
+                            rules: str = DEFAULT_RULES, batch_size: int = 8, batch_stats: list = None) -> list:
+    """
+    Like process_prepared_email for several emails, packing up to `batch_size` of the
+    emails that need the LLM into each call (see call_llm_for_batch).
+    Returns one result dictionary per input email, in input order.
+    """
+    contexts = [_begin_processing(prepared, request_type_defs, extraction_fields, rules) for prepared in prepared_emails]
+    needs_llm = [context for context in contexts if "outcome" not in context and context["result"] is None]
+
+    llm_texts = {}
+    for start in range(0, len(needs_llm), max(1, batch_size)):
+        batch = needs_llm[start:start + max(1, batch_size)]
+        llm_texts.update(call_llm_for_batch(
+            [{"id": context["prepared"]["hash"],
+              "email_text": context["prepared"]["email_text"],
+              "attachment_text": context["prepared"]["attachment_text"],
+              "extraction_fields": context["missing_fields"]} for context in batch],
+            rules, request_type_defs, batch_stats=batch_stats))
+
+    outcomes = []
+    for context in contexts:
+        if "outcome" in context:
+            outcomes.append(context["outcome"])
+        elif context["result"] is not None:
+            outcomes.append(_finish_processing(context))
+        else:
+            text, prompt_stats = llm_texts[context["prepared"]["hash"]]
+            outcomes.append(_finish_processing(context, text, prompt_stats))
+    return outcomes
 
 # ------------------------------------------------------------------------------
 # Main processing function which ties everything together.
-def process_email_with_llm(raw_email: bytes , request_type_defs: str,extraction_fields : list, rules:str ="Use email content section only to get the key extracted fields and attachment content section to identify the request types."  ) -> dict:
+def process_email_with_llm(raw_email , request_type_defs: str,extraction_fields : list, rules:str =DEFAULT_RULES  ) -> dict:
     """
     Process a raw email by:
       1. Parsing the email and attachments.
-      2. Checking for duplicates.
+      2. Checking for duplicates (exact re-sends are answered from the result cache
+         before any OCR; identical content + prompt configuration after it;
+         near-duplicates such as forwards through the MinHash index).
       3. Combining email body and attachment texts (based on user-defined priority).
       4. Calling the LLM (e.g., Google Gemini) to obtain request type classification,
          extracted fields, and duplicate detection details.
-    Returns a dictionary with metadata and the LLM output.
+    `raw_email` can be any bytes-like object (bytes, bytearray, memoryview).
+    Returns the result dictionary (see response_parser.py for its shape).
+    Each stage is timed as a span of one "email" trace (see metrics.py); with
+    PROFILE_DIR set, a profile of the whole call is written per email.
     """
-    processor = EmailProcessor(raw_email)
-    processor.parse_email()
-    
-    email_hash = processor.get_email_hash()
-    if email_hash in PROCESSED_EMAIL_HASHES:
-        print("Email already present" )
-        duplicate_info = {"flag": True, "reason": f"Duplicate email detected based on hash: {email_hash}"}
-        print("Duplicate email detected") 
-        return
-    else:
-        PROCESSED_EMAIL_HASHES.add(email_hash)
-        duplicate_info = {"flag": False, "reason": "Unique email hash"}
-    
-    attachment_texts = ""
-    for filename, content in processor.attachments:
-        attachment_texts += f"\n--- Text from {filename} ---\n"
-        attachment_texts += processor.extract_text_from_attachment(filename, content)
-    
-         
-         
-    # Combine email body and attachment texts based on the defined priority.
-    email_text = processor.get_email_content() 
-    output = call_llm_for_processing(email_text=email_text , attachment_text=attachment_texts, rules=rules, request_type_defs=request_type_defs, extraction_fields=extraction_fields)
-    # Call the LLM to process and interpret the content.
-    df = pd.read_csv(r"C:\Users\HP\hackathon\gaied-codebenders\code\src\service_requests.csv" )
-    df.loc[len(df)] = [email_hash , output.text , duplicate_info["flag"]]
-    # df = df.append({"256RSAHash" : email_hash , "Info" : output , "Is duplicate" : duplicate_info["flag"] }, ignore_index=True)
-    df.to_csv(r"C:\Users\HP\hackathon\gaied-codebenders\code\src\service_requests.csv" , index=False)
-    return output.text
+    with metrics.profiled() as profile, metrics.span("email") as attributes:
+        processor = EmailProcessor(raw_email)
+        try:
+            processor.parse_email()
+            email_hash = profile["name"] = attributes["hash"] = processor.get_email_hash()
+
+            outcome = _answer_exact_duplicate(email_hash)
+            if outcome is not None:
+                return outcome["result"]
+
+            prepared = _prepared_from_processor(processor)
+        finally:
+            processor.close()
+        return process_prepared_email(prepared, request_type_defs, extraction_fields, rules)["result"]
+
+def _answer_exact_duplicate(email_hash: str):
+    """
+    Outcome ({"hash", "result", "duplicate_info"}) for an email whose raw bytes were
+    processed before, saved as a duplicate; None for a new email.
+    """
+    cached = _lookup_exact_duplicate(email_hash)
+    if cached is None:
+        return None
+    return _exact_duplicate_outcome(email_hash, cached)
+
+def _lookup_exact_duplicate(email_hash: str):
+    with metrics.span("dedup"):
+        cached = get_result_cache().get_by_email_hash(email_hash)
+    metrics.increment("cache_lookups_total", kind="email_hash", outcome="miss" if cached is None else "hit")
+    return cached
+
+def _exact_duplicate_outcome(email_hash: str, cached: str) -> dict:
+    print("Email already present" )
+    metrics.increment("duplicates_total", kind="exact")
+    metrics.increment("emails_total", source="duplicate")
+    duplicate_info = {"flag": True, "reason": f"Duplicate email detected based on hash: {email_hash}"}
+    result = load_result(cached)
+    _save_result(email_hash, result, duplicate_info)
+    return {"hash": email_hash, "result": result, "duplicate_info": duplicate_info}
+
+# ------------------------------------------------------------------------------
+# Streaming variant for interactive use: partial results while the LLM answers.
+def process_email_streaming(raw_email, request_type_defs: str, extraction_fields: list, rules: str = DEFAULT_RULES):
+    """
+    Like process_email_with_llm, but yields progress events while the LLM response
+    streams in:
+        {"done": False, "partial": <result parsed so far>, "first_token_seconds", "elapsed_seconds"}
+    and finally {"done": True, "result": <result dictionary>, "hash", "duplicate_info", ...}. Times are measured
+    from the call; first_token_seconds is None until the first LLM chunk arrives.
+    Rule extracted fields are sent before the LLM call; results that need no classification
+    call (duplicates, semantic cache and local pre-classifier hits) are yielded once finished.
+    """
+    started = time.perf_counter()
+    timings = {"first_token_seconds": None}
+
+    def event(**values):
+        return dict(values, first_token_seconds=timings["first_token_seconds"],
+                    elapsed_seconds=round(time.perf_counter() - started, 3))
+
+    def finished(outcome):
+        return event(done=True, result=outcome["result"], hash=outcome["hash"], duplicate_info=outcome["duplicate_info"])
+
+    with metrics.span("email") as attributes:
+        processor = EmailProcessor(raw_email)
+        try:
+            processor.parse_email()
+            email_hash = attributes["hash"] = processor.get_email_hash()
+            outcome = _answer_exact_duplicate(email_hash)
+            prepared = _prepared_from_processor(processor) if outcome is None else None
+        finally:
+            processor.close()
+        if outcome is not None:
+            yield finished(outcome)
+            return
+
+        context = _begin_processing(prepared, request_type_defs, extraction_fields, rules)
+        if "outcome" in context:
+            yield finished(context["outcome"])
+            return
+        if context["result"] is not None:
+            yield finished(_finish_processing(context))
+            return
+
+        rule_fields = context["rule_fields"]
+        yield event(done=False, partial=merge_extracted_fields({}, rule_fields))
+        prompt_stats = {}
+        parser = IncrementalJSONParser()
+        chunks = call_llm_for_processing(email_text=prepared["email_text"], attachment_text=prepared["attachment_text"], rules=rules, request_type_defs=request_type_defs, extraction_fields=context["missing_fields"], prompt_stats=prompt_stats, stream=True)
+        with metrics.span("llm", emails=1, stream=True) as llm_attributes:
+            for chunk in chunks:
+                if timings["first_token_seconds"] is None:
+                    timings["first_token_seconds"] = llm_attributes["first_token_seconds"] = round(time.perf_counter() - started, 3)
+                partial = parser.feed(chunk)
+                if partial is not None:
+                    yield event(done=False, partial=merge_extracted_fields(normalize_result(partial), rule_fields))
+        yield finished(_finish_processing(context, parser.buffer, prompt_stats))
 
 
 '''
@@ -199,49 +746,33 @@ extraction_fields - list of fields to be extracted from the email ,
 rules - rules to be applied for the extraction of the fields. 
 '''
 
-def run(email_path , request_type_defs, extraction_fields, rules):
+def _with_defaults(request_type_defs, extraction_fields, rules):
 
     if not rules : 
-        rules = "Use email content section only to get the key extracted fields and attachment content section to identify the request types. "
+        rules = DEFAULT_RULES
 
     if not extraction_fields :
-        extraction_fields= [ "date" , "effective date" , "source bank" , "Transactor" , "Amount" , "Expiration Date" , "deal name" ]
+        extraction_fields= DEFAULT_EXTRACTION_FIELDS
 
     if not request_type_defs : 
-        request_type_defs = """
-            "Adjustment":{
-            "Description" : "interest adjustments and loan modifications" , 
-            "Sub request types" : []
-            },
-            "Closing Notice" : {
-            "Description" : "Completion or closing of loan" , 
-            "Sub request types" : [''Reallocation Fees' ,'Amendment Fees' , ''Reallocation Principal']
-            },
-            "Commitment Change" : {
-            "Description" : "Change of loan commitment" , 
-            "Sub request types" : ['Cashless Roll' , 'Decrease' , 'Increase']
-            },
-            "Fee Payment" : {
-            "Description" : "Adjusting money between accounts by an entity" , 
-            "Sub request types" : ['Ongoing Fee' , 'Letter of Credit Fee']
-            },
-            "Money-Movement-inbound" : {
-            "Description" : "Wells Fargo Bank receiving money" , 
-            "Sub request types" : ['Principal' , 'Interest' , 'Principal + Interest' , 'Principal + Interest + Fee']
-            },
-            "Money-Movement-outbound" : {
-            "Description" : "Wells Fargo bank transferring money to outside entity " , 
-            "Sub request types" : ['Timebound' , 'Foreign currency']
-            }"""
-
-    # Attempt to load an email from a file; if not found, use simulated content.
+        request_type_defs = DEFAULT_REQUEST_TYPE_DEFS
+
+    return request_type_defs, extraction_fields, rules
+
+def _open_email(email_path):
+    # Opened rather than read: EmailProcessor reads large emails in chunks (see mime_stream.py).
     try:
-        with open(fr"{email_path}", "rb") as f:
-            raw_email = f.read()
+        return open(fr"{email_path}", "rb")
     except Exception as e :  
         print(f"Error loading email file: {e}")
+        return None
+
+def run(email_path , request_type_defs, extraction_fields, rules):
+    request_type_defs, extraction_fields, rules = _with_defaults(request_type_defs, extraction_fields, rules)
+    email_file = _open_email(email_path)
+    if email_file is None:
         return 
     
-    result = process_email_with_llm(raw_email,  request_type_defs, extraction_fields, rules)
+    with email_file:
+        result = process_email_with_llm(email_file,  request_type_defs, extraction_fields, rules)
     return json.dumps(result, indent=4)
-
@@ -0,0 +1,35 @@
+"""
+Default prompt configuration: the rules, the extraction fields and the request type
+definitions used when a caller does not pass its own. Kept free of imports so tools
+that only need the field list (e.g. parquet_export.py) do not load the pipeline.
+"""
+
+DEFAULT_RULES = "Use email content section only to get the key extracted fields and attachment content section to identify the request types. "
+
+DEFAULT_EXTRACTION_FIELDS = [ "date" , "effective date" , "source bank" , "Transactor" , "Amount" , "Expiration Date" , "deal name" ]
+
+DEFAULT_REQUEST_TYPE_DEFS = """
+            "Adjustment":{
+            "Description" : "interest adjustments and loan modifications" , 
+            "Sub request types" : []
+            },
+            "Closing Notice" : {
+            "Description" : "Completion or closing of loan" , 
+            "Sub request types" : [''Reallocation Fees' ,'Amendment Fees' , ''Reallocation Principal']
+            },
+            "Commitment Change" : {
+            "Description" : "Change of loan commitment" , 
+            "Sub request types" : ['Cashless Roll' , 'Decrease' , 'Increase']
+            },
+            "Fee Payment" : {
+            "Description" : "Adjusting money between accounts by an entity" , 
+            "Sub request types" : ['Ongoing Fee' , 'Letter of Credit Fee']
+            },
+            "Money-Movement-inbound" : {
+            "Description" : "Wells Fargo Bank receiving money" , 
+            "Sub request types" : ['Principal' , 'Interest' , 'Principal + Interest' , 'Principal + Interest + Fee']
+            },
+            "Money-Movement-outbound" : {
+            "Description" : "Wells Fargo bank transferring money to outside entity " , 
+            "Sub request types" : ['Timebound' , 'Foreign currency']
+            }"""
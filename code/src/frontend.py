@@ -1,15 +1,41 @@
 import streamlit as st
 import requests
 import pandas as pd
-import pytesseract
-from pdf2image import convert_from_bytes
-from io import BytesIO
-from PIL import Image
-from createEmail import run
+from results_store import get_store as get_results_store
+from response_parser import classification_of, extracted_fields_of, load_result
 import os
+import re
+import time
 import json 
-# Backend API URL
-API_URL = "http://localhost:8000"
+# Backend API URL (start it with: uvicorn api:app --port 8000)
+API_URL = os.getenv("API_URL", "http://localhost:8000")
+
+def _field_list(text: str) -> list:
+    # The text area holds a quoted, comma separated list: "date" , "effective date" , ...
+    fields = [a or b for a, b in re.findall(r'"([^"]+)"|\'([^\']+)\'', text)]
+    return fields or [field.strip() for field in text.split(",") if field.strip()]
+
+# Dashboard data: cached per store version (changes when a result is added) and filters.
+@st.cache_data(show_spinner=False, max_entries=8)
+def _load_choices(version):
+    return get_results_store().choices()
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def _load_summary(version, filters):
+    return get_results_store().summary(filters)
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def _load_page(version, filters, page, page_size):
+    records = get_results_store().query(filters, offset=page * page_size, limit=page_size)
+    return pd.DataFrame({
+        "Processed at": pd.to_datetime([record["created_at"] for record in records], unit="s"),
+        "Request type": [record["request_type"] for record in records],
+        "Sub type": [record["sub_type"] for record in records],
+        "Confidence": [record["confidence"] for record in records],
+        "Is duplicate": [record["is_duplicate"] for record in records],
+        "Extracted fields": [json.dumps(extracted_fields_of(load_result(record["info"]))) for record in records],
+        "256RSAHash": [record["hash"] for record in records],
+    })
 
 # Sidebar Navigation
 st.sidebar.title("📧 AI Email & Document Processor")
@@ -54,35 +80,58 @@ if page == "📧 Email & OCR Processing":
 
     if st.button("🔍 Process Email & OCR"):
         if uploaded_email and rules and request_type_defs and extraction_fields:
-            # Save the uploaded file to a temporary location
-            temp_dir = "temp_uploads"
-            os.makedirs(temp_dir, exist_ok=True)  # Create the directory if it doesn't exist
-            file_path = os.path.join(temp_dir, uploaded_email.name)
-
-            with open(file_path, "wb") as f:
-                f.write(uploaded_email.getbuffer())  # Write the file content to the local file
+            # Processing runs in the API service (api.py); the page only submits the job and
+            # follows its events, so OCR / LLM work never blocks a Streamlit rerun.
+            try:
+                response = requests.post(
+                    f"{API_URL}/jobs",
+                    files={"files": (uploaded_email.name, uploaded_email.getvalue(), "message/rfc822")},
+                    data={"rules": rules, "request_type_defs": request_type_defs,
+                          "extraction_fields": json.dumps(_field_list(extraction_fields))},
+                    timeout=30,
+                )
+                response.raise_for_status()
+            except requests.RequestException as e:
+                st.error(f"❌ Could not submit the email to the processing service at {API_URL}: {e}")
+                st.stop()
+            job_id = response.json()["job_id"]
+            st.success(f"Queued as job {job_id}")
 
-            st.success(f"File saved to: {file_path}")
-           
-
-            # Show a loading spinner while processing
+            # Render the result while the model output streams in: extracted fields and the
+            # primary request type appear as soon as they can be parsed from the partial output.
+            timing_box = st.empty()
+            type_box = st.empty()
+            fields_box = st.empty()
+            item = None
+            started = time.perf_counter()
             with st.spinner("🔄 Processing the email and generating output..."):
-                output = run(file_path, request_type_defs, extraction_fields, rules)
-                start_index = output.find("{")
-                end_index = output.rfind("}") + 1
-                json_content = output[start_index:end_index]
-                st.write(json_content)
-                # print(json_content)
-                # Parse the JSON content
-                try:
-                    parsed_data = json.loads(json_content)
-                    # st.write(parsed_data)
-                    # st.write(output[end_index : ])
-                except json.JSONDecodeError as e:
-                    print(f"Error parsing JSON: {e}")
-                
-
-            st.success("✅ Processing complete!")
+                with requests.get(f"{API_URL}/jobs/{job_id}/events", stream=True, timeout=600) as events:
+                    for line in events.iter_lines(decode_unicode=True):
+                        if not line or not line.startswith("data: "):
+                            continue
+                        item = json.loads(line[len("data: "):])["items"][0]
+                        current = item["result"] or item["partial"] or {}
+                        primary, sub_type, confidence = classification_of(current)
+                        if primary:
+                            type_box.markdown(f"**Primary request type:** {primary}"
+                                              + (f" / {sub_type}" if sub_type else "")
+                                              + (f" (confidence {confidence:.2f})" if confidence is not None else ""))
+                        fields = extracted_fields_of(current)
+                        if fields:
+                            fields_box.table(pd.DataFrame({"Field": list(fields), "Value": [str(v) for v in fields.values()]}))
+                        first_token = item["first_token_seconds"]
+                        done = item["status"] in ("done", "error")
+                        elapsed = item["seconds"] if done and item["seconds"] is not None else time.perf_counter() - started
+                        timing_box.caption(f"⏱️ Time to first token: {f'{first_token:.2f}s' if first_token is not None else '-'}"
+                                           f" · {'Total' if done else 'Elapsed'}: {elapsed:.2f}s")
+            # The last event is the terminal one: only a finished item with a result is a success.
+            if item is not None and item["status"] == "done" and item["result"] is not None:
+                st.json(item["result"])
+                st.success("✅ Processing complete!")
+            elif item is None:
+                st.error("❌ Processing failed: no response from the service")
+            else:
+                st.error(f"❌ Processing failed: {item['error'] or 'the service stopped sending updates'}")
         else:
             st.toast(" Please upload an email file (.EML)", icon="❌")
 
@@ -92,8 +141,44 @@ if page == "📧 Email & OCR Processing":
 elif page == "📊 Service Requests":
     st.title("📊 AI-Powered Service Request Dashboard")
     try: 
-        df = pd.read_csv(r"C:\Users\HP\hackathon\gaied-codebenders\code\src\service_requests.csv")
-        
-        st.dataframe(df)
+        store = get_results_store()
+        version = store.version()
+        choices = _load_choices(version)
+
+        # Filters are applied by the store (indexed columns), only the current page is loaded.
+        filter_columns = st.columns(4)
+        request_type = filter_columns[0].selectbox("Request type", ["All"] + list(choices))
+        sub_type = filter_columns[1].selectbox("Sub type", ["All"] + choices.get(request_type, []),
+                                               disabled=request_type == "All")
+        duplicate = filter_columns[2].selectbox("Duplicates", ["All", "Unique only", "Duplicates only"])
+        dates = filter_columns[3].date_input("Processed between", value=())
+        confidence = st.slider("Confidence", 0.0, 1.0, (0.0, 1.0), step=0.05)
+
+        filters = {
+            "request_type": None if request_type == "All" else request_type,
+            "sub_type": None if request_type == "All" or sub_type == "All" else sub_type,
+            "is_duplicate": {"All": None, "Unique only": False, "Duplicates only": True}[duplicate],
+            # The full range also keeps results without a confidence score.
+            "min_confidence": confidence[0] if confidence != (0.0, 1.0) else None,
+            "max_confidence": confidence[1] if confidence != (0.0, 1.0) else None,
+        }
+        if len(dates) == 2:
+            filters["since"] = time.mktime(dates[0].timetuple())
+            filters["until"] = time.mktime(dates[1].timetuple()) + 24 * 3600
+
+        summary = _load_summary(version, filters)
+        metric_columns = st.columns(3)
+        metric_columns[0].metric("Service requests", f"{summary['total']:,}")
+        metric_columns[1].metric("Duplicates", f"{summary['duplicates']:,}")
+        metric_columns[2].metric("Request types", len([entry for entry in summary["by_request_type"] if entry["request_type"]]))
+        if summary["by_request_type"]:
+            counts = pd.DataFrame(summary["by_request_type"]).fillna({"request_type": "(unclassified)"})
+            st.bar_chart(counts.set_index("request_type")["count"])
+
+        page_size = st.selectbox("Rows per page", [25, 50, 100, 250], index=1)
+        pages = max(1, -(-summary["total"] // page_size))
+        page_number = st.number_input(f"Page (of {pages:,})", min_value=1, max_value=pages, value=1, step=1)
+        df = _load_page(version, filters, int(page_number) - 1, page_size)
+        st.dataframe(df, use_container_width=True)
     except Exception as e :
-        st.error(f"❌ Failed to fetch service requests. {e}" )
\ No newline at end of file
+        st.error(f"❌ Failed to fetch service requests. {e}" )
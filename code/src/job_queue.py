@@ -0,0 +1,306 @@
+"""
+SQLite backed job queue for the API service (see api.py).
+
+A job is one upload (a single .eml, several .eml files or an mbox), split into
+one item per email. Jobs and items are stored in SQLite so status and results
+survive a restart; a bounded pool of worker threads claims queued items in
+submission order and runs them through createEmail.process_email_streaming.
+While the LLM answer streams in, the partial result of a running item is kept
+in its row so clients polling the job see fields as they appear.
+
+Uploaded emails are held in memory and handed to the pipeline as memoryviews.
+Writing them to disk is optional: with JOB_UPLOAD_DIR set, each email is stored
+once under its SHA-256 (the same email uploaded twice is written once), and
+items queued or running when the process stopped are resumed from there on
+start; without it, such items fail with an error. An upload leaves memory when a
+worker takes its item, or once it has waited JOB_UPLOAD_TTL_SECONDS (its item then
+fails unless it was written to JOB_UPLOAD_DIR).
+
+Configuration (environment variables):
+    JOB_QUEUE_PATH, JOB_WORKERS (default 4), JOB_UPLOAD_DIR (default: uploads are not written),
+    JOB_UPLOAD_TTL_SECONDS (default 3600)
+"""
+import hashlib
+import json
+import mailbox
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+
+from createEmail import (DEFAULT_EXTRACTION_FIELDS, DEFAULT_REQUEST_TYPE_DEFS, DEFAULT_RULES,
+                         process_email_streaming)
+
+DEFAULT_QUEUE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "jobs.sqlite3")
+
+QUEUED, RUNNING, DONE, ERROR = "queued", "running", "done", "error"
+
+
+def split_upload(filename: str, content: bytes) -> list:
+    """[(name, raw email bytes), ...] for an uploaded .eml file or mbox."""
+    if (filename or "").lower().endswith(".eml"):
+        return [(filename, content)]
+    # mailbox.mbox only reads from a path.
+    handle, path = tempfile.mkstemp(suffix=".mbox")
+    try:
+        with os.fdopen(handle, "wb") as f:
+            f.write(content)
+        box = mailbox.mbox(path, create=False)
+        try:
+            return [(f"{filename}#{key}", box.get_bytes(key)) for key in box.iterkeys()]
+        finally:
+            box.close()
+    finally:
+        os.remove(path)
+
+
+class JobQueue:
+
+    def __init__(self, path: str = DEFAULT_QUEUE_PATH, workers: int = 4, upload_dir: str = None,
+                 upload_ttl: float = 3600):
+        self.path = path
+        self.workers = workers
+        self.upload_dir = upload_dir
+        self.upload_ttl = upload_ttl
+        # item id -> (memoryview of the uploaded email, time queued), until a worker takes it or it expires
+        self._uploads = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._threads = []
+        self._closed = False
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                created_at REAL NOT NULL,
+                request_type_defs TEXT,
+                extraction_fields TEXT,
+                rules TEXT
+            );
+            CREATE TABLE IF NOT EXISTS job_items (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                job_id TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                name TEXT,
+                upload TEXT,
+                status TEXT NOT NULL,
+                hash TEXT,
+                partial TEXT,
+                result TEXT,
+                duplicate INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                first_token_seconds REAL,
+                seconds REAL,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS job_items_job ON job_items (job_id, position);
+            CREATE INDEX IF NOT EXISTS job_items_status ON job_items (status, id);
+        """)
+        # Work interrupted by a restart starts over.
+        self._conn.execute("UPDATE job_items SET status = ?, partial = NULL WHERE status = ?", (QUEUED, RUNNING))
+        self._conn.commit()
+
+    # -- submitting -----------------------------------------------------------
+    def submit(self, emails: list, request_type_defs: str = None, extraction_fields: list = None,
+               rules: str = None) -> str:
+        """Queue `emails` ([(name, bytes-like), ...]) as one job; returns the job id."""
+        if not emails:
+            raise ValueError("A job needs at least one email")
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        uploads = []
+        for name, raw in emails:
+            view = memoryview(raw)
+            digest = hashlib.sha256(view).hexdigest()
+            if self.upload_dir:
+                self._write_upload(digest, view)
+            uploads.append((name, digest, view))
+        with self._lock:
+            self._evict_expired_uploads(now)
+            self._conn.execute(
+                "INSERT INTO jobs (id, created_at, request_type_defs, extraction_fields, rules) VALUES (?, ?, ?, ?, ?)",
+                (job_id, now, request_type_defs, json.dumps(extraction_fields) if extraction_fields else None, rules))
+            for position, (name, digest, view) in enumerate(uploads):
+                cursor = self._conn.execute(
+                    "INSERT INTO job_items (job_id, position, name, upload, status, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    (job_id, position, name, digest, QUEUED, now))
+                self._uploads[cursor.lastrowid] = (view, now)
+            self._conn.commit()
+            self._wakeup.notify_all()
+        return job_id
+
+    def _upload_path(self, digest: str) -> str:
+        return os.path.join(self.upload_dir, digest[:2], f"{digest}.eml")
+
+    def _write_upload(self, digest: str, content: memoryview):
+        path = self._upload_path(digest)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(partial, "wb") as f:
+            f.write(content)
+        os.replace(partial, path)
+
+    def _evict_expired_uploads(self, now: float):
+        # Called with the lock held. Without a copy on disk the expired items cannot run any more.
+        expired = [item_id for item_id, (_, queued_at) in self._uploads.items() if now - queued_at > self.upload_ttl]
+        for item_id in expired:
+            del self._uploads[item_id]
+        if expired and not self.upload_dir:
+            self._conn.executemany(
+                "UPDATE job_items SET status = ?, error = ?, updated_at = ? WHERE id = ? AND status = ?",
+                [(ERROR, f"Upload expired after waiting {self.upload_ttl:.0f}s for a worker", now, item_id, QUEUED)
+                 for item_id in expired])
+            self._conn.commit()
+
+    def _read_upload(self, item_id: int, digest: str):
+        with self._lock:
+            view, _ = self._uploads.pop(item_id, (None, None))
+        if view is None and self.upload_dir and digest and os.path.exists(self._upload_path(digest)):
+            with open(self._upload_path(digest), "rb") as f:
+                view = memoryview(f.read())
+        return view
+
+    # -- reading ----------------------------------------------------------------
+    def status(self, job_id: str):
+        """{"id", "status", "created_at", "total", "queued", "running", "done", "errors", "updated_at"} or None."""
+        with self._lock:
+            job = self._conn.execute("SELECT id, created_at FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if job is None:
+                return None
+            counts = dict(self._conn.execute(
+                "SELECT status, COUNT(*) FROM job_items WHERE job_id = ? GROUP BY status", (job_id,)).fetchall())
+            updated_at = self._conn.execute("SELECT MAX(updated_at) FROM job_items WHERE job_id = ?",
+                                            (job_id,)).fetchone()[0]
+        total = sum(counts.values())
+        finished = counts.get(DONE, 0) + counts.get(ERROR, 0)
+        if finished == total:
+            state = DONE
+        elif counts.get(QUEUED, 0) == total:
+            state = QUEUED
+        else:
+            state = RUNNING
+        return {
+            "id": job["id"],
+            "status": state,
+            "created_at": job["created_at"],
+            "total": total,
+            "queued": counts.get(QUEUED, 0),
+            "running": counts.get(RUNNING, 0),
+            "done": counts.get(DONE, 0),
+            "errors": counts.get(ERROR, 0),
+            "updated_at": updated_at,
+        }
+
+    def items(self, job_id: str) -> list:
+        """Per-email state of a job in upload order; `result` / `partial` are result dictionaries."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT position, name, status, hash, partial, result, duplicate, error, first_token_seconds, seconds "
+                "FROM job_items WHERE job_id = ? ORDER BY position", (job_id,)).fetchall()
+        return [{
+            "position": row["position"],
+            "name": row["name"],
+            "status": row["status"],
+            "hash": row["hash"],
+            "partial": json.loads(row["partial"]) if row["partial"] else None,
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "duplicate": bool(row["duplicate"]),
+            "error": row["error"],
+            "first_token_seconds": row["first_token_seconds"],
+            "seconds": row["seconds"],
+        } for row in rows]
+
+    # -- workers ----------------------------------------------------------------
+    def start(self):
+        with self._lock:
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work, name=f"job-worker-{len(self._threads)}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join()
+        with self._lock:
+            self._conn.close()
+
+    def _claim(self):
+        """Next queued item as (item id, job row, name, upload digest), waiting for one; None once closed."""
+        with self._lock:
+            while not self._closed:
+                self._evict_expired_uploads(time.time())
+                row = self._conn.execute("SELECT id, job_id, name, upload FROM job_items WHERE status = ? "
+                                         "ORDER BY id LIMIT 1", (QUEUED,)).fetchone()
+                if row is not None:
+                    self._conn.execute("UPDATE job_items SET status = ?, updated_at = ? WHERE id = ?",
+                                       (RUNNING, time.time(), row["id"]))
+                    self._conn.commit()
+                    job = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (row["job_id"],)).fetchone()
+                    return row["id"], job, row["name"], row["upload"]
+                self._wakeup.wait(self.upload_ttl)
+        return None
+
+    def _update(self, item_id: int, **values):
+        values["updated_at"] = time.time()
+        columns = ", ".join(f"{column} = ?" for column in values)
+        with self._lock:
+            self._conn.execute(f"UPDATE job_items SET {columns} WHERE id = ?", (*values.values(), item_id))
+            self._conn.commit()
+
+    def _work(self):
+        while True:
+            claimed = self._claim()
+            if claimed is None:
+                return
+            item_id, job, name, digest = claimed
+            started = time.perf_counter()
+            raw = self._read_upload(item_id, digest)
+            if raw is None:
+                self._update(item_id, status=ERROR, error="Upload no longer available (queued before a restart "
+                                                          "and JOB_UPLOAD_DIR is not set)")
+                continue
+            try:
+                for event in process_email_streaming(
+                        raw,
+                        job["request_type_defs"] or DEFAULT_REQUEST_TYPE_DEFS,
+                        json.loads(job["extraction_fields"]) if job["extraction_fields"] else DEFAULT_EXTRACTION_FIELDS,
+                        job["rules"] or DEFAULT_RULES):
+                    if event["done"]:
+                        self._update(item_id, status=DONE, partial=None, hash=event["hash"],
+                                     result=json.dumps(event["result"]),
+                                     duplicate=int(event["duplicate_info"]["flag"]),
+                                     first_token_seconds=event["first_token_seconds"],
+                                     seconds=event["elapsed_seconds"])
+                    else:
+                        self._update(item_id, partial=json.dumps(event["partial"]),
+                                     first_token_seconds=event["first_token_seconds"])
+            except Exception as e:
+                print(f"Job {job['id']}: processing {name} failed: {e}")
+                self._update(item_id, status=ERROR, partial=None, error=f"{type(e).__name__}: {e}",
+                             seconds=round(time.perf_counter() - started, 3))
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue() -> JobQueue:
+    """Process-wide queue with its workers started, created on first use."""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue(path=os.getenv("JOB_QUEUE_PATH", DEFAULT_QUEUE_PATH),
+                              workers=int(os.getenv("JOB_WORKERS", "4")),
+                              upload_dir=os.getenv("JOB_UPLOAD_DIR") or None,
+                              upload_ttl=float(os.getenv("JOB_UPLOAD_TTL_SECONDS", "3600")))
+            _queue.start()
+        return _queue
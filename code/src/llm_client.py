@@ -0,0 +1,370 @@
+"""
+Shared LLM client used by createEmail.
+
+The Gemini model is configured once and reused for every request. All requests
+go through a single asyncio event loop (running in a background thread) where:
+  - a semaphore caps the number of in-flight requests,
+  - a token bucket enforces the requests-per-minute quota,
+  - quota / transient errors are retried with exponential backoff and jitter.
+
+Sync callers use LLMClient.generate(), async callers LLMClient.agenerate(); both
+share the same limits. LLMClient.stream() yields the response text chunk by
+chunk as it arrives (a failed request is only retried before the first chunk).
+With JSON mode on (the default) a `response_schema` passed by the caller is sent
+along with response_mime_type="application/json" so the model answers with the
+result object only. For tests or offline runs the Gemini backend can be swapped for FakeBackend with set_client(LLMClient(backend=FakeBackend(...))) or
+by setting LLM_BACKEND=fake.
+
+Clients are kept per model tier: get_client() is the tuned model, and
+get_client(FAST_TIER) a small / fast model with deterministic settings and a
+tight output cap (FAST_GENERATION_CONFIG), used first by the model cascade
+(see model_cascade.py). The fast tier exists only when LLM_FAST_MODEL is set
+(or a client was given with set_client(client, FAST_TIER)); each tier has its
+own concurrency and rate limits.
+
+Configuration (environment variables):
+    GEMINI_API_KEY, GEMINI_MODEL, LLM_BACKEND (gemini | fake),
+    LLM_MAX_CONCURRENCY, LLM_REQUESTS_PER_MINUTE, LLM_MAX_RETRIES,
+    LLM_JSON_MODE (default 1; set to 0 for models without structured output),
+    LLM_FAST_MODEL, LLM_FAST_MAX_OUTPUT_TOKENS (default 1024),
+    LLM_FAST_REQUESTS_PER_MINUTE (default LLM_REQUESTS_PER_MINUTE)
+"""
+import asyncio
+import os
+import queue
+import random
+import threading
+import time
+
+import metrics
+
+DEFAULT_MODEL_NAME = "tunedModels/finetunedgemini25proexp03252-n29d3ndtniu"
+
+DEFAULT_GENERATION_CONFIG = {
+    "temperature": 1,
+    "top_p": 0.95,
+    "top_k": 40,
+    "max_output_tokens": 8192,
+    "response_mime_type": "text/plain",
+}
+
+DEFAULT_TIER = "tuned"
+FAST_TIER = "fast"
+
+FAST_GENERATION_CONFIG = {
+    "temperature": 0,
+    "top_p": 1,
+    "top_k": 1,
+    "max_output_tokens": int(os.getenv("LLM_FAST_MAX_OUTPUT_TOKENS", "1024")),
+    "response_mime_type": "text/plain",
+}
+
+
+_STREAM_END = object()
+
+
+class LLMResponse:
+    """Minimal response object exposing `.text`, like GenerateContentResponse."""
+
+    def __init__(self, text: str):
+        self.text = text
+
+    def __repr__(self):
+        return f"LLMResponse(text={self.text!r})"
+
+
+class QuotaExceededError(Exception):
+    """Raised by backends when the provider rejects a request for quota / rate reasons."""
+
+
+class TokenBucket:
+    """Async token bucket: `rate` tokens per second, bursts up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    async def acquire(self, tokens: float = 1.0):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return
+            await asyncio.sleep((tokens - self.tokens) / self.rate)
+
+
+class GeminiBackend:
+    """Google Gemini backend. The model object is created once and reused."""
+
+    def __init__(self, model_name: str = None, generation_config: dict = None, api_key: str = None):
+        import google.generativeai as genai
+
+        genai.configure(api_key=api_key or os.getenv("GEMINI_API_KEY"))
+        self.generation_config = generation_config or DEFAULT_GENERATION_CONFIG
+        self.model = genai.GenerativeModel(
+            model_name=model_name or os.getenv("GEMINI_MODEL", DEFAULT_MODEL_NAME),
+            generation_config=self.generation_config,
+        )
+
+    def _json_config(self, response_schema: dict) -> dict:
+        return dict(self.generation_config, response_mime_type="application/json", response_schema=response_schema)
+
+    async def generate(self, prompt: str, response_schema: dict = None):
+        if response_schema is None:
+            return await self.model.generate_content_async(prompt)
+        return await self.model.generate_content_async(prompt, generation_config=self._json_config(response_schema))
+
+    async def stream(self, prompt: str, response_schema: dict = None):
+        kwargs = {"stream": True}
+        if response_schema is not None:
+            kwargs["generation_config"] = self._json_config(response_schema)
+        response = await self.model.generate_content_async(prompt, **kwargs)
+        async for chunk in response:
+            try:
+                text = chunk.text
+            except ValueError:
+                # e.g. a final chunk that only carries the finish reason
+                continue
+            if text:
+                yield text
+
+    @staticmethod
+    def is_retryable(exc: Exception) -> bool:
+        try:
+            from google.api_core import exceptions as api_exceptions
+        except ImportError:
+            api_exceptions = None
+        if api_exceptions is not None and isinstance(exc, (api_exceptions.ResourceExhausted,
+                                                           api_exceptions.TooManyRequests,
+                                                           api_exceptions.ServiceUnavailable,
+                                                           api_exceptions.DeadlineExceeded)):
+            return True
+        message = str(exc).lower()
+        return "429" in message or "quota" in message or "rate limit" in message
+
+
+class FakeBackend:
+    """
+    Local stand-in for Gemini.
+    `responder(prompt) -> str` builds the response text (defaults to a fixed text),
+    `latency` simulates the network round trip and the first `failures` calls
+    raise QuotaExceededError to exercise the retry path. The last response schema
+    received is kept in `response_schema`. When streaming, the text is sent in
+    `chunk_size` character chunks `chunk_latency` seconds apart.
+    """
+
+    def __init__(self, response_text: str = "{}", latency: float = 0.0, responder=None, failures: int = 0,
+                 chunk_size: int = 20, chunk_latency: float = 0.0):
+        self.response_text = response_text
+        self.latency = latency
+        self.chunk_size = chunk_size
+        self.chunk_latency = chunk_latency
+        self.responder = responder
+        self.failures = failures
+        self.calls = 0
+        self.response_schema = None
+
+    async def generate(self, prompt: str, response_schema: dict = None):
+        self.calls += 1
+        self.response_schema = response_schema
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.failures > 0:
+            self.failures -= 1
+            raise QuotaExceededError("429 quota exceeded (fake backend)")
+        text = self.responder(prompt) if self.responder else self.response_text
+        return LLMResponse(text)
+
+    async def stream(self, prompt: str, response_schema: dict = None):
+        text = (await self.generate(prompt, response_schema=response_schema)).text
+        for start in range(0, len(text), self.chunk_size):
+            if start and self.chunk_latency:
+                await asyncio.sleep(self.chunk_latency)
+            yield text[start:start + self.chunk_size]
+
+    @staticmethod
+    def is_retryable(exc: Exception) -> bool:
+        return isinstance(exc, QuotaExceededError)
+
+
+class LLMClient:
+    """
+    Bounded-concurrency, rate limited, retrying client around a backend.
+    The backend is created lazily on first use so importing this module is cheap;
+    without one, a GeminiBackend for `model_name` / `generation_config` is created.
+    """
+
+    def __init__(self, backend=None, max_concurrency: int = 8, requests_per_minute: float = 60,
+                 max_retries: int = 5, base_delay: float = 1.0, max_delay: float = 30.0,
+                 json_mode: bool = True, model_name: str = None, generation_config: dict = None):
+        self._backend = backend
+        self.model_name = model_name
+        self.generation_config = generation_config
+        self.max_concurrency = max_concurrency
+        self.requests_per_minute = requests_per_minute
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.json_mode = json_mode
+        self.retries = 0
+        self._lock = threading.Lock()
+        self._loop = None
+        self._semaphore = None
+        self._bucket = None
+
+    @property
+    def backend(self):
+        with self._lock:
+            if self._backend is None:
+                self._backend = GeminiBackend(model_name=self.model_name, generation_config=self.generation_config)
+            return self._backend
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name="llm-client-loop", daemon=True)
+                thread.start()
+                self._loop = loop
+            return self._loop
+
+    def _init_limits(self):
+        # Always called on self._loop, so the primitives belong to that loop.
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            rate = self.requests_per_minute / 60.0
+            self._bucket = TokenBucket(rate=rate, capacity=max(1.0, min(rate * 60.0, self.max_concurrency)))
+
+    async def _backoff(self, attempt: int, error: Exception):
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        delay *= random.uniform(0.5, 1.0)
+        self.retries += 1
+        metrics.increment("llm_retries_total")
+        print(f"LLM request failed ({error}); retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+        await asyncio.sleep(delay)
+
+    async def _generate(self, prompt: str, response_schema: dict = None):
+        self._init_limits()
+        backend = self.backend
+        is_retryable = getattr(backend, "is_retryable", GeminiBackend.is_retryable)
+        if not self.json_mode:
+            response_schema = None
+        async with self._semaphore:
+            attempt = 0
+            while True:
+                await self._bucket.acquire()
+                try:
+                    if response_schema is None:
+                        response = await backend.generate(prompt)
+                    else:
+                        response = await backend.generate(prompt, response_schema=response_schema)
+                    metrics.increment("llm_requests_total", outcome="ok")
+                    return response
+                except Exception as e:
+                    if attempt >= self.max_retries or not is_retryable(e):
+                        metrics.increment("llm_requests_total", outcome="error")
+                        raise
+                    await self._backoff(attempt, e)
+                    attempt += 1
+
+    async def _stream(self, prompt: str, response_schema: dict, chunks: queue.Queue):
+        """Put text chunks on `chunks`, then _STREAM_END (or the exception that ended the stream)."""
+        try:
+            self._init_limits()
+            backend = self.backend
+            if not hasattr(backend, "stream"):
+                response = await self._generate(prompt, response_schema)
+                chunks.put(response.text)
+                chunks.put(_STREAM_END)
+                return
+            is_retryable = getattr(backend, "is_retryable", GeminiBackend.is_retryable)
+            kwargs = {"response_schema": response_schema} if self.json_mode and response_schema is not None else {}
+            async with self._semaphore:
+                attempt = 0
+                while True:
+                    await self._bucket.acquire()
+                    started = False
+                    try:
+                        async for text in backend.stream(prompt, **kwargs):
+                            started = True
+                            chunks.put(text)
+                        metrics.increment("llm_requests_total", outcome="ok")
+                        break
+                    except Exception as e:
+                        # Chunks already handed out cannot be taken back, so only retry before the first one.
+                        if started or attempt >= self.max_retries or not is_retryable(e):
+                            metrics.increment("llm_requests_total", outcome="error")
+                            raise
+                        await self._backoff(attempt, e)
+                        attempt += 1
+            chunks.put(_STREAM_END)
+        except Exception as e:
+            chunks.put(e)
+
+    def generate(self, prompt: str, response_schema: dict = None):
+        """Blocking call, safe to use from any thread."""
+        loop = self._ensure_loop()
+        return asyncio.run_coroutine_threadsafe(self._generate(prompt, response_schema), loop).result()
+
+    def stream(self, prompt: str, response_schema: dict = None):
+        """Blocking generator of response text chunks, as they arrive."""
+        chunks = queue.Queue()
+        asyncio.run_coroutine_threadsafe(self._stream(prompt, response_schema, chunks), self._ensure_loop())
+        while True:
+            item = chunks.get()
+            if item is _STREAM_END:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    async def agenerate(self, prompt: str, response_schema: dict = None):
+        """Awaitable call, usable from any event loop."""
+        loop = self._ensure_loop()
+        future = asyncio.run_coroutine_threadsafe(self._generate(prompt, response_schema), loop)
+        return await asyncio.wrap_future(future)
+
+
+# tier -> LLMClient (None for a tier that is not configured)
+_clients = {}
+_client_lock = threading.Lock()
+
+
+def _client_from_env(tier: str = DEFAULT_TIER):
+    requests_per_minute = os.getenv("LLM_REQUESTS_PER_MINUTE", "60")
+    model_name, generation_config, backend = None, None, None
+    if tier == FAST_TIER:
+        model_name = os.getenv("LLM_FAST_MODEL")
+        if not model_name:
+            return None
+        generation_config = FAST_GENERATION_CONFIG
+        requests_per_minute = os.getenv("LLM_FAST_REQUESTS_PER_MINUTE", requests_per_minute)
+    if os.getenv("LLM_BACKEND", "gemini").lower() == "fake":
+        backend = FakeBackend(latency=float(os.getenv("LLM_FAKE_LATENCY", "0")))
+    return LLMClient(
+        backend=backend,
+        max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "8")),
+        requests_per_minute=float(requests_per_minute),
+        max_retries=int(os.getenv("LLM_MAX_RETRIES", "5")),
+        json_mode=os.getenv("LLM_JSON_MODE", "1") not in ("0", "", "false", "False"),
+        model_name=model_name,
+        generation_config=generation_config,
+    )
+
+
+def get_client(tier: str = DEFAULT_TIER):
+    """Process-wide client of a model tier, created on first use; None when the tier is not configured."""
+    with _client_lock:
+        if tier not in _clients:
+            _clients[tier] = _client_from_env(tier)
+        return _clients[tier]
+
+
+def set_client(client: LLMClient, tier: str = DEFAULT_TIER):
+    """Replace the process-wide client of a tier (e.g. with one wrapping FakeBackend in tests)."""
+    with _client_lock:
+        _clients[tier] = client
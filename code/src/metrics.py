@@ -0,0 +1,283 @@
+"""
+In-process metrics and timing spans for the email pipeline.
+
+    with span("parse"):                              # email_pipeline_stage_seconds{stage="parse"}
+        ...
+    increment("duplicates_total", kind="exact")      # email_pipeline_duplicates_total{kind="exact"}
+    render_prometheus()                              # Prometheus text format, served by api.py at /metrics
+
+Stages (nested spans under one "email" span per email):
+    parse, hash, attachment (PDF text layer / OCR / text files),
+    dedup (result cache, near-duplicates, rules, pre-classifier), prompt, llm,
+    index (result cache and near-duplicate index writes), persist (results store)
+Counters: emails_total{source}, cache_lookups_total{kind, outcome}, duplicates_total{kind},
+attachments_total{path}, ocr_pages_total, llm_prompt_tokens_total, llm_response_tokens_total
+(estimated, see prompt_builder.count_tokens), llm_requests_total{outcome}, llm_retries_total,
+llm_tier_requests_total{tier, outcome}, llm_escalations_total{reason} and the llm_tier_seconds{tier}
+histogram (see model_cascade.py), preclassifier_total{outcome} (see preclassifier.py).
+
+Metrics recorded in worker processes (batch.py parses emails in a process pool) are
+taken out with drain() and added to the parent's with merge().
+
+With METRICS_JSON_LOG set ("-" for stderr, otherwise a file path) every finished span
+is also written as one JSON line shaped like an OpenTelemetry span (traceId, spanId,
+parentSpanId, name, startTimeUnixNano, endTimeUnixNano, attributes); the spans of one
+email share its traceId.
+
+With PROFILE_DIR set, profiled() writes a profile per email into that directory:
+cProfile stats (<name>.prof, open with pstats or snakeviz), or with PROFILER=pyinstrument
+a pyinstrument report (<name>.txt).
+
+Configuration (environment variables):
+    METRICS_JSON_LOG, PROFILE_DIR, PROFILER (cprofile | pyinstrument, default cprofile)
+"""
+import contextlib
+import contextvars
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PREFIX = "email_pipeline_"
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+DESCRIPTIONS = {
+    "stage_seconds": "Wall time of each pipeline stage",
+    "emails_total": "Emails processed, by where the result came from",
+    "cache_lookups_total": "Result cache lookups by key kind (email_hash, content, semantic) and outcome",
+    "duplicates_total": "Emails flagged as duplicates, by kind (exact, content, near)",
+    "attachments_total": "Attachments by extraction path",
+    "ocr_pages_total": "PDF pages and images that went through OCR",
+    "llm_prompt_tokens_total": "Estimated prompt tokens sent to the LLM",
+    "llm_response_tokens_total": "Estimated response tokens received from the LLM",
+    "llm_requests_total": "LLM requests by outcome",
+    "llm_retries_total": "LLM requests retried after a quota / transient error",
+    "llm_tier_requests_total": "LLM answers by model tier (fast, tuned) and outcome (accepted, escalated, answered)",
+    "llm_escalations_total": "Fast model answers escalated to the tuned model, by reason",
+    "llm_tier_seconds": "LLM latency per answer by model tier",
+    "preclassifier_total": "Emails seen by the local pre-classifier, by outcome (hit = classification call saved, deferred)",
+    "watcher_messages_total": "Mailbox messages ingested by the watcher, by outcome (done, recovered, error, vanished)",
+}
+
+_lock = threading.Lock()
+# (name, labels) -> value, labels being a sorted tuple of (key, value) pairs
+_counters = {}
+# (name, labels) -> [bucket counts..., +Inf count, sum]
+_histograms = {}
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_log_lock = threading.Lock()
+_log_file = None
+_log_path = None
+
+
+def _labels(labels: dict) -> tuple:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def increment(name: str, value: float = 1, **labels):
+    key = (name, _labels(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name: str, seconds: float, **labels):
+    key = (name, _labels(labels))
+    with _lock:
+        values = _histograms.get(key)
+        if values is None:
+            values = _histograms[key] = [0] * (len(STAGE_BUCKETS) + 2)
+        for position, bound in enumerate(STAGE_BUCKETS):
+            if seconds <= bound:
+                values[position] += 1
+        values[-2] += 1
+        values[-1] += seconds
+
+
+def _write_span_log(record: dict):
+    global _log_file, _log_path
+    target = os.getenv("METRICS_JSON_LOG")
+    if not target:
+        return
+    line = json.dumps(record) + "\n"
+    with _log_lock:
+        if target == "-":
+            sys.stderr.write(line)
+            return
+        if _log_path != target:
+            if _log_file is not None:
+                _log_file.close()
+            _log_file, _log_path = open(target, "a", encoding="utf-8"), target
+        _log_file.write(line)
+        _log_file.flush()
+
+
+@contextlib.contextmanager
+def span(name: str, **attributes):
+    """
+    Time a stage; yields the span's attribute dictionary so the caller can add to it.
+    The outermost span of a thread / task starts a new trace.
+    """
+    parent = _current_span.get()
+    current = {
+        "trace_id": parent["trace_id"] if parent else uuid.uuid4().hex,
+        "span_id": uuid.uuid4().hex[:16],
+        "attributes": attributes,
+    }
+    token = _current_span.set(current)
+    start_ns = time.time_ns()
+    started = time.perf_counter()
+    error = None
+    try:
+        yield attributes
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        seconds = time.perf_counter() - started
+        _current_span.reset(token)
+        observe("stage_seconds", seconds, stage=name)
+        if os.getenv("METRICS_JSON_LOG"):
+            _write_span_log({
+                "traceId": current["trace_id"],
+                "spanId": current["span_id"],
+                "parentSpanId": parent["span_id"] if parent else None,
+                "name": name,
+                "startTimeUnixNano": start_ns,
+                "endTimeUnixNano": start_ns + int(seconds * 1e9),
+                "status": {"code": "ERROR", "message": f"{type(error).__name__}: {error}"} if error else {"code": "OK"},
+                "attributes": {key: value for key, value in attributes.items()
+                               if isinstance(value, (str, int, float, bool))},
+            })
+
+
+def drain() -> dict:
+    """Take out (and reset) everything recorded so far, as a picklable dictionary for merge()."""
+    global _counters, _histograms
+    with _lock:
+        taken = {"counters": list(_counters.items()), "histograms": list(_histograms.items())}
+        _counters, _histograms = {}, {}
+    return taken
+
+
+def merge(taken: dict):
+    """Add metrics taken with drain() (e.g. in a worker process) to this process's."""
+    with _lock:
+        for key, value in taken.get("counters", []):
+            _counters[key] = _counters.get(key, 0) + value
+        for key, values in taken.get("histograms", []):
+            current = _histograms.setdefault(key, [0] * len(values))
+            for position, value in enumerate(values):
+                current[position] += value
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: tuple, extra: tuple = ()) -> str:
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+def render_prometheus() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted((key, list(values)) for key, values in _histograms.items())
+    lines = []
+    described = set()
+
+    def header(name, kind):
+        if name not in described:
+            described.add(name)
+            lines.append(f"# HELP {PREFIX}{name} {DESCRIPTIONS.get(name, name)}")
+            lines.append(f"# TYPE {PREFIX}{name} {kind}")
+
+    for (name, labels), value in counters:
+        header(name, "counter")
+        lines.append(f"{PREFIX}{name}{_format_labels(labels)} {value:g}")
+    for (name, labels), values in histograms:
+        header(name, "histogram")
+        for bound, count in zip(STAGE_BUCKETS, values):
+            lines.append(f"{PREFIX}{name}_bucket{_format_labels(labels, (('le', f'{bound:g}'),))} {count}")
+        lines.append(f"{PREFIX}{name}_bucket{_format_labels(labels, (('le', '+Inf'),))} {values[-2]}")
+        lines.append(f"{PREFIX}{name}_sum{_format_labels(labels)} {values[-1]:.6f}")
+        lines.append(f"{PREFIX}{name}_count{_format_labels(labels)} {values[-2]}")
+    return "\n".join(lines) + "\n"
+
+
+@contextlib.contextmanager
+def profiled(name: str = None):
+    """
+    Profile the block into PROFILE_DIR (no-op when it is not set); see the module docstring.
+    Yields a dictionary whose "name" (set by the block, e.g. to the email hash) names the file.
+    """
+    profile = {"name": name}
+    directory = os.getenv("PROFILE_DIR")
+    if not directory:
+        yield profile
+        return
+
+    def path():
+        os.makedirs(directory, exist_ok=True)
+        name = profile["name"] or f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        return os.path.join(directory, re.sub(r"[^\w.-]+", "_", name))
+
+    if os.getenv("PROFILER", "cprofile").lower() == "pyinstrument":
+        from pyinstrument import Profiler
+
+        profiler = Profiler()
+        profiler.start()
+        try:
+            yield profile
+        finally:
+            profiler.stop()
+            with open(f"{path()}.txt", "w", encoding="utf-8") as f:
+                f.write(profiler.output_text(unicode=True))
+        return
+
+    import cProfile
+
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Another profiler is active in this process (e.g. a concurrent email on another thread).
+        yield profile
+        return
+    try:
+        yield profile
+    finally:
+        profiler.disable()
+        profiler.dump_stats(f"{path()}.prof")
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """Serve GET /metrics from a background thread (for processes without the API, e.g. batch.py)."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
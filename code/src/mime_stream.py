@@ -0,0 +1,302 @@
+"""
+Memory-bounded MIME parsing for large emails (EmailProcessor streaming mode).
+
+email.parser builds the whole message tree in memory: the raw bytes, the encoded
+text of every part and, once decoded, every attachment payload are held at the
+same time, so one email with a 40 MB scanned PDF costs several times that in RSS.
+parse() reads the email line by line from a file object instead, decodes each
+part's transfer encoding (base64 / quoted-printable) as it goes and writes the
+payload to a buffer that moves to a temporary file once it grows past
+EMAIL_SPOOL_BYTES. Spilled payloads are handed on as read-only mmap views, so OCR
+reads them through the page cache rather than the heap, and memory use stays
+flat whatever the attachment size. Only the headers of each part are parsed with
+the email package.
+
+Limits: a part whose decoded size exceeds EMAIL_MAX_PART_BYTES is dropped (kept
+with truncated=True and no content), and once EMAIL_MAX_BYTES of the email have
+been read the remaining parts are skipped (ParsedEmail.truncated).
+
+Configuration (environment variables):
+    EMAIL_STREAMING (auto | 1 | 0, default auto: stream emails larger than
+    EMAIL_STREAMING_THRESHOLD bytes, default 8 MB), EMAIL_SPOOL_BYTES (default 1 MB),
+    EMAIL_MAX_PART_BYTES (default 50 MB), EMAIL_MAX_BYTES (default 200 MB; 0 = no limit)
+"""
+import binascii
+import io
+import mmap
+import os
+import tempfile
+from email import policy
+from email.parser import BytesHeaderParser
+
+MB = 1024 * 1024
+
+STREAMING = os.getenv("EMAIL_STREAMING", "auto").lower()
+STREAMING_THRESHOLD = int(os.getenv("EMAIL_STREAMING_THRESHOLD", str(8 * MB)))
+SPOOL_BYTES = int(os.getenv("EMAIL_SPOOL_BYTES", str(MB)))
+MAX_PART_BYTES = int(os.getenv("EMAIL_MAX_PART_BYTES", str(50 * MB)))
+MAX_EMAIL_BYTES = int(os.getenv("EMAIL_MAX_BYTES", str(200 * MB)))
+
+# Lines are read in chunks of at most this size, so a part without line breaks is never held whole.
+LINE_LIMIT = 64 * 1024
+MAX_HEADER_BYTES = MB
+
+
+def should_stream(size: int) -> bool:
+    """Whether an email of `size` bytes is parsed with parse() under the EMAIL_STREAMING setting."""
+    if STREAMING in ("1", "true", "always"):
+        return True
+    if STREAMING in ("0", "false", "never"):
+        return False
+    return size > STREAMING_THRESHOLD or bool(MAX_EMAIL_BYTES and size > MAX_EMAIL_BYTES)
+
+
+class Part:
+    """One leaf part: its headers and decoded payload (in memory, or in a temporary file past spool_bytes)."""
+
+    def __init__(self, headers, spool_bytes: int = SPOOL_BYTES, max_bytes: int = MAX_PART_BYTES):
+        self.headers = headers
+        self.content_type = headers.get_content_type()
+        self.disposition = headers.get_content_disposition()
+        self.filename = headers.get_filename()
+        self.charset = headers.get_content_charset() or "utf-8"
+        self.size = 0
+        self.truncated = False
+        self._spool_bytes = spool_bytes
+        self._max_bytes = max_bytes
+        self._buffer = io.BytesIO()
+        self._file = None
+        self._mmap = None
+        self._views = []
+
+    @property
+    def on_disk(self) -> bool:
+        return self._file is not None
+
+    def write(self, data: bytes):
+        if self.truncated or not data:
+            return
+        if self._max_bytes and self.size + len(data) > self._max_bytes:
+            # Over the cap: nothing of the part is passed on.
+            self.truncated = True
+            self._buffer = io.BytesIO()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            return
+        if self._file is None and self.size + len(data) > self._spool_bytes:
+            self._file = tempfile.TemporaryFile(prefix="email-part-")
+            self._file.write(self._buffer.getbuffer())
+            self._buffer = io.BytesIO()
+        (self._file or self._buffer).write(data)
+        self.size += len(data)
+
+    def content(self) -> memoryview:
+        """Read-only view of the payload (file backed when spilled); valid until close()."""
+        if self.truncated or self.size == 0:
+            return memoryview(b"")
+        if self._file is None:
+            view = self._buffer.getbuffer()
+        else:
+            if self._mmap is None:
+                self._file.flush()
+                self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            view = memoryview(self._mmap)
+        self._views.append(view)
+        return view
+
+    def text(self) -> str:
+        content = self.content()
+        try:
+            return str(content, self.charset, "replace")
+        except LookupError:
+            return str(content, "utf-8", "replace")
+
+    def close(self):
+        for view in self._views:
+            view.release()
+        self._views = []
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # A caller still holds a view of it; it is closed when that goes away.
+                pass
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class ParsedEmail:
+
+    def __init__(self, headers):
+        self.headers = headers
+        self.parts = []
+        self.truncated = False
+        self.bytes_read = 0
+
+    def close(self):
+        for part in self.parts:
+            part.close()
+
+
+class _Lines:
+    """Line reader that counts bytes, enforces the email size cap and knows whether a chunk starts a line."""
+
+    def __init__(self, stream, max_bytes: int):
+        self.stream = stream
+        self.max_bytes = max_bytes
+        self.read = 0
+        self.exceeded = False
+        self._at_line_start = True
+
+    def next(self):
+        """(chunk, starts_a_line); chunk is b"" at the end of the input or once over the cap."""
+        if self.exceeded:
+            return b"", True
+        line = self.stream.readline(LINE_LIMIT)
+        if self.max_bytes and self.read + len(line) > self.max_bytes:
+            self.exceeded = True
+            return b"", True
+        self.read += len(line)
+        starts = self._at_line_start
+        self._at_line_start = line.endswith(b"\n")
+        return line, starts
+
+
+def _line_end(line: bytes):
+    if line.endswith(b"\r\n"):
+        return line[:-2], b"\r\n"
+    if line.endswith(b"\n"):
+        return line[:-1], b"\n"
+    return line, b""
+
+
+class _Parser:
+
+    def __init__(self, stream, max_part_bytes: int, max_email_bytes: int, spool_bytes: int):
+        self.lines = _Lines(stream, max_email_bytes)
+        self.max_part_bytes = max_part_bytes
+        self.spool_bytes = spool_bytes
+        self.parts = []
+
+    def headers(self):
+        block = []
+        size = 0
+        while True:
+            line, _ = self.lines.next()
+            if not line or line in (b"\r\n", b"\n"):
+                break
+            if size < MAX_HEADER_BYTES:
+                block.append(line)
+                size += len(line)
+        return BytesHeaderParser(policy=policy.default).parsebytes(b"".join(block))
+
+    @staticmethod
+    def _boundary(line: bytes, starts: bool, boundaries: list):
+        """(index into boundaries, is_close_delimiter) when the line is a boundary line, else None."""
+        if not starts or not line.startswith(b"--"):
+            return None
+        stripped = line.rstrip(b" \t\r\n")
+        for index in range(len(boundaries) - 1, -1, -1):
+            if stripped == boundaries[index]:
+                return index, False
+            if stripped == boundaries[index] + b"--":
+                return index, True
+        return None
+
+    def skip_until_boundary(self, boundaries: list):
+        while True:
+            line, starts = self.lines.next()
+            if not line:
+                return None
+            hit = self._boundary(line, starts, boundaries)
+            if hit is not None:
+                return hit
+
+    def entity(self, headers, boundaries: list):
+        """Read one entity (after its headers); returns the enclosing boundary that ended it, or None."""
+        boundary = headers.get_boundary() if headers.get_content_maintype() == "multipart" else None
+        if boundary:
+            inner = boundaries + [b"--" + boundary.encode("ascii", "replace")]
+            own = len(inner) - 1
+            hit = self.skip_until_boundary(inner)  # preamble
+            while hit is not None and hit == (own, False):
+                hit = self.entity(self.headers(), inner)
+            if hit == (own, True):
+                hit = self.skip_until_boundary(boundaries)  # epilogue
+            return hit
+        encoding = str(headers.get("content-transfer-encoding", "7bit")).strip().lower()
+        if headers.get_content_type() == "message/rfc822" and encoding not in ("base64", "quoted-printable"):
+            # An attached email: listed as an empty part (as Message.walk() yields it), then walked into.
+            self.parts.append(Part(headers, self.spool_bytes, self.max_part_bytes))
+            return self.entity(self.headers(), boundaries)
+        return self.leaf(headers, boundaries)
+
+    def leaf(self, headers, boundaries: list):
+        part = Part(headers, self.spool_bytes, self.max_part_bytes)
+        self.parts.append(part)
+        encoding = str(headers.get("content-transfer-encoding", "7bit")).strip().lower()
+        leftover = b""
+        pending_eol = b""
+        while True:
+            line, starts = self.lines.next()
+            if not line:
+                # End of the input rather than a boundary: the last line break is content.
+                hit = None
+                part.write(pending_eol)
+                break
+            hit = self._boundary(line, starts, boundaries)
+            if hit is not None:
+                break
+            if encoding == "base64":
+                data = leftover + b"".join(line.split())
+                usable = len(data) - len(data) % 4
+                leftover = data[usable:]
+                try:
+                    part.write(binascii.a2b_base64(data[:usable]))
+                except binascii.Error:
+                    pass
+                continue
+            # The line break before a boundary belongs to the boundary, so each one is
+            # only written once the next line shows the part continues.
+            content, eol = _line_end(line)
+            part.write(pending_eol)
+            if encoding == "quoted-printable":
+                if content.endswith(b"="):
+                    part.write(binascii.a2b_qp(content[:-1]))
+                    eol = b""
+                else:
+                    part.write(binascii.a2b_qp(content))
+            else:
+                part.write(content)
+            pending_eol = eol
+        if leftover:
+            try:
+                part.write(binascii.a2b_base64(leftover + b"=" * (-len(leftover) % 4)))
+            except binascii.Error:
+                pass
+        return hit
+
+
+def parse(stream, max_part_bytes: int = None, max_email_bytes: int = None, spool_bytes: int = None) -> ParsedEmail:
+    """
+    Parse the email read from the binary file object `stream`. Leaf parts are
+    returned in document order (ParsedEmail.parts); call close() when done with them.
+    """
+    parser = _Parser(stream,
+                     MAX_PART_BYTES if max_part_bytes is None else max_part_bytes,
+                     MAX_EMAIL_BYTES if max_email_bytes is None else max_email_bytes,
+                     SPOOL_BYTES if spool_bytes is None else spool_bytes)
+    parsed = ParsedEmail(parser.headers())
+    try:
+        parser.entity(parsed.headers, [])
+    finally:
+        parsed.parts = parser.parts
+    parsed.truncated = parser.lines.exceeded
+    if parsed.truncated and parsed.parts:
+        # The part being read when the cap was reached is incomplete.
+        parsed.parts[-1].truncated = True
+    parsed.bytes_read = parser.lines.read
+    return parsed
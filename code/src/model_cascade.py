@@ -0,0 +1,115 @@
+"""
+Model cascade: a cheap, fast model answers first and only uncertain or malformed
+answers are escalated to the tuned model.
+
+With LLM_FAST_MODEL set (see llm_client.py for the fast tier's settings), a prompt
+goes to the fast tier first. Its answer is kept when it parses, matches the result
+schema (response_parser.schema_errors) and the confidence score of its primary
+request type is at least LLM_CASCADE_THRESHOLD; otherwise the same prompt is sent to
+the tuned model. Without a fast tier every prompt goes straight to the tuned model.
+
+Every answer is counted per tier and outcome (llm_tier_requests_total{tier, outcome}),
+escalations per reason (llm_escalations_total{reason}: error, unparseable, schema,
+low_confidence) and latency per tier (llm_tier_seconds{tier}); see metrics.py.
+The tier, escalation reason and per-tier seconds of each email are written into its
+prompt stats (stored with the result), and stats() sums them up for the process.
+
+Configuration (environment variables):
+    LLM_FAST_MODEL, LLM_CASCADE_THRESHOLD (default 0.8), LLM_CASCADE_DISABLED (set to 1
+    to always use the tuned model)
+"""
+import os
+import threading
+import time
+
+import metrics
+from llm_client import DEFAULT_TIER, FAST_TIER, get_client
+from response_parser import classification_of, parse_llm_json, schema_errors
+
+CASCADE_THRESHOLD = float(os.getenv("LLM_CASCADE_THRESHOLD", "0.8"))
+
+_lock = threading.Lock()
+# tier -> {"calls", "seconds", outcome: count}
+_stats = {}
+
+
+def enabled() -> bool:
+    """Whether prompts go to the fast tier first."""
+    if os.getenv("LLM_CASCADE_DISABLED", "0") not in ("0", "", "false", "False"):
+        return False
+    return get_client(FAST_TIER) is not None
+
+
+def escalation_reason(text: str, threshold: float = None):
+    """Why the fast tier's answer `text` is not good enough, or None when it is kept."""
+    threshold = CASCADE_THRESHOLD if threshold is None else threshold
+    result = parse_llm_json(text or "")
+    if result is None:
+        return "unparseable"
+    if schema_errors(result):
+        return "schema"
+    _, _, confidence = classification_of(result)
+    if confidence is None or confidence < threshold:
+        return "low_confidence"
+    return None
+
+
+def record(tier: str, seconds: float, outcome: str, reason: str = None, emails: int = 1):
+    """Count `emails` answers of a tier (a batch call's latency is shared by its emails)."""
+    metrics.increment("llm_tier_requests_total", emails, tier=tier, outcome=outcome)
+    metrics.observe("llm_tier_seconds", seconds / max(1, emails), tier=tier)
+    if reason is not None:
+        metrics.increment("llm_escalations_total", emails, reason=reason)
+    with _lock:
+        tier_stats = _stats.setdefault(tier, {"calls": 0, "seconds": 0.0})
+        tier_stats["calls"] += emails
+        tier_stats["seconds"] += seconds
+        tier_stats[outcome] = tier_stats.get(outcome, 0) + emails
+
+
+def stats() -> dict:
+    """Per tier: answers, outcomes, mean seconds per answer and (fast tier) the escalation rate."""
+    with _lock:
+        current = {tier: dict(values) for tier, values in _stats.items()}
+    for tier, values in current.items():
+        values["mean_seconds"] = round(values.pop("seconds") / values["calls"], 4) if values["calls"] else None
+        if tier == FAST_TIER:
+            values["escalation_rate"] = round(values.get("escalated", 0) / values["calls"], 4) if values["calls"] else None
+    return current
+
+
+def _call(tier: str, prompt_text: str, response_schema: dict, prompt_stats: dict):
+    started = time.perf_counter()
+    try:
+        return get_client(tier).generate(prompt_text, response_schema=response_schema)
+    finally:
+        seconds = time.perf_counter() - started
+        prompt_stats.setdefault("tier_seconds", {})[tier] = round(seconds, 3)
+
+
+def generate(prompt_text: str, response_schema: dict = None, prompt_stats: dict = None, cascade: bool = True):
+    """
+    Answer the prompt through the cascade (see the module docstring); with cascade=False,
+    or without a fast tier, straight from the tuned model. Returns the LLM response.
+    """
+    prompt_stats = {} if prompt_stats is None else prompt_stats
+    if cascade and enabled():
+        try:
+            response = _call(FAST_TIER, prompt_text, response_schema, prompt_stats)
+        except Exception as e:
+            print(f"Fast model failed, escalating to the tuned model: {e}")
+            reason = "error"
+        else:
+            reason = escalation_reason(response.text)
+        seconds = prompt_stats["tier_seconds"][FAST_TIER]
+        if reason is None:
+            record(FAST_TIER, seconds, "accepted")
+            prompt_stats["model_tier"] = FAST_TIER
+            return response
+        record(FAST_TIER, seconds, "escalated", reason)
+        prompt_stats["escalation"] = reason
+        print(f"Fast model answer escalated to the tuned model ({reason})")
+    response = _call(DEFAULT_TIER, prompt_text, response_schema, prompt_stats)
+    record(DEFAULT_TIER, prompt_stats["tier_seconds"][DEFAULT_TIER], "answered")
+    prompt_stats["model_tier"] = DEFAULT_TIER
+    return response
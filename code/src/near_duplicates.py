@@ -0,0 +1,168 @@
+"""
+Near-duplicate detection for emails.
+
+The exact SHA-256 hash misses forwarded copies, re-sends with new Message-ID
+headers and replies quoting the original. Here the normalized body + attachment
+text is shingled into word 3-grams and summarized by a MinHash signature; an
+LSH index (signature split into bands, one bucket per band) stored in SQLite
+returns candidate matches without scanning past emails, and the best candidate
+above the similarity threshold is reported.
+
+Text with fewer than NEAR_DUP_MIN_SHINGLES shingles (an empty body whose attachment
+could not be read, a one-line note) has no signature: it is neither looked up nor
+indexed, since such emails would all look alike.
+
+Configuration (environment variables):
+    NEAR_DUP_INDEX_PATH, NEAR_DUP_THRESHOLD (estimated Jaccard similarity, default 0.9),
+    NEAR_DUP_MIN_SHINGLES (default 10)
+"""
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+
+import numpy as np
+
+DEFAULT_INDEX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "near_duplicates.sqlite3")
+
+_MERSENNE_PRIME = (1 << 31) - 1
+_HEADER_LINE = re.compile(r"^\s*(from|to|cc|sent|subject)\s*:.*$", re.IGNORECASE | re.MULTILINE)
+_FORWARD_MARKER = re.compile(r"-+\s*(forwarded message|original message)\s*-+", re.IGNORECASE)
+_QUOTE_PREFIX = re.compile(r"^\s*(>\s*)+", re.MULTILINE)
+_WORD = re.compile(r"\w+")
+
+
+def normalize_for_similarity(text: str) -> str:
+    """Drop quoting / forwarding noise so a forward or reply looks like its original."""
+    text = _QUOTE_PREFIX.sub("", text or "")
+    text = _FORWARD_MARKER.sub(" ", text)
+    text = _HEADER_LINE.sub(" ", text)
+    return " ".join(_WORD.findall(text.lower()))
+
+
+def shingles(text: str, size: int = 3) -> set:
+    words = text.split()
+    if len(words) <= size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+class NearDuplicateIndex:
+
+    def __init__(self, path: str = DEFAULT_INDEX_PATH, num_perm: int = 128, bands: int = 32,
+                 threshold: float = 0.9, min_shingles: int = 10, seed: int = 1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.path = path
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.min_shingles = max(1, min_shingles)
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, _MERSENNE_PRIME, size=num_perm).astype(np.uint64)
+        self._b = rng.randint(0, _MERSENNE_PRIME, size=num_perm).astype(np.uint64)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS signatures (
+                email_hash TEXT PRIMARY KEY,
+                signature BLOB NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS buckets (
+                band INTEGER NOT NULL,
+                bucket TEXT NOT NULL,
+                email_hash TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS buckets_lookup ON buckets (band, bucket);
+        """)
+        self._conn.commit()
+
+    def signature(self, text: str):
+        """
+        MinHash signature (num_perm uint32 values) of the normalized text, or None when
+        the text has fewer than min_shingles shingles.
+        """
+        grams = shingles(normalize_for_similarity(text))
+        if len(grams) < self.min_shingles:
+            return None
+        hashes = np.fromiter(
+            (int.from_bytes(hashlib.blake2b(gram.encode("utf-8"), digest_size=4).digest(), "little")
+             for gram in grams),
+            dtype=np.uint64, count=len(grams),
+        )
+        # (a * x + b) mod p for every permutation / shingle pair; fits in uint64 since a, x < 2^32.
+        permuted = (np.outer(self._a, hashes) + self._b[:, None]) % _MERSENNE_PRIME
+        return permuted.min(axis=1)
+
+    def _bucket_keys(self, signature: np.ndarray):
+        for band in range(self.bands):
+            chunk = signature[band * self.rows:(band + 1) * self.rows]
+            yield band, hashlib.blake2b(chunk.tobytes(), digest_size=8).hexdigest()
+
+    def query(self, text: str = None, signature: np.ndarray = None, exclude: str = None):
+        """
+        Best match above the threshold as (email_hash, similarity), or None.
+        Pass `signature` to avoid recomputing it when the email is added afterwards.
+        """
+        if signature is None and text is not None:
+            signature = self.signature(text)
+        if signature is None:
+            return None
+        with self._lock:
+            candidates = set()
+            for band, bucket in self._bucket_keys(signature):
+                rows = self._conn.execute("SELECT email_hash FROM buckets WHERE band = ? AND bucket = ?",
+                                          (band, bucket)).fetchall()
+                candidates.update(row[0] for row in rows)
+            candidates.discard(exclude)
+
+            best = None
+            for email_hash in candidates:
+                row = self._conn.execute("SELECT signature FROM signatures WHERE email_hash = ?",
+                                         (email_hash,)).fetchone()
+                if row is None:
+                    continue
+                other = np.frombuffer(row[0], dtype=np.uint64)
+                similarity = float(np.mean(other == signature))
+                if similarity >= self.threshold and (best is None or similarity > best[1]):
+                    best = (email_hash, similarity)
+        return best
+
+    def add(self, email_hash: str, text: str = None, signature: np.ndarray = None):
+        """Index an email; text too short to have a signature is not indexed."""
+        if signature is None and text is not None:
+            signature = self.signature(text)
+        if signature is None:
+            return
+        signature = np.ascontiguousarray(signature, dtype=np.uint64)
+        with self._lock:
+            cursor = self._conn.execute("INSERT OR IGNORE INTO signatures (email_hash, signature) VALUES (?, ?)",
+                                        (email_hash, signature.tobytes()))
+            if cursor.rowcount:
+                self._conn.executemany("INSERT INTO buckets (band, bucket, email_hash) VALUES (?, ?, ?)",
+                                       [(band, bucket, email_hash) for band, bucket in self._bucket_keys(signature)])
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index() -> NearDuplicateIndex:
+    """Process-wide index, opened on first use."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = NearDuplicateIndex(
+                path=os.getenv("NEAR_DUP_INDEX_PATH", DEFAULT_INDEX_PATH),
+                threshold=float(os.getenv("NEAR_DUP_THRESHOLD", "0.9")),
+                min_shingles=int(os.getenv("NEAR_DUP_MIN_SHINGLES", "10")),
+            )
+        return _index
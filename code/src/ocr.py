@@ -0,0 +1,233 @@
+"""
+Text extraction / OCR pipeline for email attachments.
+
+Digitally generated PDFs already carry a text layer: it is read directly with
+pypdf and only pages whose text layer is missing or too sparse (fewer than
+OCR_MIN_TEXT_CHARS characters) go through Tesseract. Every call reports which
+path was taken (text-layer / ocr / mixed / cache) so the speedup can be measured.
+
+Pages that do need OCR are rendered one at a time (pdf2image first_page /
+last_page ranges) from a single temporary copy of the file, so only the pages
+currently being OCRed are held in memory. Pages are OCRed in a process pool and
+the text is cached in a SQLite cache (see result_cache.ResultCache) keyed by the SHA-256 of the
+attachment, so the same PDF attached to every reply in a thread is OCRed once. The key also
+holds the rendering settings and ocr_engine.cache_tag() (engine, language, preprocessing), so
+changing OCR_ENGINE, OCR_DPI or OCR_BINARIZE does not return text produced by the old setup.
+
+Attachment content can be any bytes-like object; createEmail passes memoryviews
+of the decoded payload, which are hashed and written out without copying.
+
+Pages and images are OCRed by the engine from ocr_engine.py (a persistent
+tesserocr handle per process, or pytesseract as the fallback) after its
+preprocess() step; each OCR pool worker opens its engine when it starts.
+
+pypdf, pdf2image, the OCR engine and Pillow are imported on first use rather
+than with this module; warm_up() loads them ahead of time, e.g. once per worker
+process.
+
+Configuration (environment variables):
+    OCR_DPI (default 200), OCR_GRAYSCALE (default 1), OCR_WORKERS (default: CPU count),
+    OCR_MIN_TEXT_CHARS (default 25), OCR_CACHE_PATH
+"""
+import hashlib
+import io
+import json
+import mmap
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import ocr_engine
+from result_cache import ResultCache
+
+DEFAULT_OCR_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ocr_cache.sqlite3")
+
+OCR_DPI = int(os.getenv("OCR_DPI", "200"))
+OCR_GRAYSCALE = os.getenv("OCR_GRAYSCALE", "1") not in ("0", "false", "False")
+OCR_MIN_TEXT_CHARS = int(os.getenv("OCR_MIN_TEXT_CHARS", "25"))
+
+_workers = int(os.getenv("OCR_WORKERS", "0")) or os.cpu_count() or 1
+_pool = None
+_cache = None
+_lock = threading.Lock()
+
+
+def set_workers(workers: int):
+    """Change the size of the page OCR pool (1 = OCR pages in the calling process)."""
+    global _workers, _pool
+    with _lock:
+        _workers = max(1, workers)
+        if _pool is not None:
+            _pool.shutdown(wait=False)
+            _pool = None
+
+
+def _get_pool():
+    global _pool
+    with _lock:
+        if _pool is None and _workers > 1:
+            _pool = ProcessPoolExecutor(max_workers=_workers, initializer=ocr_engine.warm_up)
+        return _pool
+
+
+def _pdf_reader():
+    """pypdf.PdfReader, or None when pypdf is not installed (every page is then OCRed)."""
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        return None
+    return PdfReader
+
+
+def warm_up():
+    """
+    Import the extraction libraries and open the cache now instead of on the first attachment.
+    A missing OCR library is reported here and not raised, so a worker process still starts;
+    the attachments that need it then fail one by one with the ImportError.
+    """
+    try:
+        import pdf2image
+        from PIL import Image
+    except ImportError as e:
+        ocr_engine.report_missing(e)
+    ocr_engine.warm_up()
+    _pdf_reader()
+    get_ocr_cache()
+
+
+def get_ocr_cache() -> ResultCache:
+    global _cache
+    with _lock:
+        if _cache is None:
+            _cache = ResultCache(path=os.getenv("OCR_CACHE_PATH", DEFAULT_OCR_CACHE_PATH))
+        return _cache
+
+
+def _stream(content):
+    # BytesIO shares the buffer of a bytes object instead of copying it, so unwrap
+    # views that cover a whole bytes object; a file-backed mmap (a streamed attachment,
+    # see mime_stream.py) is read in place; other buffers are copied once.
+    if isinstance(content, memoryview) and isinstance(content.obj, mmap.mmap) and content.nbytes == len(content.obj):
+        content.obj.seek(0)
+        return content.obj
+    if isinstance(content, memoryview) and isinstance(content.obj, bytes) and content.nbytes == len(content.obj):
+        content = content.obj
+    return io.BytesIO(content)
+
+
+def _cache_key(content: bytes, dpi: int, grayscale: bool) -> str:
+    # Rendering settings, the engine and its preprocessing change the OCR output, so they are part of the key.
+    return f"{hashlib.sha256(content).hexdigest()}:{dpi}:{int(grayscale)}:{ocr_engine.cache_tag()}"
+
+
+def _ocr_page(path: str, page: int, dpi: int, grayscale: bool) -> str:
+    # Runs in a pool worker: render exactly one page and OCR it with the worker's engine.
+    from pdf2image import convert_from_path
+
+    engine = ocr_engine.get_engine()
+    images = convert_from_path(path, dpi=dpi, first_page=page, last_page=page, grayscale=grayscale)
+    texts = []
+    for image in images:
+        with ocr_engine.preprocess(image, dpi) as prepared:
+            texts.append(engine.image_to_string(prepared))
+        image.close()
+    return "".join(texts)
+
+
+def _text_layer(content: bytes):
+    """Embedded text of every page, or None when pypdf is unavailable / cannot read the file."""
+    PdfReader = _pdf_reader()
+    if PdfReader is None:
+        return None
+    try:
+        reader = PdfReader(_stream(content))
+        return [page.extract_text() or "" for page in reader.pages]
+    except Exception as e:
+        print(f"Could not read PDF text layer, falling back to OCR: {e}")
+        return None
+
+
+def _ocr_pages(content: bytes, pages: list, dpi: int, grayscale: bool) -> list:
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
+        tmp.write(content)
+        path = tmp.name
+    try:
+        pool = _get_pool()
+        if pool is None or len(pages) == 1:
+            return [_ocr_page(path, page, dpi, grayscale) for page in pages]
+        futures = [pool.submit(_ocr_page, path, page, dpi, grayscale) for page in pages]
+        return [future.result() for future in futures]
+    finally:
+        os.unlink(path)
+
+
+def extract_pdf_text(content: bytes, dpi: int = None, grayscale: bool = None):
+    """
+    Text of a PDF attachment plus a dictionary describing how it was obtained:
+        {"path": "text-layer" | "ocr" | "mixed" | "cache",
+         "pages", "text_layer_pages", "ocr_pages", "seconds"}
+    """
+    dpi = dpi or OCR_DPI
+    grayscale = OCR_GRAYSCALE if grayscale is None else grayscale
+    started = time.perf_counter()
+    cache = get_ocr_cache()
+    key = _cache_key(content, dpi, grayscale)
+    cached = cache.get(key)
+    if cached is not None:
+        try:
+            entry = json.loads(cached)
+        except ValueError:
+            # Entry written before extraction details were cached.
+            entry = {"text": cached, "info": {}}
+        info = dict(entry["info"], path="cache", seconds=round(time.perf_counter() - started, 4))
+        return entry["text"], info
+
+    texts = _text_layer(content)
+    if texts is None:
+        from pdf2image import pdfinfo_from_path
+
+        with tempfile.NamedTemporaryFile(suffix=".pdf") as tmp:
+            tmp.write(content)
+            tmp.flush()
+            page_count = int(pdfinfo_from_path(tmp.name)["Pages"])
+        texts = [""] * page_count
+
+    # 1-based page numbers whose text layer is missing or too sparse.
+    ocr_pages = [i + 1 for i, text in enumerate(texts) if len(text.strip()) < OCR_MIN_TEXT_CHARS]
+    if ocr_pages:
+        for page, text in zip(ocr_pages, _ocr_pages(content, ocr_pages, dpi, grayscale)):
+            texts[page - 1] = text
+
+    if not ocr_pages:
+        path = "text-layer"
+    elif len(ocr_pages) == len(texts):
+        path = "ocr"
+    else:
+        path = "mixed"
+    text = "".join(texts)
+    info = {
+        "path": path,
+        "pages": len(texts),
+        "text_layer_pages": len(texts) - len(ocr_pages),
+        "ocr_pages": len(ocr_pages),
+    }
+    cache.put(key, json.dumps({"text": text, "info": info}))
+    info["seconds"] = round(time.perf_counter() - started, 4)
+    return text, info
+
+
+def ocr_image(content: bytes) -> str:
+    """OCR a single image attachment (JPEG etc.), using the attachment cache."""
+    cache = get_ocr_cache()
+    key = _cache_key(content, 0, False)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+    from PIL import Image
+
+    with Image.open(_stream(content)) as image, ocr_engine.preprocess(image) as prepared:
+        text = ocr_engine.get_engine().image_to_string(prepared)
+    cache.put(key, text)
+    return text
@@ -0,0 +1,179 @@
+"""
+OCR engines behind one interface, used by ocr.py for PDF pages and image attachments.
+
+    engine = get_engine()
+    text = engine.image_to_string(preprocess(image, dpi))
+
+TesserocrEngine (default) keeps tesserocr.PyTessBaseAPI handles open for the life
+of the process, one per thread (a handle is not thread safe), so each page or
+image is passed to Tesseract in memory and the language data is loaded once.
+PytesseractEngine is the fallback: pytesseract starts the tesseract binary for
+every image and passes it through temporary files. With OCR_ENGINE=auto,
+tesserocr is used when it is installed and a handle can be opened.
+
+preprocess() prepares an image for either engine: grayscale, scaled down to
+OCR_TARGET_DPI when its resolution is known to be higher, and with OCR_BINARIZE
+set, binarized at an Otsu threshold.
+
+Configuration (environment variables):
+    OCR_ENGINE (auto | tesserocr | pytesseract, default auto), OCR_LANG (default eng),
+    OCR_TARGET_DPI (default 300), OCR_BINARIZE (default 1), TESSDATA_PREFIX
+"""
+import os
+import threading
+
+OCR_ENGINE = os.getenv("OCR_ENGINE", "auto").lower()
+OCR_LANG = os.getenv("OCR_LANG", "eng")
+OCR_TARGET_DPI = int(os.getenv("OCR_TARGET_DPI", "300"))
+OCR_BINARIZE = os.getenv("OCR_BINARIZE", "1") not in ("0", "false", "False")
+
+_engine = None
+_lock = threading.Lock()
+
+
+class TesserocrEngine:
+    """Long-lived Tesseract API handles (tesserocr), one per thread."""
+
+    name = "tesserocr"
+
+    def __init__(self, lang: str = None):
+        import tesserocr
+
+        self._tesserocr = tesserocr
+        self.lang = lang or OCR_LANG
+        self._local = threading.local()
+        # Open this thread's handle now, so a missing library or language fails here rather than on the first page.
+        self._api()
+
+    def _api(self):
+        api = getattr(self._local, "api", None)
+        if api is None:
+            path = os.getenv("TESSDATA_PREFIX")
+            api = self._tesserocr.PyTessBaseAPI(path=path, lang=self.lang) if path else \
+                self._tesserocr.PyTessBaseAPI(lang=self.lang)
+            self._local.api = api
+        return api
+
+    def image_to_string(self, image) -> str:
+        api = self._api()
+        api.SetImage(image)
+        try:
+            return api.GetUTF8Text()
+        finally:
+            api.Clear()
+
+
+class PytesseractEngine:
+    """One tesseract process per image (pytesseract)."""
+
+    name = "pytesseract"
+
+    def __init__(self, lang: str = None):
+        import pytesseract
+
+        self._pytesseract = pytesseract
+        self.lang = lang or OCR_LANG
+
+    def image_to_string(self, image) -> str:
+        return self._pytesseract.image_to_string(image, lang=self.lang)
+
+
+ENGINES = {"tesserocr": TesserocrEngine, "pytesseract": PytesseractEngine}
+
+
+def _engine_from_env():
+    if OCR_ENGINE in ENGINES:
+        return ENGINES[OCR_ENGINE]()
+    try:
+        return TesserocrEngine()
+    except Exception as e:
+        print(f"tesserocr unavailable, using pytesseract: {e}")
+        return PytesseractEngine()
+
+
+def get_engine():
+    """The process-wide OCR engine (created on first use, see OCR_ENGINE)."""
+    global _engine
+    with _lock:
+        if _engine is None:
+            _engine = _engine_from_env()
+        return _engine
+
+
+def set_engine(engine):
+    """Replace the process-wide engine (e.g. to compare engines in a benchmark)."""
+    global _engine
+    with _lock:
+        _engine = engine
+
+
+def cache_tag() -> str:
+    """Engine, language and preprocessing settings that the OCR output depends on, for cache keys."""
+    try:
+        engine = get_engine()
+        name, lang = getattr(engine, "name", type(engine).__name__), getattr(engine, "lang", OCR_LANG)
+    except Exception:
+        # No engine can be opened; only text-layer results will be cached under this tag.
+        name, lang = OCR_ENGINE, OCR_LANG
+    return f"{name}:{lang}:{OCR_TARGET_DPI}:{int(OCR_BINARIZE)}"
+
+
+def _otsu_threshold(histogram: list) -> int:
+    total = sum(histogram)
+    weighted_total = sum(level * count for level, count in enumerate(histogram))
+    background = weighted_background = 0
+    best_threshold, best_variance = 127, -1.0
+    for level, count in enumerate(histogram):
+        background += count
+        if background == 0:
+            continue
+        foreground = total - background
+        if foreground == 0:
+            break
+        weighted_background += level * count
+        mean_background = weighted_background / background
+        mean_foreground = (weighted_total - weighted_background) / foreground
+        variance = background * foreground * (mean_background - mean_foreground) ** 2
+        if variance > best_variance:
+            best_threshold, best_variance = level, variance
+    return best_threshold
+
+
+def preprocess(image, dpi: float = None, target_dpi: int = None, binarize: bool = None):
+    """
+    Grayscale copy of `image` for OCR, scaled down to target_dpi when `dpi` (or the
+    resolution stored in the image) is higher, and binarized when `binarize` is set.
+    """
+    target_dpi = target_dpi or OCR_TARGET_DPI
+    binarize = OCR_BINARIZE if binarize is None else binarize
+    from PIL import Image
+
+    if dpi is None:
+        stored = image.info.get("dpi")
+        dpi = float(stored[0]) if stored else None
+    result = image.convert("L") if image.mode != "L" else image.copy()
+    if dpi and dpi > target_dpi:
+        scale = target_dpi / dpi
+        resized = result.resize((max(1, round(result.width * scale)), max(1, round(result.height * scale))),
+                                Image.LANCZOS)
+        result.close()
+        result = resized
+    if binarize:
+        threshold = _otsu_threshold(result.histogram())
+        binary = result.point(lambda value: 255 if value > threshold else 0)
+        result.close()
+        result = binary
+    return result
+
+
+def report_missing(error: ImportError):
+    print(f"OCR dependency missing ({error}): scanned PDF pages and images cannot be read. "
+          f"Install the OCR requirements (pip install -e \".[ocr]\", see requirements.txt).")
+
+
+def warm_up():
+    """Open the engine (and this thread's Tesseract handle) now instead of on the first page."""
+    try:
+        get_engine()
+    except ImportError as e:
+        report_missing(e)
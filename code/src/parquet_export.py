@@ -0,0 +1,226 @@
+"""
+Columnar export of the results store for analytics.
+
+Each stored result is flattened into typed columns:
+    hash, created_at (timestamp, UTC), is_duplicate, duplicate_reason, source, parse_error,
+    request_type, sub_type, confidence          (the primary request type)
+    request_types                               (list of {request_type, sub_type, confidence, reason})
+    field_<name>                                (one string column per default extraction field)
+    extracted_fields                            (map of every extracted field, custom ones included)
+and written as Parquet under <root>/processed_date=YYYY-MM-DD/ (Hive partitioning).
+Exports are incremental: the store position reached is kept in <root>/_export_state.json
+and the next run only writes records appended since then, as new files.
+
+read_results() opens the partitioned dataset with filters pushed down to partition
+pruning (dates) and Parquet row group statistics (everything else), so a report over
+months of history only reads the matching files, row groups and columns.
+
+Usage:
+    python parquet_export.py export [root]
+"""
+import datetime
+import json
+import os
+import re
+import sys
+import uuid
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from defaults import DEFAULT_EXTRACTION_FIELDS
+from response_parser import classification_of, extracted_fields_of, load_result, request_types_of
+from results_store import get_store
+
+DEFAULT_EXPORT_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results_parquet")
+STATE_FILE = "_export_state.json"
+PARTITION_COLUMN = "processed_date"
+ROW_GROUP_ROWS = 50000
+
+REQUEST_TYPE_ENTRY = pa.struct([
+    ("request_type", pa.string()),
+    ("sub_type", pa.string()),
+    ("confidence", pa.float64()),
+    ("reason", pa.string()),
+])
+
+PARTITIONING = ds.partitioning(pa.schema([(PARTITION_COLUMN, pa.date32())]), flavor="hive")
+
+
+def field_column(field: str) -> str:
+    return "field_" + re.sub(r"\W+", "_", field.lower()).strip("_")
+
+
+def _text(value):
+    if value is None:
+        return None
+    if isinstance(value, (list, tuple)):
+        return ", ".join(str(item) for item in value)
+    return value if isinstance(value, str) else json.dumps(value)
+
+
+def results_schema(fields: list = None) -> pa.Schema:
+    fields = DEFAULT_EXTRACTION_FIELDS if fields is None else fields
+    return pa.schema([
+        ("hash", pa.string()),
+        ("created_at", pa.timestamp("us", tz="UTC")),
+        ("is_duplicate", pa.bool_()),
+        ("duplicate_reason", pa.string()),
+        ("source", pa.string()),
+        ("parse_error", pa.bool_()),
+        ("request_type", pa.string()),
+        ("sub_type", pa.string()),
+        ("confidence", pa.float64()),
+        ("request_types", pa.list_(REQUEST_TYPE_ENTRY)),
+        *[(field_column(field), pa.string()) for field in fields],
+        ("extracted_fields", pa.map_(pa.string(), pa.string())),
+    ])
+
+
+def flatten_record(record: dict, fields: list = None) -> dict:
+    """One row of results_schema(fields) for a results store record."""
+    fields = DEFAULT_EXTRACTION_FIELDS if fields is None else fields
+    result = load_result(record["info"]) if record["info"] else {}
+    request_type, sub_type, confidence = classification_of(result)
+    extracted = {str(name): _text(value) for name, value in extracted_fields_of(result).items()}
+    lowered = {name.lower(): value for name, value in extracted.items()}
+    meta = record.get("meta") or {}
+    row = {
+        "hash": record["hash"],
+        "created_at": datetime.datetime.fromtimestamp(record["created_at"], tz=datetime.timezone.utc),
+        "is_duplicate": bool(record["is_duplicate"]),
+        "duplicate_reason": meta.get("duplicate_reason"),
+        "source": meta.get("source"),
+        "parse_error": bool(result.get("parse_error")),
+        "request_type": _text(request_type),
+        "sub_type": _text(sub_type),
+        "confidence": confidence,
+        "request_types": [{"request_type": _text(name), "sub_type": _text(sub), "confidence": score, "reason": _text(reason)}
+                          for name, sub, score, reason in request_types_of(result)],
+        "extracted_fields": list(extracted.items()),
+    }
+    for field in fields:
+        row[field_column(field)] = lowered.get(field.lower())
+    return row
+
+
+def _read_state(root: str) -> dict:
+    path = os.path.join(root, STATE_FILE)
+    if not os.path.exists(path):
+        return {"position": 0, "rows": 0}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_state(root: str, state: dict):
+    path = os.path.join(root, STATE_FILE)
+    partial = f"{path}.tmp"
+    with open(partial, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(partial, path)
+
+
+def _write_partitions(root: str, rows: list, schema: pa.Schema) -> int:
+    by_date = {}
+    for row in rows:
+        by_date.setdefault(row["created_at"].date(), []).append(row)
+    name = f"part-{uuid.uuid4().hex}.parquet"
+    for day, day_rows in by_date.items():
+        directory = os.path.join(root, f"{PARTITION_COLUMN}={day.isoformat()}")
+        os.makedirs(directory, exist_ok=True)
+        # Written under a dot name (ignored by readers) and renamed once complete.
+        partial = os.path.join(directory, f".{name}")
+        # Sorted by request type (then time) so row group statistics can skip other types.
+        day_rows.sort(key=lambda row: (row["request_type"] or "", row["created_at"]))
+        pq.write_table(pa.Table.from_pylist(day_rows, schema=schema), partial, compression="zstd",
+                       row_group_size=ROW_GROUP_ROWS)
+        os.replace(partial, os.path.join(directory, name))
+    return len(by_date)
+
+
+def export_incremental(root: str = DEFAULT_EXPORT_ROOT, store=None, fields: list = None,
+                       chunk_rows: int = 100000) -> dict:
+    """
+    Append the records added to the store since the last export to the Parquet dataset
+    under `root`. Returns {"rows", "files", "position"}.
+    """
+    store = store or get_store()
+    schema = results_schema(fields)
+    os.makedirs(root, exist_ok=True)
+    state = _read_state(root)
+    position = state["position"]
+    exported = files = 0
+    rows = []
+    for position_after, record in store.iter_records_after(position):
+        rows.append(flatten_record(record, fields))
+        position = position_after
+        if len(rows) >= chunk_rows:
+            files += _write_partitions(root, rows, schema)
+            exported += len(rows)
+            rows = []
+            _write_state(root, {"position": position, "rows": state["rows"] + exported})
+    if rows:
+        files += _write_partitions(root, rows, schema)
+        exported += len(rows)
+    _write_state(root, {"position": position, "rows": state["rows"] + exported})
+    return {"rows": exported, "files": files, "position": position}
+
+
+def open_dataset(root: str = DEFAULT_EXPORT_ROOT) -> ds.Dataset:
+    return ds.dataset(root, format="parquet", partitioning=PARTITIONING)
+
+
+def filter_expression(filters: dict = None):
+    """
+    pyarrow expression for the results store filter dict (request_type, sub_type,
+    min_confidence, max_confidence, is_duplicate, since, until as epoch seconds).
+    """
+    filters = filters or {}
+    expression = None
+
+    def both(condition):
+        return condition if expression is None else expression & condition
+
+    if filters.get("request_type") is not None:
+        expression = both(ds.field("request_type") == filters["request_type"])
+    if filters.get("sub_type") is not None:
+        expression = both(ds.field("sub_type") == filters["sub_type"])
+    if filters.get("min_confidence") is not None:
+        expression = both(ds.field("confidence") >= filters["min_confidence"])
+    if filters.get("max_confidence") is not None:
+        expression = both(ds.field("confidence") <= filters["max_confidence"])
+    if filters.get("is_duplicate") is not None:
+        expression = both(ds.field("is_duplicate") == bool(filters["is_duplicate"]))
+    for name, compare in (("since", "__ge__"), ("until", "__lt__")):
+        if filters.get(name) is None:
+            continue
+        moment = datetime.datetime.fromtimestamp(filters[name], tz=datetime.timezone.utc)
+        expression = both(getattr(ds.field("created_at"), compare)(pa.scalar(moment, pa.timestamp("us", tz="UTC"))))
+        # The same bound on the partition column lets whole directories be skipped.
+        day = moment.date()
+        if name == "since":
+            expression = both(ds.field(PARTITION_COLUMN) >= pa.scalar(day, pa.date32()))
+        else:
+            expression = both(ds.field(PARTITION_COLUMN) <= pa.scalar(day, pa.date32()))
+    return expression
+
+
+def read_results(root: str = DEFAULT_EXPORT_ROOT, filters: dict = None, columns: list = None,
+                 expression=None) -> pa.Table:
+    """
+    Exported results matching `filters` (see filter_expression) and / or a pyarrow
+    `expression`, reading only `columns` (all when None).
+    """
+    combined = filter_expression(filters)
+    if expression is not None:
+        combined = expression if combined is None else combined & expression
+    return open_dataset(root).to_table(columns=columns, filter=combined)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1] == "export":
+        summary = export_incremental(sys.argv[2] if len(sys.argv) > 2 else DEFAULT_EXPORT_ROOT)
+        print(f"Exported {summary['rows']} results in {summary['files']} files (store position {summary['position']})")
+    else:
+        print("usage: python parquet_export.py export [root]")
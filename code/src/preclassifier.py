@@ -0,0 +1,245 @@
+"""
+Local pre-classifier that answers routine emails without the LLM.
+
+A hashing vectorizer (word unigrams + bigrams, sublinear TF, L2 normalized)
+feeds a multinomial logistic regression over "<request type>|<sub type>"
+labels. It is trained from the labeled samples in loan_samples.xlsx (see
+try.py) plus past LLM results in the results store, and saved to disk.
+When the top class probability is at least the threshold, the type, sub type
+and confidence are returned directly; otherwise the caller defers to the LLM.
+
+Train / retrain with
+    python preclassifier.py train
+
+Configuration (environment variables):
+    PRECLASSIFIER_MODEL_PATH, PRECLASSIFIER_THRESHOLD (default 0.95),
+    PRECLASSIFIER_DISABLED (set to 1 to always use the LLM)
+"""
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+
+import numpy as np
+
+import metrics
+from response_parser import classification_of, parse_llm_json
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_MODEL_PATH = os.path.join(SRC_DIR, "preclassifier.npz")
+SAMPLES_PATH = os.path.join(SRC_DIR, "..", "..", "loan_samples.xlsx")
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+_LABEL_SEPARATOR = "|"
+
+
+class HashingVectorizer:
+    def __init__(self, n_features: int = 2 ** 15):
+        self.n_features = n_features
+
+    def transform_one(self, text: str):
+        """Sparse (indices, values) vector for one document."""
+        tokens = _TOKEN.findall((text or "").lower())
+        terms = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+        counts = {}
+        for term in terms:
+            index = int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=4).digest(), "little")
+            index %= self.n_features
+            counts[index] = counts.get(index, 0) + 1
+        if not counts:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        indices = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+        values = 1.0 + np.log(np.fromiter(counts.values(), dtype=np.float32, count=len(counts)))
+        return indices, values / np.linalg.norm(values)
+
+
+class PreClassifier:
+
+    def __init__(self, classes: list, weights: np.ndarray, bias: np.ndarray, n_features: int):
+        self.classes = list(classes)
+        self.weights = weights
+        self.bias = bias
+        self.vectorizer = HashingVectorizer(n_features)
+
+    @classmethod
+    def train(cls, texts: list, labels: list, n_features: int = 2 ** 15, epochs: int = 40,
+              learning_rate: float = 0.5, l2: float = 1e-4, batch_size: int = 128, seed: int = 0):
+        classes = sorted(set(labels))
+        if len(classes) < 2:
+            raise ValueError("Need examples of at least two request types to train the pre-classifier")
+        vectorizer = HashingVectorizer(n_features)
+        docs = [vectorizer.transform_one(text) for text in texts]
+        targets = np.array([classes.index(label) for label in labels])
+        weights = np.zeros((n_features, len(classes)), dtype=np.float32)
+        bias = np.zeros(len(classes), dtype=np.float32)
+        rng = np.random.RandomState(seed)
+
+        for _ in range(epochs):
+            order = rng.permutation(len(docs))
+            for start in range(0, len(order), batch_size):
+                batch = order[start:start + batch_size]
+                x = np.zeros((len(batch), n_features), dtype=np.float32)
+                for row, doc in enumerate(batch):
+                    indices, values = docs[doc]
+                    x[row, indices] = values
+                probabilities = _softmax(x @ weights + bias)
+                probabilities[np.arange(len(batch)), targets[batch]] -= 1.0
+                probabilities /= len(batch)
+                weights -= learning_rate * (x.T @ probabilities + l2 * weights)
+                bias -= learning_rate * probabilities.sum(axis=0)
+        return cls(classes, weights, bias, n_features)
+
+    def predict(self, text: str):
+        """(request type, sub type, confidence) of the most likely class."""
+        indices, values = self.vectorizer.transform_one(text)
+        scores = values @ self.weights[indices] + self.bias
+        probabilities = _softmax(scores[None, :])[0]
+        best = int(np.argmax(probabilities))
+        request_type, _, sub_type = self.classes[best].partition(_LABEL_SEPARATOR)
+        return request_type, sub_type or None, float(probabilities[best])
+
+    def save(self, path: str):
+        np.savez_compressed(path, classes=np.array(self.classes), weights=self.weights, bias=self.bias,
+                            n_features=np.array(self.vectorizer.n_features))
+
+    @classmethod
+    def load(cls, path: str):
+        data = np.load(path, allow_pickle=False)
+        return cls(data["classes"].tolist(), data["weights"], data["bias"], int(data["n_features"]))
+
+
+def _softmax(scores: np.ndarray) -> np.ndarray:
+    scores = scores - scores.max(axis=1, keepdims=True)
+    exp = np.exp(scores)
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+def _label(request_type, sub_type) -> str:
+    return f"{request_type}{_LABEL_SEPARATOR}{sub_type or ''}"
+
+
+def load_sample_examples(path: str = SAMPLES_PATH):
+    """(texts, labels) from the labeled samples spreadsheet written by try.py."""
+    import pandas as pd
+
+    texts, labels = [], []
+    for _, row in pd.read_excel(path).iterrows():
+        try:
+            email_text = json.loads(row["input"])["Email content"]
+        except (TypeError, ValueError, KeyError):
+            continue
+        request_type, sub_type, _ = classification_of(parse_llm_json(row["output"]))
+        if request_type:
+            texts.append(email_text)
+            labels.append(_label(request_type, sub_type))
+    return texts, labels
+
+
+def load_store_examples(store):
+    """(texts, labels) from past LLM results that kept their email text."""
+    texts, labels = [], []
+    for record in store.iter_records():
+        email_text = record["meta"].get("email_text")
+        if record["is_duplicate"] or not email_text or record["meta"].get("source") == "local-classifier":
+            continue
+        request_type, sub_type, _ = classification_of(parse_llm_json(record["info"]))
+        if request_type:
+            texts.append(email_text)
+            labels.append(_label(request_type, sub_type))
+    return texts, labels
+
+
+def train_default(path: str = None) -> PreClassifier:
+    from results_store import get_store
+
+    texts, labels = [], []
+    if os.path.exists(SAMPLES_PATH):
+        try:
+            texts, labels = load_sample_examples()
+        except Exception as e:
+            print(f"Could not load labeled samples from {SAMPLES_PATH}: {e}")
+    store_texts, store_labels = load_store_examples(get_store())
+    model = PreClassifier.train(texts + store_texts, labels + store_labels)
+    model.save(path or os.getenv("PRECLASSIFIER_MODEL_PATH", DEFAULT_MODEL_PATH))
+    print(f"Trained pre-classifier on {len(texts) + len(store_texts)} examples, {len(model.classes)} classes")
+    return model
+
+
+class PreClassifierStats:
+    """Hit rate of this process; also counted as metrics' preclassifier_total{outcome}."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.seen = 0
+        self.hits = 0
+
+    def record(self, hit: bool):
+        with self.lock:
+            self.seen += 1
+            self.hits += int(hit)
+        metrics.increment("preclassifier_total", outcome="hit" if hit else "deferred")
+
+    def hit_rate(self) -> float:
+        with self.lock:
+            return self.hits / self.seen if self.seen else 0.0
+
+
+STATS = PreClassifierStats()
+_model = None
+_model_loaded = False
+_model_lock = threading.Lock()
+
+
+def get_preclassifier():
+    """Model saved by `python preclassifier.py train`, or None when there is none / it is disabled."""
+    global _model, _model_loaded
+    if os.getenv("PRECLASSIFIER_DISABLED", "0") not in ("0", "", "false", "False"):
+        return None
+    with _model_lock:
+        if not _model_loaded:
+            _model_loaded = True
+            path = os.getenv("PRECLASSIFIER_MODEL_PATH", DEFAULT_MODEL_PATH)
+            if os.path.exists(path):
+                _model = PreClassifier.load(path)
+        return _model
+
+
+def classify(email_text: str, attachment_text: str, request_type_defs: str):
+    """
+    (request type, sub type, confidence) when the local model is confident enough and
+    the type exists in `request_type_defs`, otherwise None (the caller uses the LLM).
+    """
+    model = get_preclassifier()
+    if model is None:
+        return None
+    request_type, sub_type, confidence = model.predict(email_text + "\n" + attachment_text)
+    threshold = float(os.getenv("PRECLASSIFIER_THRESHOLD", "0.95"))
+    hit = confidence >= threshold and f'"{request_type}"' in (request_type_defs or "")
+    STATS.record(hit)
+    return (request_type, sub_type, confidence) if hit else None
+
+
+def build_result(request_type: str, sub_type: str, confidence: float, extraction_fields: list) -> dict:
+    """Result in the same shape as the LLM output (fields are left for the extraction step)."""
+    return {
+        "extracted_fields": {field: None for field in extraction_fields},
+        "request type": {
+            "Primary Request Type": request_type,
+            "Request Type": [{
+                request_type: {
+                    "Confidence score": round(confidence, 4),
+                    "Reason": "Classified by the local pre-classifier.",
+                    "request sub type": sub_type,
+                }
+            }],
+        },
+    }
+
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1] == "train":
+        train_default()
+    else:
+        print("usage: python preclassifier.py train")
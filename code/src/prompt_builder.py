@@ -0,0 +1,223 @@
+"""
+Prompt construction for call_llm_for_processing.
+
+The prompt is split into:
+  - a static prefix (instructions, rules, request type definitions, output
+    format) that only depends on the prompt configuration; it is built once per
+    configuration and cached, and it comes first so provider-side prefix caching
+    can reuse it,
+  - the per-email part (fields to extract, email content, attachment content).
+Each section appears once. Attachment text beyond the token budget is cut down
+to its most relevant chunks (term overlap with the fields, request types and
+email body), kept in document order.
+
+Several emails can share one prompt (build_batch_prompt); the static prefix is
+then sent once for the whole batch. Emails classified already (semantic cache
+hits) only get their fields extracted (build_extraction_prompt).
+
+Token counts are estimated at ~4 characters per token.
+
+Configuration (environment variables):
+    PROMPT_ATTACHMENT_TOKEN_BUDGET (default 2000), PROMPT_CHARS_PER_TOKEN (default 4)
+"""
+import os
+import re
+from collections import Counter, namedtuple
+from functools import lru_cache
+
+Prompt = namedtuple("Prompt", ["text", "stats"])
+
+_TERM = re.compile(r"[a-z][a-z0-9]{2,}")
+_STOPWORDS = {"the", "and", "for", "with", "this", "that", "from", "are", "was", "has", "have", "you",
+              "your", "our", "will", "been", "please", "dear", "regards", "thank", "description",
+              "sub", "request", "types"}
+
+INSTRUCTIONS = ("You are an expert in processing loan service requests at Wells Fargo. As part of the "
+                "Commercial Bank Lending Service team you daily get a significant volume of servicing "
+                "requests through emails which may contain attachments as well. Given the input you have "
+                "to extract key fields, classify the email into its request type and sub request types "
+                "along with the confidence score strictly based on the rules in the input. The input "
+                "contains the email content in text form along with the text of attachments "
+                "(pdf, jpeg, jpg, txt etc.).")
+
+OUTPUT_FORMAT = """output should be of the form -
+
+    "extracted fields" ,
+    "primary request types",
+    "request types": "sub request types" , "confidence score", "reason for the classification\""""
+
+
+def count_tokens(text: str) -> int:
+    chars_per_token = float(os.getenv("PROMPT_CHARS_PER_TOKEN", "4"))
+    return int(len(text or "") / chars_per_token + 0.5)
+
+
+@lru_cache(maxsize=64)
+def static_prefix(rules: str, request_type_defs: str) -> str:
+    """Everything that depends only on the prompt configuration."""
+    return (f"{INSTRUCTIONS}\n\n"
+            f"Rules:\n{(rules or '').strip()}\n\n"
+            f"Request type description:\n{(request_type_defs or '').strip()}\n\n"
+            f"{OUTPUT_FORMAT}\n")
+
+
+def _terms(text: str) -> list:
+    return [term for term in _TERM.findall((text or "").lower()) if term not in _STOPWORDS]
+
+
+@lru_cache(maxsize=64)
+def _config_terms(request_type_defs: str, fields: tuple) -> frozenset:
+    return frozenset(_terms(request_type_defs) + _terms(" ".join(fields)))
+
+
+def _chunks(text: str, size: int) -> list:
+    """Split on blank lines / lines, then pack pieces into chunks of about `size` characters."""
+    pieces = [piece for piece in re.split(r"\n\s*\n|\n", text) if piece.strip()]
+    chunks, current = [], ""
+    for piece in pieces:
+        while len(piece) > size:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(piece[:size])
+            piece = piece[size:]
+        if current and len(current) + len(piece) + 1 > size:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n{piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def fit_attachment_text(attachment_text: str, budget_tokens: int, query_terms: set,
+                        chunk_chars: int = 800) -> str:
+    """Keep the most relevant chunks of `attachment_text` that fit in `budget_tokens`."""
+    if count_tokens(attachment_text) <= budget_tokens:
+        return attachment_text
+    chunks = _chunks(attachment_text, chunk_chars)
+    scored = []
+    for position, chunk in enumerate(chunks):
+        counts = Counter(_terms(chunk))
+        overlap = sum(1 + 0.1 * min(counts[term], 10) for term in query_terms if term in counts)
+        # Ties (and chunks with no overlap) favour the start of the document.
+        scored.append((overlap, -position, position))
+
+    selected, used = [], 0
+    for _, _, position in sorted(scored, reverse=True):
+        tokens = count_tokens(chunks[position])
+        if used + tokens > budget_tokens:
+            continue
+        selected.append(position)
+        used += tokens
+    selected.sort()
+
+    parts, previous = [], -1
+    for position in selected:
+        if position != previous + 1:
+            parts.append(f"[... {position - previous - 1} less relevant section(s) omitted ...]")
+        parts.append(chunks[position])
+        previous = position
+    if previous != len(chunks) - 1:
+        parts.append(f"[... {len(chunks) - previous - 1} less relevant section(s) omitted ...]")
+    return "\n".join(parts)
+
+
+def build_prompt(email_text: str, attachment_text: str, rules: str, request_type_defs: str,
+                 extraction_fields: list, attachment_token_budget: int = None) -> Prompt:
+    """Prompt text plus stats: prompt_tokens, attachment_tokens (before / after budgeting), truncated."""
+    if attachment_token_budget is None:
+        attachment_token_budget = int(os.getenv("PROMPT_ATTACHMENT_TOKEN_BUDGET", "2000"))
+    fields = tuple(extraction_fields or ())
+    prefix = static_prefix(rules, request_type_defs)
+
+    original_attachment_tokens = count_tokens(attachment_text)
+    query_terms = set(_config_terms(request_type_defs, fields)) | set(_terms(email_text))
+    attachment_text = fit_attachment_text(attachment_text or "", attachment_token_budget, query_terms)
+
+    text = (f"{prefix}\n"
+            f"extraction_fields: {list(fields)}\n\n"
+            f"Email Content:\n{email_text}\n\n"
+            f"Attachment content:\n{attachment_text}\n")
+    stats = {
+        "prompt_tokens": count_tokens(text),
+        "static_prefix_tokens": count_tokens(prefix),
+        "attachment_tokens": original_attachment_tokens,
+        "attachment_tokens_sent": count_tokens(attachment_text),
+        "attachment_truncated": count_tokens(attachment_text) < original_attachment_tokens,
+    }
+    return Prompt(text, stats)
+
+
+EXTRACTION_INSTRUCTIONS = ("You are an expert in processing loan service requests at Wells Fargo. The email below "
+                           "has already been classified. Extract only the fields listed in extraction_fields from "
+                           "the email content and attachment content, exactly as they are stated. Answer with a JSON "
+                           "object whose \"extracted_fields\" object has one key per field, null when a field is "
+                           "not stated.")
+
+
+def build_extraction_prompt(email_text: str, attachment_text: str, extraction_fields: list,
+                            attachment_token_budget: int = None) -> Prompt:
+    """
+    Prompt for the extraction_fields alone, for emails whose classification is
+    known already (semantic cache hits); no rules or request type definitions.
+    """
+    if attachment_token_budget is None:
+        attachment_token_budget = int(os.getenv("PROMPT_ATTACHMENT_TOKEN_BUDGET", "2000"))
+    fields = tuple(extraction_fields or ())
+    original_attachment_tokens = count_tokens(attachment_text)
+    query_terms = set(_terms(" ".join(fields))) | set(_terms(email_text))
+    attachment_text = fit_attachment_text(attachment_text or "", attachment_token_budget, query_terms)
+
+    text = (f"{EXTRACTION_INSTRUCTIONS}\n\n"
+            f"extraction_fields: {list(fields)}\n\n"
+            f"Email Content:\n{email_text}\n\n"
+            f"Attachment content:\n{attachment_text}\n")
+    stats = {
+        "prompt_tokens": count_tokens(text),
+        "static_prefix_tokens": count_tokens(EXTRACTION_INSTRUCTIONS),
+        "attachment_tokens": original_attachment_tokens,
+        "attachment_tokens_sent": count_tokens(attachment_text),
+        "attachment_truncated": count_tokens(attachment_text) < original_attachment_tokens,
+    }
+    return Prompt(text, stats)
+
+
+BATCH_INSTRUCTIONS = """You are given {count} separate emails below, each introduced by an "=== Email id: <id> ===" line.
+Process every email independently. Return ONLY a JSON array with exactly one object per email.
+Each object must contain an "id" key with the email id copied exactly, plus the output fields described above
+(extracted fields for that email's extraction_fields, primary request type, request types with sub request
+type, confidence score and reason)."""
+
+
+def build_batch_prompt(emails: list, rules: str, request_type_defs: str,
+                       attachment_token_budget: int = None) -> Prompt:
+    """
+    One prompt for several emails; `emails` is a list of
+    {"id", "email_text", "attachment_text", "extraction_fields"}.
+    """
+    if attachment_token_budget is None:
+        attachment_token_budget = int(os.getenv("PROMPT_ATTACHMENT_TOKEN_BUDGET", "2000"))
+    prefix = static_prefix(rules, request_type_defs)
+    sections = [prefix, BATCH_INSTRUCTIONS.format(count=len(emails))]
+    attachment_tokens = attachment_tokens_sent = 0
+    for email in emails:
+        fields = tuple(email.get("extraction_fields") or ())
+        query_terms = set(_config_terms(request_type_defs, fields)) | set(_terms(email["email_text"]))
+        attachment_text = email.get("attachment_text") or ""
+        attachment_tokens += count_tokens(attachment_text)
+        attachment_text = fit_attachment_text(attachment_text, attachment_token_budget, query_terms)
+        attachment_tokens_sent += count_tokens(attachment_text)
+        sections.append(f"=== Email id: {email['id']} ===\n"
+                        f"extraction_fields: {list(fields)}\n\n"
+                        f"Email Content:\n{email['email_text']}\n\n"
+                        f"Attachment content:\n{attachment_text}\n")
+    text = "\n\n".join(sections)
+    stats = {
+        "prompt_tokens": count_tokens(text),
+        "static_prefix_tokens": count_tokens(prefix),
+        "attachment_tokens": attachment_tokens,
+        "attachment_tokens_sent": attachment_tokens_sent,
+        "attachment_truncated": attachment_tokens_sent < attachment_tokens,
+    }
+    return Prompt(text, stats)
@@ -0,0 +1,417 @@
+"""
+Helpers to read the classification JSON out of LLM output text.
+
+The expected shape follows the samples in try.py:
+    {"extracted_fields": {...},
+     "request type": {"Primary Request Type": "...",
+                      "Request Type": [{"<type>": {"Confidence score": 0.9, "Reason": "...",
+                                                   "request sub type": "..."}}]}}
+
+The model is asked for JSON (response_mime_type="application/json" plus the
+schema from result_schema()), but the parser stays tolerant so a stray remark,
+a markdown fence, a trailing comma, Python literals or a truncated response
+do not cost another LLM call: parse_json_tolerant() scans once, repairs what it
+can and closes any open strings / containers. IncrementalJSONParser applies the
+same repair to a growing buffer of streamed chunks.
+"""
+import json
+
+_CLOSERS = {"{": "}", "[": "]"}
+_PYTHON_LITERALS = {"None": "null", "True": "true", "False": "false"}
+
+
+def _find_start(text: str, expect: str = None) -> int:
+    if expect == "object":
+        return text.find("{")
+    if expect == "array":
+        return text.find("[")
+    starts = [index for index in (text.find("{"), text.find("[")) if index >= 0]
+    return min(starts) if starts else -1
+
+
+class _Scanner:
+    """
+    The single pass behind parse_json_tolerant, resumable so streamed chunks are scanned
+    once: copies the JSON value while dropping trailing commas and translating Python
+    literals, and stops after the value closes (anything after it is ignored). Cut points
+    are (offset in the cleaned text, open containers there) where a truncated value can
+    be cut cleanly: after an opening bracket, before a comma and after a closing bracket.
+    """
+
+    def __init__(self):
+        self.out = []  # cleaned text, one character per item
+        self.stack = []
+        self.in_string = False
+        self.escape = False
+        self.cuts = []
+        self.complete = False
+        # A word cut off at the end of a chunk ("Non"), translated once it is whole.
+        self._word = ""
+
+    def feed(self, text: str):
+        if self.complete:
+            return
+        text = self._word + text
+        self._word = ""
+        out, stack, cuts = self.out, self.stack, self.cuts
+        i = 0
+        n = len(text)
+        while i < n:
+            char = text[i]
+            if self.in_string:
+                out.append(char)
+                if self.escape:
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+                i += 1
+                continue
+            if char == '"':
+                self.in_string = True
+                out.append(char)
+            elif char in "{[":
+                stack.append(char)
+                out.append(char)
+                cuts.append((len(out), tuple(stack)))
+            elif char in "}]":
+                # Drop a trailing comma before the closing bracket.
+                while out and out[-1] in " \t\r\n":
+                    out.pop()
+                if out and out[-1] == ",":
+                    out.pop()
+                if stack:
+                    stack.pop()
+                out.append(char)
+                cuts.append((len(out), tuple(stack)))
+                if not stack:
+                    self.complete = True
+                    return
+            elif char == ",":
+                cuts.append((len(out), tuple(stack)))
+                out.append(char)
+            elif char.isalpha():
+                word_end = i
+                while word_end < n and text[word_end].isalpha():
+                    word_end += 1
+                if word_end == n:
+                    self._word = text[i:]
+                    return
+                out.extend(_PYTHON_LITERALS.get(text[i:word_end], text[i:word_end]))
+                i = word_end
+                continue
+            else:
+                out.append(char)
+            i += 1
+
+    def finish(self):
+        """End of the text: a word left pending is taken as it is."""
+        self.out.extend(_PYTHON_LITERALS.get(self._word, self._word))
+        self._word = ""
+
+    def cleaned(self, end: int = None) -> str:
+        return "".join(self.out if end is None else self.out[:end])
+
+
+def _close(fragment: str, stack: list, in_string: bool) -> str:
+    if in_string:
+        fragment += '"'
+    fragment = fragment.rstrip()
+    if fragment.endswith(","):
+        fragment = fragment[:-1]
+    elif fragment.endswith(":"):
+        fragment += " null"
+    return fragment + "".join(_CLOSERS[opener] for opener in reversed(stack))
+
+
+def parse_json_tolerant(text: str, expect: str = None, partial_strings: bool = True):
+    """
+    Best-effort parse of the first JSON object / array in `text` (`expect` = "object"
+    or "array" restricts which). Returns None when nothing usable is found.
+    With partial_strings=False a string cut off mid-way is dropped rather than closed.
+    """
+    if not text:
+        return None
+    start = _find_start(text, expect)
+    if start < 0:
+        return None
+    scanner = _Scanner()
+    scanner.feed(text[start:])
+    scanner.finish()
+    cleaned = scanner.cleaned()
+    if partial_strings or not scanner.in_string:
+        try:
+            return json.loads(cleaned if scanner.complete else _close(cleaned, scanner.stack, scanner.in_string))
+        except json.JSONDecodeError:
+            pass
+    # Truncated in an awkward place (e.g. after a key): cut back to the last clean point.
+    return _parse_at_cuts(cleaned, scanner.cuts[-50:])
+
+
+def _parse_at_cuts(cleaned: str, cuts: list):
+    """The value cut back to the latest of `cuts` where it parses, or None."""
+    for cut, stack in reversed(cuts):
+        try:
+            return json.loads(_close(cleaned[:cut], list(stack), False))
+        except json.JSONDecodeError:
+            continue
+    return None
+
+
+class IncrementalJSONParser:
+    """
+    Feed streamed chunks; `feed` returns the best partial object parsed so far (or None).
+    Values still being written are left out, so a partial "Fee Pay" is never shown.
+    Each chunk is scanned once (the scan state is kept), and the partial object is only
+    parsed again when the chunk completed a value, cut at the last value it completed.
+    """
+
+    def __init__(self, expect: str = "object"):
+        self.expect = expect
+        self.value = None
+        self._chunks = []
+        self._buffer = ""
+        self._scanner = None
+        self._parsed_cuts = 0
+
+    @property
+    def buffer(self) -> str:
+        """Everything fed so far."""
+        if self._chunks:
+            self._buffer += "".join(self._chunks)
+            self._chunks = []
+        return self._buffer
+
+    def feed(self, chunk: str):
+        chunk = chunk or ""
+        self._chunks.append(chunk)
+        if self._scanner is None:
+            # Opening brackets are single characters, so each chunk can be searched on its own.
+            start = _find_start(chunk, self.expect)
+            if start < 0:
+                return self.value
+            self._scanner = _Scanner()
+            chunk = chunk[start:]
+        scanner = self._scanner
+        scanner.feed(chunk)
+        if len(scanner.cuts) == self._parsed_cuts:
+            return self.value
+        new_cuts = scanner.cuts[self._parsed_cuts:]
+        self._parsed_cuts = len(scanner.cuts)
+        cleaned = scanner.cleaned(new_cuts[-1][0])
+        value = _parse_at_cuts(cleaned, new_cuts[-3:])
+        if value is not None:
+            self.value = value
+        return self.value
+
+
+def parse_llm_json(text: str):
+    """The result object in `text` (tolerant, see parse_json_tolerant); None when there is none."""
+    value = parse_json_tolerant(text, "object")
+    return normalize_result(value) if isinstance(value, dict) else None
+
+
+def parse_llm_json_array(text: str):
+    """The JSON array in `text` (tolerant, see parse_json_tolerant); None when there is none."""
+    value = parse_json_tolerant(text, "array")
+    return value if isinstance(value, list) else None
+
+
+def load_result(text: str) -> dict:
+    """
+    Result object from stored / cached text: the JSON written by the pipeline, or
+    (for records written before JSON mode) whatever parse_llm_json can recover.
+    Unreadable text is wrapped as {"raw_output": text, "parse_error": True}.
+    """
+    try:
+        value = json.loads(text)
+    except (TypeError, ValueError):
+        value = None
+    if not isinstance(value, dict):
+        value = parse_llm_json(text or "")
+    return value if value is not None else {"raw_output": text, "parse_error": True}
+
+
+def normalize_result(result: dict) -> dict:
+    """
+    Convert "Request Type" entries written in the flat schema form
+    {"request type": "Fee Payment", "Confidence score": ...} into the nested form used
+    everywhere else: {"Fee Payment": {"Confidence score": ...}}.
+    """
+    request_type = _get(result, "request type", "request types")
+    entries = _get(request_type, "request type", "request types") if isinstance(request_type, dict) else None
+    if not isinstance(entries, list):
+        return result
+    for position, entry in enumerate(entries):
+        if isinstance(entry, dict):
+            name = _get(entry, "request type", "type")
+            if isinstance(name, str):
+                details = {key: value for key, value in entry.items()
+                           if key.lower().replace("_", " ") not in ("request type", "type")}
+                entries[position] = {name: details}
+    return result
+
+
+def result_schema(extraction_fields: list) -> dict:
+    """
+    Response schema (Gemini OpenAPI subset) for one result with the given fields.
+    Without fields (all filled by the rules) extracted_fields is left out, since an
+    OBJECT without properties is rejected.
+    """
+    nullable_string = {"type": "STRING", "nullable": True}
+    schema = {
+        "type": "OBJECT",
+        "properties": {
+            "request type": {
+                "type": "OBJECT",
+                "properties": {
+                    "Primary Request Type": {"type": "STRING"},
+                    "Request Type": {
+                        "type": "ARRAY",
+                        "items": {
+                            "type": "OBJECT",
+                            "properties": {
+                                "request type": {"type": "STRING"},
+                                "Confidence score": {"type": "NUMBER"},
+                                "Reason": {"type": "STRING"},
+                                "request sub type": nullable_string,
+                            },
+                            "required": ["request type", "Confidence score"],
+                        },
+                    },
+                },
+                "required": ["Primary Request Type", "Request Type"],
+            },
+        },
+        "required": ["request type"],
+    }
+    if extraction_fields:
+        schema["properties"] = dict({"extracted_fields": {
+            "type": "OBJECT",
+            "properties": {field: nullable_string for field in extraction_fields},
+        }}, **schema["properties"])
+    return schema
+
+
+def extraction_schema(extraction_fields: list) -> dict:
+    """Response schema for an extraction-only answer (see prompt_builder.build_extraction_prompt)."""
+    return {
+        "type": "OBJECT",
+        "properties": {
+            "extracted_fields": {
+                "type": "OBJECT",
+                "properties": {field: {"type": "STRING", "nullable": True} for field in extraction_fields},
+            },
+        },
+        "required": ["extracted_fields"],
+    }
+
+
+def schema_errors(result: dict) -> list:
+    """
+    Ways a parsed (normalized) result departs from result_schema(), as readable
+    strings; empty when it has the expected shape.
+    """
+    if not isinstance(result, dict):
+        return ["not an object"]
+    errors = []
+    fields = _get(result, "extracted fields")
+    if fields is not None and not isinstance(fields, dict):
+        errors.append("extracted_fields is not an object")
+    request_type = _get(result, "request type", "request types")
+    if not isinstance(request_type, dict):
+        return errors + ["missing request type"]
+    primary = _get(request_type, "primary request type", "primary request types")
+    if not isinstance(primary, str) or not primary.strip():
+        errors.append("missing Primary Request Type")
+    entries = _get(request_type, "request type", "request types")
+    if not isinstance(entries, list) or not entries:
+        return errors + ["missing Request Type entries"]
+    for name, _, confidence, _ in request_types_of(result) or [(None, None, None, None)]:
+        if confidence is None:
+            errors.append(f"no Confidence score for {name}")
+    if isinstance(primary, str) and primary not in [name for name, _, _, _ in request_types_of(result)]:
+        errors.append(f"Primary Request Type {primary} has no Request Type entry")
+    return errors
+
+
+def batch_result_schema(extraction_fields: list) -> dict:
+    """Schema for the JSON array answered to a multi-email prompt."""
+    item = result_schema(extraction_fields)
+    item["properties"] = dict(item["properties"], id={"type": "STRING"})
+    item["required"] = ["id"] + item["required"]
+    return {"type": "ARRAY", "items": item}
+
+
+def _get(mapping: dict, *names):
+    # The model is not consistent about key casing / spacing ("extracted fields" vs "extracted_fields").
+    wanted = {name.lower().replace("_", " ") for name in names}
+    for key, value in mapping.items():
+        if isinstance(key, str) and key.lower().replace("_", " ") in wanted:
+            return value
+    return None
+
+
+def classification_of(result: dict):
+    """
+    (primary request type, its sub type, its confidence score) from a parsed result,
+    or (None, None, None) when the result does not have the expected shape.
+    """
+    if not isinstance(result, dict):
+        return None, None, None
+    request_type = _get(result, "request type", "request types") or {}
+    if not isinstance(request_type, dict):
+        return None, None, None
+    primary = _get(request_type, "primary request type", "primary request types")
+    sub_type, confidence = None, None
+    for entry in _get(request_type, "request type", "request types") or []:
+        if isinstance(entry, dict) and primary in entry and isinstance(entry[primary], dict):
+            details = entry[primary]
+            sub_type = _get(details, "request sub type", "sub request type", "sub request types")
+            confidence = _get(details, "confidence score", "confidence")
+            break
+    try:
+        confidence = float(confidence) if confidence is not None else None
+    except (TypeError, ValueError):
+        confidence = None
+    return primary, sub_type, confidence
+
+
+def request_types_of(result: dict) -> list:
+    """Every "Request Type" entry as (request type, sub type, confidence score, reason)."""
+    if not isinstance(result, dict):
+        return []
+    request_type = _get(result, "request type", "request types")
+    entries = _get(request_type, "request type", "request types") if isinstance(request_type, dict) else None
+    found = []
+    for entry in entries if isinstance(entries, list) else []:
+        if not isinstance(entry, dict):
+            continue
+        for name, details in entry.items():
+            if not isinstance(details, dict):
+                continue
+            confidence = _get(details, "confidence score", "confidence")
+            try:
+                confidence = float(confidence) if confidence is not None else None
+            except (TypeError, ValueError):
+                confidence = None
+            found.append((name, _get(details, "request sub type", "sub request type", "sub request types"),
+                          confidence, _get(details, "reason")))
+    return found
+
+
+def extracted_fields_of(result: dict) -> dict:
+    if not isinstance(result, dict):
+        return {}
+    fields = _get(result, "extracted fields")
+    return fields if isinstance(fields, dict) else {}
+
+
+def merge_extracted_fields(result: dict, fields: dict) -> dict:
+    """Overlay `fields` (e.g. found by rule_extractor) on the result's extracted fields, in place."""
+    key = next((k for k in result if isinstance(k, str) and k.lower().replace("_", " ") == "extracted fields"),
+               "extracted_fields")
+    current = result.get(key) if isinstance(result.get(key), dict) else {}
+    result[key] = dict(current, **fields)
+    return result
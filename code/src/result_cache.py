@@ -0,0 +1,142 @@
+"""
+Persistent, content-addressed cache of LLM results.
+
+Entries are keyed by a SHA-256 over the normalized email body, the attachment
+text and the prompt configuration (rules, request type definitions, extraction
+fields), so a re-sent email with new headers still hits the cache while a
+change in the prompt configuration does not. Raw email hashes are also mapped
+to their cache key so exact re-sends are answered before any parsing / OCR.
+
+Backed by a single SQLite file with TTL expiry and LRU eviction.
+
+Configuration (environment variables):
+    RESULT_CACHE_PATH, RESULT_CACHE_TTL_SECONDS, RESULT_CACHE_MAX_ENTRIES
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "result_cache.sqlite3")
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Collapse whitespace / line endings so formatting-only differences hash the same."""
+    return _WHITESPACE.sub(" ", text or "").strip()
+
+
+def make_cache_key(email_text: str, attachment_text: str, rules: str, request_type_defs: str,
+                   extraction_fields: list) -> str:
+    payload = json.dumps([
+        normalize_text(email_text),
+        normalize_text(attachment_text),
+        normalize_text(rules),
+        normalize_text(request_type_defs),
+        [normalize_text(field) for field in extraction_fields or []],
+    ])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    # Eviction scans are amortized over this many writes.
+    EVICT_EVERY = 100
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, ttl_seconds: float = 30 * 24 * 3600,
+                 max_entries: int = 100000):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS results_accessed_at ON results (accessed_at);
+            CREATE TABLE IF NOT EXISTS email_hashes (
+                email_hash TEXT PRIMARY KEY,
+                key TEXT NOT NULL
+            );
+        """)
+        self._conn.commit()
+
+    def get(self, key: str):
+        """Return the cached result for `key`, or None on a miss / expired entry."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, created_at FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, created_at = row
+            if self.ttl_seconds and now - created_at > self.ttl_seconds:
+                self._conn.execute("DELETE FROM results WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE results SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            return value
+
+    def get_by_email_hash(self, email_hash: str):
+        """Look up the result of a byte-identical email seen before."""
+        with self._lock:
+            row = self._conn.execute("SELECT key FROM email_hashes WHERE email_hash = ?", (email_hash,)).fetchone()
+        return self.get(row[0]) if row else None
+
+    def put(self, key: str, value: str, email_hash: str = None):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            if email_hash:
+                self._conn.execute("INSERT OR REPLACE INTO email_hashes (email_hash, key) VALUES (?, ?)",
+                                   (email_hash, key))
+            self._conn.commit()
+            self._writes += 1
+            if self._writes % self.EVICT_EVERY == 0:
+                self._evict(now)
+
+    def _evict(self, now: float):
+        if self.ttl_seconds:
+            self._conn.execute("DELETE FROM results WHERE created_at < ?", (now - self.ttl_seconds,))
+        count = self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        if self.max_entries and count > self.max_entries:
+            self._conn.execute(
+                "DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY accessed_at LIMIT ?)",
+                (count - self.max_entries,),
+            )
+        self._conn.execute("DELETE FROM email_hashes WHERE key NOT IN (SELECT key FROM results)")
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> ResultCache:
+    """Process-wide cache, opened on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResultCache(
+                path=os.getenv("RESULT_CACHE_PATH", DEFAULT_CACHE_PATH),
+                ttl_seconds=float(os.getenv("RESULT_CACHE_TTL_SECONDS", str(30 * 24 * 3600))),
+                max_entries=int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "100000")),
+            )
+        return _cache
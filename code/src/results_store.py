@@ -0,0 +1,551 @@
+"""
+Pluggable results store for processed emails.
+
+Replaces the read-whole-CSV / append / rewrite-whole-CSV cycle with an append
+path that costs O(1) per email and an index on the email SHA-256 hash:
+  - SQLiteResultsStore (default): SQLite in WAL mode, one writer connection
+    per process behind a lock, readers never block the writer.
+  - JSONLResultsStore: append-only JSON lines file plus a sidecar index
+    (hash -> byte offset) that is rebuilt from the tail on open.
+
+Every record has: hash, created_at, info (the classification result),
+is_duplicate, meta (a JSON object for pipeline details) and the classification
+summary taken from info when it is appended: request_type, sub_type, confidence.
+
+The dashboard reads pages of records through query(filters, offset, limit),
+totals through summary(filters) and the filter choices through choices().
+Filters are a dict with any of: request_type, sub_type, min_confidence,
+max_confidence, is_duplicate (True / False) and since / until (epoch seconds,
+until exclusive). SQLite answers these from indexed columns; the JSONL store
+scans the file, so it is meant for small stores. version() changes whenever a
+record is added and is cheap, so callers can cache on it.
+
+The old service_requests.csv can be imported once with
+    python results_store.py migrate [path/to/service_requests.csv]
+
+Configuration (environment variables):
+    RESULTS_STORE (sqlite | jsonl), RESULTS_STORE_PATH
+"""
+import abc
+import csv
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+from response_parser import classification_of, load_result
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+LEGACY_CSV_PATH = os.path.join(SRC_DIR, "service_requests.csv")
+DEFAULT_SQLITE_PATH = os.path.join(SRC_DIR, "service_requests.sqlite3")
+DEFAULT_JSONL_PATH = os.path.join(SRC_DIR, "service_requests.jsonl")
+
+
+def summarize(info: str):
+    """(request type, sub type, confidence) of a stored result, Nones where missing."""
+    if not info:
+        return None, None, None
+    request_type, sub_type, confidence = classification_of(load_result(info))
+    if isinstance(sub_type, (list, tuple)):
+        sub_type = ", ".join(str(value) for value in sub_type) or None
+    return (str(request_type) if request_type else None,
+            str(sub_type) if sub_type else None,
+            confidence)
+
+
+def _matches(record: dict, filters: dict) -> bool:
+    filters = filters or {}
+    confidence = record.get("confidence")
+    checks = (
+        ("request_type", lambda value: record.get("request_type") == value),
+        ("sub_type", lambda value: record.get("sub_type") == value),
+        ("min_confidence", lambda value: confidence is not None and confidence >= value),
+        ("max_confidence", lambda value: confidence is not None and confidence <= value),
+        ("is_duplicate", lambda value: record["is_duplicate"] == bool(value)),
+        ("since", lambda value: record["created_at"] >= value),
+        ("until", lambda value: record["created_at"] < value),
+    )
+    return all(check(filters[name]) for name, check in checks if filters.get(name) is not None)
+
+
+def _summary_of(rows) -> dict:
+    """Totals from (request type, sub type, count, duplicates, confidence sum, confidence count) rows."""
+    by_type = {}
+    summary = {"total": 0, "duplicates": 0, "by_request_type": [], "by_sub_type": []}
+    for request_type, sub_type, count, duplicates, confidence_sum, confidence_count in rows:
+        summary["total"] += count
+        summary["duplicates"] += duplicates
+        totals = by_type.setdefault(request_type, [0, 0, 0.0, 0])
+        for position, value in enumerate((count, duplicates, confidence_sum or 0.0, confidence_count)):
+            totals[position] += value
+        summary["by_sub_type"].append({"request_type": request_type, "sub_type": sub_type, "count": count})
+    for request_type, (count, duplicates, confidence_sum, confidence_count) in by_type.items():
+        summary["by_request_type"].append({
+            "request_type": request_type,
+            "count": count,
+            "duplicates": duplicates,
+            "avg_confidence": round(confidence_sum / confidence_count, 4) if confidence_count else None,
+        })
+    summary["by_request_type"].sort(key=lambda entry: -entry["count"])
+    summary["by_sub_type"].sort(key=lambda entry: -entry["count"])
+    return summary
+
+
+class ResultsStore(abc.ABC):
+    """
+    Interface shared by the store backends. query / summary / choices / version
+    have scanning implementations here; backends override them with faster ones.
+    """
+
+    @abc.abstractmethod
+    def append(self, email_hash: str, info: str, is_duplicate: bool, meta: dict = None) -> dict:
+        """Store a record and return it."""
+
+    @abc.abstractmethod
+    def get(self, email_hash: str):
+        """Latest record for `email_hash`, or None."""
+
+    @abc.abstractmethod
+    def iter_records(self):
+        """Every record, oldest first."""
+
+    def iter_records_after(self, position=0):
+        """
+        (position, record) for records appended after `position` (0 = from the start);
+        the last position seen can be passed back later to continue incrementally.
+        """
+        for index, record in enumerate(self.iter_records(), start=1):
+            if index > position:
+                yield index, record
+
+    @abc.abstractmethod
+    def count(self) -> int:
+        """Number of records."""
+
+    def close(self):
+        pass
+
+    def query(self, filters: dict = None, offset: int = 0, limit: int = 50) -> list:
+        """One page of matching records, newest first."""
+        matching = [record for record in self.iter_records() if _matches(record, filters)]
+        matching.sort(key=lambda record: record["created_at"], reverse=True)
+        return matching[offset:offset + limit]
+
+    def count_matching(self, filters: dict = None) -> int:
+        return sum(1 for record in self.iter_records() if _matches(record, filters))
+
+    def summary(self, filters: dict = None) -> dict:
+        """{"total", "duplicates", "by_request_type": [...], "by_sub_type": [...]} for matching records."""
+        groups = {}
+        for record in self.iter_records():
+            if not _matches(record, filters):
+                continue
+            group = groups.setdefault((record.get("request_type"), record.get("sub_type")), [0, 0, 0.0, 0])
+            group[0] += 1
+            group[1] += int(record["is_duplicate"])
+            if record.get("confidence") is not None:
+                group[2] += record["confidence"]
+                group[3] += 1
+        return _summary_of((request_type, sub_type, *totals) for (request_type, sub_type), totals in groups.items())
+
+    def choices(self) -> dict:
+        """{request type: [sub types]} present in the store, for filter widgets."""
+        choices = {}
+        for record in self.iter_records():
+            if record.get("request_type"):
+                sub_types = choices.setdefault(record["request_type"], set())
+                if record.get("sub_type"):
+                    sub_types.add(record["sub_type"])
+        return {request_type: sorted(sub_types) for request_type, sub_types in sorted(choices.items())}
+
+    def version(self):
+        """Changes whenever a record is added."""
+        return self.count()
+
+    @staticmethod
+    def _record(email_hash, info, is_duplicate, meta, created_at=None) -> dict:
+        request_type, sub_type, confidence = summarize(info)
+        return {
+            "hash": email_hash,
+            "created_at": created_at if created_at is not None else time.time(),
+            "info": info,
+            "is_duplicate": bool(is_duplicate),
+            "meta": meta or {},
+            "request_type": request_type,
+            "sub_type": sub_type,
+            "confidence": confidence,
+        }
+
+
+class SQLiteResultsStore(ResultsStore):
+
+    def __init__(self, path: str = DEFAULT_SQLITE_PATH):
+        self.path = path
+        self._write_lock = threading.Lock()
+        self._local = threading.local()
+        self._writer = self._connect()
+        self._writer.executescript("""
+            CREATE TABLE IF NOT EXISTS results (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                hash TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                info TEXT,
+                is_duplicate INTEGER NOT NULL DEFAULT 0,
+                meta TEXT,
+                request_type TEXT,
+                sub_type TEXT,
+                confidence REAL
+            );
+            CREATE INDEX IF NOT EXISTS results_hash ON results (hash);
+        """)
+        columns = {row[1] for row in self._writer.execute("PRAGMA table_info(results)")}
+        if "request_type" not in columns:
+            # Store created before the summary columns: add and fill them once.
+            for column in ("request_type TEXT", "sub_type TEXT", "confidence REAL"):
+                self._writer.execute(f"ALTER TABLE results ADD COLUMN {column}")
+            self._backfill_summaries()
+        self._writer.executescript("""
+            CREATE INDEX IF NOT EXISTS results_created ON results (created_at);
+            CREATE INDEX IF NOT EXISTS results_type ON results (request_type, created_at);
+            -- Covers the summary() GROUP BY, so it never reads the info / meta columns.
+            CREATE INDEX IF NOT EXISTS results_summary ON results (request_type, sub_type, is_duplicate, confidence);
+        """)
+        self._writer.commit()
+
+    def _backfill_summaries(self, chunk: int = 1000):
+        rows = self._writer.execute("SELECT id, info FROM results").fetchall()
+        for start in range(0, len(rows), chunk):
+            self._writer.executemany(
+                "UPDATE results SET request_type = ?, sub_type = ?, confidence = ? WHERE id = ?",
+                [(*summarize(info), row_id) for row_id, info in rows[start:start + chunk]])
+        self._writer.commit()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def append(self, email_hash, info, is_duplicate, meta=None, created_at=None):
+        record = self._record(email_hash, info, is_duplicate, meta, created_at)
+        with self._write_lock:
+            self._writer.execute(
+                "INSERT INTO results (hash, created_at, info, is_duplicate, meta, request_type, sub_type, confidence) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (record["hash"], record["created_at"], record["info"], int(record["is_duplicate"]),
+                 json.dumps(record["meta"]), record["request_type"], record["sub_type"], record["confidence"]),
+            )
+            self._writer.commit()
+        return record
+
+    _COLUMNS = "hash, created_at, info, is_duplicate, meta, request_type, sub_type, confidence"
+
+    def _row_to_record(self, row) -> dict:
+        email_hash, created_at, info, is_duplicate, meta, request_type, sub_type, confidence = row
+        return {
+            "hash": email_hash,
+            "created_at": created_at,
+            "info": info,
+            "is_duplicate": bool(is_duplicate),
+            "meta": json.loads(meta) if meta else {},
+            "request_type": request_type,
+            "sub_type": sub_type,
+            "confidence": confidence,
+        }
+
+    @staticmethod
+    def _where(filters: dict):
+        filters = filters or {}
+        conditions = (
+            ("request_type", "request_type = ?"),
+            ("sub_type", "sub_type = ?"),
+            ("min_confidence", "confidence >= ?"),
+            ("max_confidence", "confidence <= ?"),
+            ("is_duplicate", "is_duplicate = ?"),
+            ("since", "created_at >= ?"),
+            ("until", "created_at < ?"),
+        )
+        clauses, params = [], []
+        for name, clause in conditions:
+            value = filters.get(name)
+            if value is not None:
+                clauses.append(clause)
+                params.append(int(value) if name == "is_duplicate" else value)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def get(self, email_hash):
+        row = self._reader().execute(
+            f"SELECT {self._COLUMNS} FROM results WHERE hash = ? ORDER BY id DESC LIMIT 1",
+            (email_hash,),
+        ).fetchone()
+        return self._row_to_record(row) if row else None
+
+    def iter_records(self):
+        cursor = self._reader().execute(f"SELECT {self._COLUMNS} FROM results ORDER BY id")
+        for row in cursor:
+            yield self._row_to_record(row)
+
+    def count(self):
+        return self._reader().execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def iter_records_after(self, position=0):
+        cursor = self._reader().execute(f"SELECT id, {self._COLUMNS} FROM results WHERE id > ? ORDER BY id", (position,))
+        for row in cursor:
+            yield row[0], self._row_to_record(row[1:])
+
+    def query(self, filters=None, offset=0, limit=50):
+        where, params = self._where(filters)
+        rows = self._reader().execute(f"SELECT {self._COLUMNS} FROM results{where} "
+                                      "ORDER BY created_at DESC, id DESC LIMIT ? OFFSET ?",
+                                      (*params, limit, offset)).fetchall()
+        return [self._row_to_record(row) for row in rows]
+
+    def count_matching(self, filters=None):
+        where, params = self._where(filters)
+        return self._reader().execute(f"SELECT COUNT(*) FROM results{where}", params).fetchone()[0]
+
+    def summary(self, filters=None):
+        where, params = self._where(filters)
+        rows = self._reader().execute(
+            "SELECT request_type, sub_type, COUNT(*), SUM(is_duplicate), SUM(confidence), COUNT(confidence) "
+            f"FROM results{where} GROUP BY request_type, sub_type", params).fetchall()
+        return _summary_of(rows)
+
+    def choices(self):
+        choices = {}
+        rows = self._reader().execute("SELECT DISTINCT request_type, sub_type FROM results "
+                                      "WHERE request_type IS NOT NULL ORDER BY request_type, sub_type")
+        for request_type, sub_type in rows:
+            sub_types = choices.setdefault(request_type, [])
+            if sub_type:
+                sub_types.append(sub_type)
+        return choices
+
+    def version(self):
+        # Rows are only ever appended, so the last id identifies the content.
+        return self._reader().execute("SELECT MAX(id) FROM results").fetchone()[0] or 0
+
+    def close(self):
+        with self._write_lock:
+            self._writer.close()
+
+
+class JSONLResultsStore(ResultsStore):
+    """
+    Append-only JSON lines file. `<path>.idx` holds "hash<TAB>offset" lines; it is
+    only ever appended to, and any records written after the last indexed one
+    (e.g. after a crash) are re-indexed when the store is opened.
+    """
+
+    def __init__(self, path: str = DEFAULT_JSONL_PATH):
+        self.path = path
+        self.index_path = path + ".idx"
+        self._lock = threading.Lock()
+        self._index = {}
+        self._count = 0
+        open(self.path, "ab").close()
+        self._load_index()
+        self._data = open(self.path, "ab")
+        self._sidecar = open(self.index_path, "a", encoding="utf-8")
+
+    def _load_index(self):
+        indexed_until = 0
+        if os.path.exists(self.index_path):
+            good_until = 0
+            with open(self.index_path, "rb") as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    email_hash, _, offset = line.decode("utf-8").rstrip("\n").partition("\t")
+                    self._index[email_hash] = int(offset)
+                    indexed_until = max(indexed_until, int(offset) + 1)
+                    self._count += 1
+                    good_until += len(line)
+            if good_until != os.path.getsize(self.index_path):
+                os.truncate(self.index_path, good_until)
+
+        # Re-index records appended after the last sidecar entry.
+        missing = []
+        torn_at = None
+        with open(self.path, "rb") as f:
+            if indexed_until:
+                f.seek(indexed_until - 1)
+                f.readline()
+            while True:
+                offset = f.tell()
+                line = f.readline()
+                if not line:
+                    break
+                if not line.endswith(b"\n"):
+                    torn_at = offset
+                    break
+                missing.append((json.loads(line)["hash"], offset))
+        if torn_at is not None:
+            # Partial last line from a crash mid-write: drop it.
+            os.truncate(self.path, torn_at)
+        if missing:
+            with open(self.index_path, "a", encoding="utf-8") as f:
+                for email_hash, offset in missing:
+                    f.write(f"{email_hash}\t{offset}\n")
+                    self._index[email_hash] = offset
+                    self._count += 1
+
+    def append(self, email_hash, info, is_duplicate, meta=None, created_at=None):
+        record = self._record(email_hash, info, is_duplicate, meta, created_at)
+        line = (json.dumps(record) + "\n").encode("utf-8")
+        with self._lock:
+            offset = self._data.tell()
+            self._data.write(line)
+            self._data.flush()
+            self._sidecar.write(f"{email_hash}\t{offset}\n")
+            self._sidecar.flush()
+            self._index[email_hash] = offset
+            self._count += 1
+        return record
+
+    @staticmethod
+    def _load(line: bytes) -> dict:
+        record = json.loads(line)
+        if "request_type" not in record:
+            # Written before records carried the classification summary.
+            record["request_type"], record["sub_type"], record["confidence"] = summarize(record["info"])
+        return record
+
+    def get(self, email_hash):
+        offset = self._index.get(email_hash)
+        if offset is None:
+            return None
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            return self._load(f.readline())
+
+    def iter_records(self):
+        with open(self.path, "rb") as f:
+            for line in f:
+                if line.endswith(b"\n"):
+                    yield self._load(line)
+
+    def iter_records_after(self, position=0):
+        # Positions are byte offsets just past each record.
+        with open(self.path, "rb") as f:
+            f.seek(position)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                position += len(line)
+                yield position, self._load(line)
+
+    def count(self):
+        return self._count
+
+    def close(self):
+        with self._lock:
+            self._data.close()
+            self._sidecar.close()
+
+
+def _legacy_answer_text(info: str) -> str:
+    """The model's text when a legacy Info cell holds the repr of a GenerateContentResponse."""
+    start = info.find("GenerateContentResponse({")
+    if start < 0:
+        return info
+    try:
+        response, _ = json.JSONDecoder().raw_decode(info, info.index("{", start))
+        return response["candidates"][0]["content"]["parts"][0]["text"]
+    except (ValueError, LookupError, TypeError):
+        return info
+
+
+def _from_legacy_shape(result: dict) -> dict:
+    """
+    Convert a legacy answer ("primary request type", "request types": {type: [sub types]},
+    "confidence score", "reason for the classification") into the current result shape.
+    """
+    fields = {str(key).lower().replace("_", " ").strip(): value for key, value in result.items()}
+    primary = fields.get("primary request type")
+    if not isinstance(primary, str) or classification_of(result)[0]:
+        return result
+    types = fields.get("request types")
+    sub_types = types.get(primary) if isinstance(types, dict) else None
+    if isinstance(sub_types, list):
+        sub_types = sub_types[0] if len(sub_types) == 1 else (sub_types or None)
+    return {
+        "extracted_fields": fields.get("extracted fields") or {},
+        "request type": {
+            "Primary Request Type": primary,
+            "Request Type": [{primary: {"Confidence score": fields.get("confidence score"),
+                                        "Reason": fields.get("reason for the classification"),
+                                        "request sub type": sub_types}}],
+        },
+    }
+
+
+def migrate_csv(csv_path: str, store: ResultsStore) -> dict:
+    """
+    One-time import of the legacy service_requests.csv (256RSAHash, Info, Is duplicate).
+    Info holds either the model's text or the repr of the whole GenerateContentResponse;
+    the answer is taken out of it and stored in the current result shape. Rows whose
+    answer cannot be read are imported as they are, with meta parse_error set.
+    Rows whose hash is already in the store are skipped, so re-running is harmless.
+    Returns {"imported", "unclassified"} row counts.
+    """
+    csv.field_size_limit(sys.maxsize)
+    report = {"imported": 0, "unclassified": 0}
+    with open(csv_path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            email_hash = (row.get("256RSAHash") or "").strip()
+            if not email_hash or store.get(email_hash) is not None:
+                continue
+            is_duplicate = (row.get("Is duplicate") or "").strip().lower() in ("true", "1")
+            info = row.get("Info") or ""
+            meta = {"migrated_from": csv_path}
+            result = _from_legacy_shape(load_result(_legacy_answer_text(info))) if info.strip() else None
+            if result is not None and classification_of(result)[0]:
+                info = json.dumps(result)
+            else:
+                meta["parse_error"] = True
+                report["unclassified"] += 1
+            store.append(email_hash, info, is_duplicate, meta=meta)
+            report["imported"] += 1
+    return report
+
+
+def open_store(kind: str = None, path: str = None) -> ResultsStore:
+    kind = (kind or os.getenv("RESULTS_STORE", "sqlite")).lower()
+    path = path or os.getenv("RESULTS_STORE_PATH")
+    if kind == "jsonl":
+        return JSONLResultsStore(path or DEFAULT_JSONL_PATH)
+    if kind == "sqlite":
+        return SQLiteResultsStore(path or DEFAULT_SQLITE_PATH)
+    raise ValueError(f"Unknown results store: {kind}")
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> ResultsStore:
+    """Process-wide store, opened on first use."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = open_store()
+        return _store
+
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1] == "migrate":
+        source = sys.argv[2] if len(sys.argv) > 2 else LEGACY_CSV_PATH
+        report = migrate_csv(source, get_store())
+        print(f"Imported {report['imported']} rows from {source} "
+              f"({report['unclassified']} could not be read and are marked parse_error)")
+    else:
+        print("usage: python results_store.py migrate [path/to/service_requests.csv]")
@@ -0,0 +1,80 @@
+"""
+Deterministic extraction of the standard extraction_fields.
+
+Servicing emails state most fields in rigid patterns (see the try.py samples):
+    JPMORGAN CHASE BANK, N.A.          <- source bank (sender line above "To:")
+    Date: 15-Dec-2023
+    ... the deal 'ABC Corp Loan Adjustment 2023' ...
+    Effective date: 18-Dec-2023
+    Amount: USD 5,000,000.00
+    Expiration Date: 31-Dec-2024
+All patterns for the requested fields are compiled into a single alternation
+regex (cached per field list) and the text is scanned once; any field written
+as a "<field name>: value" line is picked up as well. Fields found here are
+not requested from the LLM.
+"""
+import re
+from functools import lru_cache
+
+_DATE = r"\d{1,2}[-/ ][A-Za-z]{3,9}[-/ ]\d{2,4}|\d{4}-\d{2}-\d{2}|\d{1,2}/\d{1,2}/\d{2,4}"
+
+# Patterns for the default fields, keyed by lower-cased field name. Each one has a
+# single (?P<value>...) group. Only the keywords are case-insensitive ((?i:...)):
+# the value classes are not, so the source bank has to be an upper-case letterhead
+# and a currency an ISO code.
+_FIELD_PATTERNS = {
+    "date": [rf"^[ \t]*(?i:date)[ \t]*:[ \t]*(?P<value>{_DATE})"],
+    "effective date": [rf"^[ \t]*(?i:effective[ \t]+date)[ \t]*:[ \t]*(?P<value>{_DATE})"],
+    "expiration date": [rf"^[ \t]*(?i:expiration[ \t]+date)[ \t]*:[ \t]*(?P<value>{_DATE})"],
+    "amount": [r"^[ \t]*(?i:amount)[^:\n]{0,30}:[ \t]*(?P<value>(?:[A-Z]{3}|[$€£])[ \t]?\d[\d,]*(?:\.\d+)?)"],
+    "source bank": [r"\A\s*(?P<value>[A-Z][A-Z0-9 .,&'()-]{1,80}?)[ \t]*\r?\n[ \t]*(?i:to)[ \t]*:"],
+    "deal name": [r"\b(?i:deal[ \t]+name)[ \t]*:[ \t]*(?P<value>[^\n]+?)[ \t]*$",
+                  r"\b(?i:deal)[ \t]+['\"‘“](?P<value>[^'\"’”\n]{2,120})['\"’”]"],
+}
+
+
+def _generic_pattern(field: str) -> str:
+    # "<field name>: value" on its own line.
+    words = r"[ \t]+".join(re.escape(word) for word in field.split())
+    return rf"^[ \t]*(?i:{words})[ \t]*:[ \t]*(?P<value>[^\n]+?)[ \t]*$"
+
+
+class RuleExtractor:
+
+    def __init__(self, fields: tuple):
+        self.fields = tuple(fields)
+        alternatives = []
+        self._group_fields = {}
+        for field in self.fields:
+            patterns = _FIELD_PATTERNS.get(field.lower().strip()) or [_generic_pattern(field)]
+            for pattern in patterns:
+                group = f"g{len(self._group_fields)}"
+                self._group_fields[group] = field
+                alternatives.append(pattern.replace("(?P<value>", f"(?P<{group}>"))
+        self._regex = re.compile("|".join(f"(?:{alt})" for alt in alternatives),
+                                 re.MULTILINE) if alternatives else None
+
+    def extract(self, text: str) -> dict:
+        """{field: value} for every field found; the first occurrence of a field wins."""
+        found = {}
+        if self._regex is None or not text:
+            return found
+        for match in self._regex.finditer(text):
+            group = match.lastgroup
+            field = self._group_fields.get(group)
+            if field is not None and field not in found:
+                value = match.group(group).strip()
+                if value:
+                    found[field] = value
+                    if len(found) == len(self.fields):
+                        break
+        return found
+
+
+@lru_cache(maxsize=32)
+def get_extractor(fields: tuple) -> RuleExtractor:
+    return RuleExtractor(fields)
+
+
+def extract_fields(text: str, extraction_fields: list) -> dict:
+    return get_extractor(tuple(extraction_fields or ())).extract(text)
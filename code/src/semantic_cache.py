@@ -0,0 +1,178 @@
+"""
+Semantic cache over past classifications.
+
+Most servicing emails are templated: the same agent bank sends the same notice
+with another deal name, amount and dates. Near-duplicate detection (MinHash,
+see near_duplicates.py) rightly misses these, as too many words differ, but the
+classification carries over. Every email classified by the LLM is stored here
+as an embedding with its request type, sub type and extracted fields; before
+the next LLM call the nearest stored email is looked up and, when its cosine
+similarity is at least the threshold, its request type and sub type are reused.
+Only the fields that neither the rule extractor nor the neighbour's values fill
+are asked from the LLM, in a short extraction-only call (see
+createEmail._finish_processing).
+
+Embeddings are hashed word unigrams + bigrams (preclassifier.HashingVectorizer)
+of the normalized text with numbers and month names masked, so amounts and dates do not pull
+templated emails apart. Vectors are stored in SQLite and held in memory as one
+NumPy matrix; a lookup is a single matrix-vector product. Rows added by other
+processes are picked up on the next lookup.
+
+Configuration (environment variables):
+    SEMANTIC_CACHE_PATH, SEMANTIC_CACHE_THRESHOLD (cosine similarity, default 0.85),
+    SEMANTIC_CACHE_DIMENSIONS (default 1024), SEMANTIC_CACHE_DISABLED (set to 1 to always use the LLM)
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from near_duplicates import normalize_for_similarity
+from preclassifier import HashingVectorizer
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "semantic_cache.sqlite3")
+
+# Numbers and month names: the amounts and dates that vary between copies of a template.
+_VARIABLE = re.compile(r"\b(\d[\d,.]*|jan|feb|mar|apr|may|jun|jul|aug|sep|sept|oct|nov|dec|january|february|march|"
+                       r"april|june|july|august|september|october|november|december)\b")
+
+
+def _as_text(value):
+    # The LLM sometimes answers a list of sub types; stored like results_store.summarize does.
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (list, tuple)):
+        return ", ".join(str(item) for item in value) or None
+    return json.dumps(value)
+
+
+class SemanticCache:
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, dimensions: int = 1024, threshold: float = 0.85):
+        self.path = path
+        self.dimensions = dimensions
+        self.threshold = threshold
+        self.vectorizer = HashingVectorizer(dimensions)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS entries (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                email_hash TEXT UNIQUE NOT NULL,
+                vector BLOB NOT NULL,
+                request_type TEXT,
+                sub_type TEXT,
+                confidence REAL,
+                extracted_fields TEXT,
+                created_at REAL NOT NULL
+            );
+        """)
+        self._conn.commit()
+        # Row i of the matrix is self._entries[i]; capacity doubles as rows are added.
+        self._matrix = np.zeros((0, dimensions), dtype=np.float32)
+        self._entries = []
+        self._last_id = 0
+        self._load_new_rows()
+
+    def embed(self, text: str) -> np.ndarray:
+        """Unit length embedding of the normalized text with amounts and dates masked."""
+        indices, values = self.vectorizer.transform_one(_VARIABLE.sub(" ", normalize_for_similarity(text)))
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        vector[indices] = values
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _append(self, vector: np.ndarray, entry: dict):
+        count = len(self._entries)
+        if count == len(self._matrix):
+            grown = np.zeros((max(64, 2 * count), self.dimensions), dtype=np.float32)
+            grown[:count] = self._matrix[:count]
+            self._matrix = grown
+        self._matrix[count] = vector
+        self._entries.append(entry)
+
+    def _load_new_rows(self):
+        # Called with the lock held (or from __init__).
+        rows = self._conn.execute(
+            "SELECT id, email_hash, vector, request_type, sub_type, confidence, extracted_fields FROM entries "
+            "WHERE id > ? ORDER BY id", (self._last_id,)).fetchall()
+        for row_id, email_hash, vector, request_type, sub_type, confidence, fields in rows:
+            vector = np.frombuffer(vector, dtype=np.float32)
+            if len(vector) == self.dimensions:
+                self._append(vector, {"email_hash": email_hash, "request_type": request_type, "sub_type": sub_type,
+                                      "confidence": confidence, "extracted_fields": json.loads(fields or "{}")})
+            self._last_id = row_id
+
+    def query(self, text: str = None, vector: np.ndarray = None, exclude: str = None):
+        """
+        Nearest stored classification with similarity at least the threshold, as a
+        dictionary (email_hash, request_type, sub_type, confidence, extracted_fields,
+        similarity), or None. Pass `vector` to avoid recomputing it when the email is added afterwards.
+        """
+        if vector is None:
+            vector = self.embed(text)
+        with self._lock:
+            self._load_new_rows()
+            count = len(self._entries)
+            if count == 0 or not vector.any():
+                return None
+            scores = self._matrix[:count] @ vector
+            for position in np.argsort(scores)[::-1][:2]:
+                similarity = float(scores[position])
+                if similarity < self.threshold:
+                    return None
+                if self._entries[position]["email_hash"] != exclude:
+                    return dict(self._entries[position], similarity=similarity)
+        return None
+
+    def add(self, email_hash: str, result_fields: tuple, text: str = None, vector: np.ndarray = None):
+        """
+        Store an email's classification: `result_fields` is (request type, sub type,
+        confidence, extracted fields dictionary). A list of sub types is stored joined.
+        """
+        if vector is None:
+            vector = self.embed(text)
+        if not vector.any():
+            return
+        vector = np.ascontiguousarray(vector, dtype=np.float32)
+        request_type, sub_type, confidence, fields = result_fields
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO entries (email_hash, vector, request_type, sub_type, confidence, "
+                "extracted_fields, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (email_hash, vector.tobytes(), _as_text(request_type), _as_text(sub_type), confidence,
+                 json.dumps(fields or {}), time.time()))
+            self._conn.commit()
+            self._load_new_rows()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Process-wide cache, opened on first use; None when SEMANTIC_CACHE_DISABLED is set."""
+    global _cache
+    if os.getenv("SEMANTIC_CACHE_DISABLED", "0") not in ("0", "", "false", "False"):
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = SemanticCache(
+                path=os.getenv("SEMANTIC_CACHE_PATH", DEFAULT_CACHE_PATH),
+                dimensions=int(os.getenv("SEMANTIC_CACHE_DIMENSIONS", "1024")),
+                threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.85")),
+            )
+        return _cache
@@ -0,0 +1,545 @@
+"""
+Mailbox watcher: ingests new messages from a local Maildir or mbox (e.g. the one an
+IMAP / fetchmail drop delivers into) as they arrive and runs each one through
+createEmail.process_email_with_llm.
+
+New messages are found without rescanning the mailbox:
+  - Maildir: with inotify, the file names carried by the events are queued and
+    new/ and cur/ are listed in full only at startup and when the kernel dropped
+    events (queue overflow); when polling, they are listed only when their
+    modification time changed. Only keys not seen before are queued (a message
+    keeps its key when a mail client moves it from new/ to cur/).
+  - mbox: the file is read from the offset reached so far; a message is taken once
+    the next "From " line follows it, or, at the end of the file, once the file has
+    stopped growing (read under a shared lock, so messages being appended by a
+    locking writer are not read half written).
+On Linux an inotify watch wakes the watcher as soon as a message is delivered;
+elsewhere (or with WATCHER_INOTIFY=0) it polls every --poll-interval seconds.
+
+Progress is checkpointed in SQLite (WATCHER_STATE_PATH): every message's state
+(running / done / error) and, for an mbox, the offset below which every message
+is done. A message is marked done only after its result was stored. After a crash
+or restart the watcher resumes from the checkpoint: messages that were done are
+not read again, and a message that was running is looked up by its SHA-256 in the
+results store and only processed again if its result never got stored. Failed
+messages are recorded with their error and not retried.
+
+Backpressure: at most --max-in-flight messages are read and queued at a time (the
+mbox is not read further, new Maildir keys wait) while --workers threads process them.
+
+Usage:
+    python watcher.py <maildir | mbox> [--workers N] [--max-in-flight N] [--poll-interval S]
+                      [--once] [--metrics-port PORT]
+
+Configuration (environment variables):
+    WATCHER_STATE_PATH, WATCHER_POLL_SECONDS (default 2), WATCHER_INOTIFY (default 1)
+"""
+import argparse
+import bisect
+import contextlib
+import ctypes
+import ctypes.util
+import json
+import os
+import select
+import signal
+import sqlite3
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from createEmail import (DEFAULT_EXTRACTION_FIELDS, DEFAULT_REQUEST_TYPE_DEFS, DEFAULT_RULES, EmailProcessor,
+                         process_email_with_llm, warm_up)
+from results_store import get_store as get_results_store
+
+try:
+    import fcntl
+except ImportError:  # Windows: mbox reads are not locked
+    fcntl = None
+
+DEFAULT_STATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "watcher.sqlite3")
+
+POLL_SECONDS = float(os.getenv("WATCHER_POLL_SECONDS", "2"))
+
+RUNNING, DONE, ERROR = "running", "done", "error"
+
+
+class Checkpoints:
+    """Durable ingestion state: per-message states plus the done-below offset of each mbox."""
+
+    def __init__(self, path: str = DEFAULT_STATE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS messages (
+                source TEXT NOT NULL,
+                key TEXT NOT NULL,
+                position INTEGER,
+                state TEXT NOT NULL,
+                email_hash TEXT,
+                error TEXT,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (source, key)
+            );
+            CREATE TABLE IF NOT EXISTS offsets (
+                source TEXT PRIMARY KEY,
+                inode INTEGER NOT NULL,
+                offset INTEGER NOT NULL,
+                updated_at REAL NOT NULL
+            );
+        """)
+        self._conn.commit()
+
+    def states(self, source: str) -> dict:
+        """key -> (state, email hash) of every message recorded for `source`."""
+        with self._lock:
+            rows = self._conn.execute("SELECT key, state, email_hash FROM messages WHERE source = ?",
+                                      (source,)).fetchall()
+        return {key: (state, email_hash) for key, state, email_hash in rows}
+
+    def mark(self, source: str, key: str, state: str, position: int = None, email_hash: str = None,
+             error: str = None):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO messages (source, key, position, state, email_hash, error, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (source, key) DO UPDATE SET "
+                "position = COALESCE(excluded.position, position), state = excluded.state, "
+                "email_hash = COALESCE(excluded.email_hash, email_hash), error = excluded.error, "
+                "updated_at = excluded.updated_at",
+                (source, key, position, state, email_hash, error, time.time()))
+            self._conn.commit()
+
+    def offset(self, source: str):
+        """(inode, offset) checkpointed for an mbox, or (None, 0)."""
+        with self._lock:
+            row = self._conn.execute("SELECT inode, offset FROM offsets WHERE source = ?", (source,)).fetchone()
+        return (row[0], row[1]) if row else (None, 0)
+
+    def set_offset(self, source: str, inode: int, offset: int):
+        """Every message of the mbox below `offset` is done; their rows are no longer needed."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO offsets (source, inode, offset, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (source) DO UPDATE SET inode = excluded.inode, offset = excluded.offset, "
+                "updated_at = excluded.updated_at",
+                (source, inode, offset, time.time()))
+            self._conn.execute("DELETE FROM messages WHERE source = ? AND state = ? AND key LIKE ? AND position < ?",
+                               (source, DONE, f"{inode}:%", offset))
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class MaildirSource:
+    """New messages of a Maildir; keys are the unique part of the file names."""
+
+    def __init__(self, path: str):
+        self.path = path
+        # Set while inotify reports deliveries (see notify); otherwise every scan polls the directories.
+        self.evented = False
+        self._mtimes = {}
+        self._paths = {}
+        self._lock = threading.Lock()
+        self._delivered = []
+        self._rescan = True
+
+    @staticmethod
+    def key_of(name: str) -> str:
+        return name.split(":", 1)[0]
+
+    def notify(self, changes: list):
+        """Record (directory, file name) changes reported by inotify; a None name asks for a full listing."""
+        with self._lock:
+            for directory, name in changes:
+                if name is None:
+                    self._rescan = True
+                else:
+                    self._delivered.append(os.path.join(directory, name))
+
+    def scan(self) -> list:
+        """
+        Keys of new messages: the files reported through notify, or, when polling (and at
+        startup or after lost events), the listing of new/ and cur/ if they changed since
+        the last scan.
+        """
+        with self._lock:
+            rescan, self._rescan = self._rescan or not self.evented, False
+            delivered, self._delivered = self._delivered, []
+            if rescan and self.evented:
+                # Events were lost: list the directories even if their mtime looks unchanged.
+                self._mtimes.clear()
+        keys = self._list() if rescan else []
+        for path in delivered:
+            name = os.path.basename(path)
+            if not name.startswith(".") and os.path.isfile(path):
+                key = self.key_of(name)
+                self._paths[key] = path
+                keys.append(key)
+        return list(dict.fromkeys(keys))
+
+    def _list(self) -> list:
+        keys = []
+        for subdir in ("new", "cur"):
+            directory = os.path.join(self.path, subdir)
+            try:
+                mtime = os.stat(directory).st_mtime_ns
+            except FileNotFoundError:
+                continue
+            # A delivery within the same clock tick as the last listing leaves the mtime unchanged,
+            # so recently modified directories are listed again.
+            if self._mtimes.get(subdir) == mtime and time.time_ns() - mtime > 2_000_000_000:
+                continue
+            self._mtimes[subdir] = mtime
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if not entry.name.startswith(".") and entry.is_file():
+                        key = self.key_of(entry.name)
+                        self._paths[key] = entry.path
+                        keys.append(key)
+        return keys
+
+    def open(self, key: str):
+        path = self._paths.get(key)
+        try:
+            return open(path, "rb")
+        except (FileNotFoundError, TypeError):
+            # Moved between new/ and cur/ (or flags changed) since the scan.
+            for subdir in ("cur", "new"):
+                directory = os.path.join(self.path, subdir)
+                for name in os.listdir(directory):
+                    if self.key_of(name) == key:
+                        self._paths[key] = os.path.join(directory, name)
+                        return open(self._paths[key], "rb")
+            raise
+
+    def watch_paths(self) -> list:
+        return [os.path.join(self.path, subdir) for subdir in ("new", "cur")]
+
+    def forget(self, key: str):
+        self._paths.pop(key, None)
+
+
+class MboxSource:
+    """Messages appended to an mbox file, read incrementally from an offset; keys are "<inode>:<offset>"."""
+
+    def __init__(self, path: str, inode: int = None, offset: int = 0):
+        self.path = path
+        self.inode = inode
+        self.read_offset = offset
+        self._last_size = None
+
+    def _check_rotation(self, stat):
+        if self.inode != stat.st_ino or stat.st_size < self.read_offset:
+            if self.inode is not None:
+                print(f"{self.path} was replaced or truncated; reading it from the start")
+            self.inode, self.read_offset, self._last_size = stat.st_ino, 0, None
+            return True
+        return False
+
+    def read(self, limit: int) -> list:
+        """Up to `limit` complete messages after the read offset, as (key, offset, raw bytes)."""
+        messages = []
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return messages
+        with f:
+            stat = os.fstat(f.fileno())
+            self._check_rotation(stat)
+            if stat.st_size == self.read_offset:
+                return messages
+            if fcntl is not None:
+                try:
+                    fcntl.lockf(f, fcntl.LOCK_SH | fcntl.LOCK_NB)
+                except OSError:
+                    # A writer holds the lock; the message it is appending is read on the next poll.
+                    return messages
+            try:
+                settled = self._last_size == stat.st_size
+                self._last_size = stat.st_size
+                f.seek(self.read_offset)
+                start, lines, previous_blank = self.read_offset, [], True
+                position = self.read_offset
+                while len(messages) < limit:
+                    line = f.readline()
+                    if line.startswith(b"From ") and previous_blank and lines:
+                        messages.append(self._message(start, lines))
+                        start, lines = position, []
+                    if not line:
+                        break
+                    lines.append(line)
+                    position += len(line)
+                    previous_blank = line in (b"\n", b"\r\n")
+                # The last message has no "From " line after it: taken once the file stopped growing.
+                if lines and len(messages) < limit and settled and lines[-1].endswith(b"\n"):
+                    messages.append(self._message(start, lines))
+                    start = position
+                self.read_offset = start
+            finally:
+                if fcntl is not None:
+                    fcntl.lockf(f, fcntl.LOCK_UN)
+        return messages
+
+    def _message(self, start: int, lines: list):
+        # Like mailbox.mbox.get_bytes: without the "From " line and the blank line that separates messages.
+        body = lines[1:] if lines[0].startswith(b"From ") else lines
+        if body and body[-1] in (b"\n", b"\r\n"):
+            body = body[:-1]
+        return f"{self.inode}:{start}", start, b"".join(body).replace(b"\r\n", b"\n")
+
+    def watch_paths(self) -> list:
+        return [self.path, os.path.dirname(os.path.abspath(self.path))]
+
+
+class _Inotify:
+    """Reports changes of the watched paths (Linux inotify through libc; no dependency)."""
+
+    _EVENTS = 0x2 | 0x8 | 0x80 | 0x100  # IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+    _OVERFLOW = 0x4000  # IN_Q_OVERFLOW: the kernel queue was full and events were dropped
+    _HEADER = struct.Struct("iIII")  # struct inotify_event: wd, mask, cookie, len (then the name)
+
+    def __init__(self, paths: list):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._paths = {}
+        for path in paths:
+            if os.path.exists(path):
+                wd = libc.inotify_add_watch(self.fd, os.fsencode(path), self._EVENTS)
+                if wd >= 0:
+                    self._paths[wd] = path
+
+    def wait(self, timeout: float) -> list:
+        """
+        Changes within `timeout` seconds as (watched path, file name) pairs, empty when
+        nothing changed. The name is None when the watched path itself changed or events
+        were lost, i.e. when everything has to be looked at again.
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        data = b""
+        try:
+            while True:
+                chunk = os.read(self.fd, 65536)
+                if not chunk:
+                    break
+                data += chunk
+        except BlockingIOError:
+            pass
+        changes = []
+        offset = 0
+        while offset + self._HEADER.size <= len(data):
+            wd, mask, _, length = self._HEADER.unpack_from(data, offset)
+            offset += self._HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if mask & self._OVERFLOW or wd not in self._paths:
+                changes.append((None, None))
+            else:
+                changes.append((self._paths[wd], os.fsdecode(name) if name else None))
+        return changes
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Watcher:
+
+    def __init__(self, path: str, request_type_defs: str = None, extraction_fields: list = None, rules: str = None,
+                 workers: int = 4, max_in_flight: int = None, poll_interval: float = None,
+                 checkpoints: Checkpoints = None):
+        self.path = os.path.abspath(path)
+        self.request_type_defs = request_type_defs or DEFAULT_REQUEST_TYPE_DEFS
+        self.extraction_fields = extraction_fields or DEFAULT_EXTRACTION_FIELDS
+        self.rules = rules or DEFAULT_RULES
+        self.workers = workers
+        self.max_in_flight = max_in_flight or 2 * workers
+        self.poll_interval = POLL_SECONDS if poll_interval is None else poll_interval
+        self.checkpoints = checkpoints or Checkpoints(os.getenv("WATCHER_STATE_PATH", DEFAULT_STATE_PATH))
+        self.is_maildir = os.path.isdir(self.path)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._in_flight = 0
+        self._outstanding = []  # mbox offsets of messages read but not finished, sorted
+        self._claimed = set()  # Maildir keys queued or in flight
+
+        states = self.checkpoints.states(self.path)
+        self._finished = {key for key, (state, _) in states.items() if state in (DONE, ERROR)}
+        # Running when the last run stopped: processed again only if no result was stored.
+        self._interrupted = {key for key, (state, _) in states.items() if state == RUNNING}
+        if self.is_maildir:
+            self.source = MaildirSource(self.path)
+            self._pending = []
+        else:
+            inode, offset = self.checkpoints.offset(self.path)
+            self.source = MboxSource(self.path, inode, offset)
+
+    def _next_messages(self, limit: int) -> list:
+        """Up to `limit` unprocessed messages as (key, position, opener), counted as in flight."""
+        messages = []
+        if self.is_maildir:
+            if not self._pending:
+                self._pending = [key for key in self.source.scan()
+                                 if key not in self._finished and key not in self._claimed]
+                self._claimed.update(self._pending)
+            taken, self._pending = self._pending[:limit], self._pending[limit:]
+            messages = [(key, None, lambda key=key: self.source.open(key)) for key in taken]
+            with self._lock:
+                self._in_flight += len(messages)
+            return messages
+        # Read under the lock: a message finishing meanwhile must not move the checkpointed
+        # offset past messages that were read but are not yet counted as outstanding.
+        with self._lock:
+            while len(messages) < limit:
+                read = self.source.read(limit - len(messages))
+                if not read:
+                    break
+                for key, position, raw in read:
+                    if key in self._finished:
+                        continue
+                    messages.append((key, position, lambda raw=raw: contextlib.nullcontext(raw)))
+                    bisect.insort(self._outstanding, position)
+            self._in_flight += len(messages)
+            if not self._outstanding:
+                # Only done messages (or none) were read.
+                self.checkpoints.set_offset(self.path, self.source.inode, self.source.read_offset)
+        return messages
+
+    def _process(self, key: str, position, opener) -> dict:
+        started = time.perf_counter()
+        item = {"name": f"{self.path}#{key}", "hash": None, "result": None, "error": None}
+        try:
+            message = opener()
+        except FileNotFoundError:
+            # Deleted by a mail client between the scan and now: nothing to ingest.
+            metrics.increment("watcher_messages_total", outcome="vanished")
+            item["error"] = "vanished before it was read"
+            item["seconds"] = round(time.perf_counter() - started, 3)
+            return item
+        try:
+            with message as raw:
+                email_hash = item["hash"] = EmailProcessor(raw).get_email_hash()
+                if key in self._interrupted and get_results_store().get(email_hash) is not None:
+                    # Stored before the last run stopped, but not checkpointed.
+                    outcome = "recovered"
+                    item["result"] = "already stored"
+                else:
+                    self.checkpoints.mark(self.path, key, RUNNING, position, email_hash)
+                    item["result"] = process_email_with_llm(raw, self.request_type_defs, self.extraction_fields,
+                                                            self.rules)
+                    outcome = DONE
+            self.checkpoints.mark(self.path, key, DONE, position, email_hash)
+        except Exception as e:
+            outcome = ERROR
+            item["error"] = f"{type(e).__name__}: {e}"
+            self.checkpoints.mark(self.path, key, ERROR, position, error=item["error"])
+        metrics.increment("watcher_messages_total", outcome=outcome)
+        item["seconds"] = round(time.perf_counter() - started, 3)
+        return item
+
+    def _finish(self, key: str, position, item: dict):
+        with self._lock:
+            self._in_flight -= 1
+            self._finished.add(key)
+            self._claimed.discard(key)
+            self._interrupted.discard(key)
+            if position is not None:
+                self._outstanding.pop(bisect.bisect_left(self._outstanding, position))
+                # Every message below the oldest unfinished one is done.
+                frontier = self._outstanding[0] if self._outstanding else self.source.read_offset
+                self.checkpoints.set_offset(self.path, self.source.inode, frontier)
+            else:
+                self.source.forget(key)
+        print(json.dumps(item, default=str), flush=True)
+        self._wake.set()
+
+    def run(self, stop: threading.Event = None, once: bool = False):
+        """
+        Process messages as they arrive until `stop` is set (or, with once=True, until
+        every message present has been processed). Messages in flight are finished first.
+        """
+        stop = stop or threading.Event()
+        stopped = threading.Event()
+        notifier = None
+        if not once and os.getenv("WATCHER_INOTIFY", "1") not in ("0", "false", "False"):
+            try:
+                notifier = _Inotify(self.source.watch_paths())
+            except (OSError, AttributeError) as e:
+                print(f"inotify unavailable, polling every {self.poll_interval}s: {e}")
+        if self.is_maildir:
+            self.source.evented = notifier is not None
+        if notifier is not None:
+            def forward():
+                while not stop.is_set() and not stopped.is_set():
+                    changes = notifier.wait(self.poll_interval)
+                    if changes:
+                        if self.is_maildir:
+                            self.source.notify(changes)
+                        self._wake.set()
+                notifier.close()
+            threading.Thread(target=forward, name="watcher-inotify", daemon=True).start()
+
+        print(f"Watching {self.path} ({'Maildir' if self.is_maildir else 'mbox'})")
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while not stop.is_set():
+                with self._lock:
+                    free = self.max_in_flight - self._in_flight
+                messages = self._next_messages(free) if free > 0 else []
+                for key, position, opener in messages:
+                    future = pool.submit(self._process, key, position, opener)
+                    future.add_done_callback(lambda future, key=key, position=position:
+                                             self._finish(key, position, future.result()))
+                if messages:
+                    continue
+                with self._lock:
+                    idle = self._in_flight == 0
+                if once and idle and (self.is_maildir or self.source.read_offset >= self._size()):
+                    break
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+        stopped.set()
+
+    def _size(self) -> int:
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Process new messages of a Maildir or mbox as they arrive.")
+    parser.add_argument("mailbox", help="Maildir directory or mbox file")
+    parser.add_argument("--workers", type=int, default=4, help="messages processed concurrently")
+    parser.add_argument("--max-in-flight", type=int, default=None, help="messages read ahead (default 2 x workers)")
+    parser.add_argument("--poll-interval", type=float, default=None, help="seconds between polls")
+    parser.add_argument("--once", action="store_true", help="process what is there now, then exit")
+    parser.add_argument("--metrics-port", type=int, default=None, help="serve Prometheus metrics on this port")
+    args = parser.parse_args()
+
+    if args.metrics_port:
+        metrics.start_http_server(args.metrics_port)
+    warm_up()
+    watcher = Watcher(args.mailbox, workers=args.workers, max_in_flight=args.max_in_flight,
+                      poll_interval=args.poll_interval)
+    stop = threading.Event()
+
+    def request_stop(*_):
+        print("Stopping after the messages in flight")
+        stop.set()
+        watcher._wake.set()
+
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, request_stop)
+    watcher.run(stop, once=args.once)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""
+End-to-end benchmark of the email pipeline with a fake LLM.
+
+A synthetic corpus (synthetic_eml.py) is run through createEmail.process_email_with_llm
+with the Gemini backend swapped for llm_client.FakeBackend (fixed latency, answers
+with the try.py sample output matching the email's subject), against a results
+store, result cache, near-duplicate index, semantic cache and OCR cache in a
+temporary directory.
+
+Reported per corpus size:
+    seconds, emails_per_second, peak_rss_mb
+    startup: import_seconds (import createEmail in a fresh process), warm_up_seconds (createEmail.warm_up)
+    stages: calls, total_seconds, per_email_ms, mean_ms, p50_ms, p95_ms (per call) for
+        parse       MIME parsing (EmailProcessor.parse_email)
+        hash_dedup  raw hash, exact / content / near-duplicate lookups, rule extraction
+                    and the local pre-classifier (_answer_exact_duplicate, _begin_processing)
+        ocr         attachment text extraction: PDF text layer, OCR, text files
+        prompt      prompt assembly (prompt_builder.build_prompt)
+        llm         the (fake) LLM call, rate limiting and retries included
+        persist     parsing the answer, result cache, near-duplicate index, results store
+Stage times are exclusive: time spent in a nested stage (e.g. persisting an exact
+duplicate inside hash_dedup) is only counted there.
+
+Each size runs in a fresh process so peak RSS is per size (the corpus is held in
+memory, see corpus_mb). The report is printed as JSON (and written to --output);
+with --baseline, throughput and per-email stage times are compared to an earlier
+report (as is import time) and the exit status is 1 when any is worse than
+--tolerance allows.
+
+Usage (from code/test):
+    python benchmark.py [--sizes 1 100 10000] [--latency 0.2] [--output report.json] [--baseline old.json]
+"""
+import argparse
+import functools
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SRC = os.path.abspath(os.path.join(HERE, "..", "src"))
+
+STAGES = ["parse", "hash_dedup", "ocr", "prompt", "llm", "persist"]
+
+
+class StageTimer:
+    """Exclusive wall time per stage; nested stages are subtracted from the enclosing one."""
+
+    def __init__(self):
+        self.samples = {stage: [] for stage in STAGES}
+        self._local = threading.local()
+
+    def wrap(self, stage: str, function):
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            stack = self._local.__dict__.setdefault("stack", [])
+            stack.append(0.0)
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                nested = stack.pop()
+                self.samples[stage].append(elapsed - nested)
+                if stack:
+                    stack[-1] += elapsed
+        return timed
+
+    def summary(self, emails: int) -> dict:
+        summary = {}
+        for stage, samples in self.samples.items():
+            ordered = sorted(samples)
+            summary[stage] = {
+                "calls": len(ordered),
+                "total_seconds": round(sum(ordered), 4),
+                "per_email_ms": round(1000 * sum(ordered) / emails, 3) if emails else None,
+                "mean_ms": round(1000 * sum(ordered) / len(ordered), 3) if ordered else None,
+                "p50_ms": round(1000 * ordered[len(ordered) // 2], 3) if ordered else None,
+                "p95_ms": round(1000 * ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3) if ordered else None,
+            }
+        return summary
+
+
+def _instrument(timer: StageTimer):
+    """Wrap the pipeline's stage functions where createEmail looks them up."""
+    import createEmail
+    import llm_client
+
+    processor = createEmail.EmailProcessor
+    processor.parse_email = timer.wrap("parse", processor.parse_email)
+    processor.get_email_hash = timer.wrap("hash_dedup", processor.get_email_hash)
+    processor.extract_text_from_attachment = timer.wrap("ocr", processor.extract_text_from_attachment)
+    for name, stage in (("_answer_exact_duplicate", "hash_dedup"), ("_begin_processing", "hash_dedup"),
+                        ("build_prompt", "prompt"), ("build_batch_prompt", "prompt"),
+                        ("_finish_processing", "persist"), ("_save_result", "persist")):
+        setattr(createEmail, name, timer.wrap(stage, getattr(createEmail, name)))
+    llm_client.LLMClient.generate = timer.wrap("llm", llm_client.LLMClient.generate)
+
+
+def _fake_responder(templates: list):
+    by_subject = {}
+    for template in templates:
+        for line in template["email_text"].split("\n"):
+            if line.lower().startswith("subject:"):
+                by_subject.setdefault(line.split(":", 1)[1].strip(), template["output"])
+
+    def respond(prompt: str) -> str:
+        for subject, output in by_subject.items():
+            if subject in prompt:
+                return json.dumps(output)
+        return json.dumps(templates[0]["output"])
+    return respond
+
+
+def run_size(count: int, latency: float, seed: int) -> dict:
+    """Process `count` synthetic emails in this process; returns the run's measurements."""
+    workdir = tempfile.mkdtemp(prefix="email-benchmark-")
+    os.environ.update({
+        "RESULTS_STORE_PATH": os.path.join(workdir, "results.sqlite3"),
+        "RESULT_CACHE_PATH": os.path.join(workdir, "result_cache.sqlite3"),
+        "NEAR_DUP_INDEX_PATH": os.path.join(workdir, "near_duplicates.sqlite3"),
+        "OCR_CACHE_PATH": os.path.join(workdir, "ocr_cache.sqlite3"),
+        "SEMANTIC_CACHE_PATH": os.path.join(workdir, "semantic_cache.sqlite3"),
+        "PRECLASSIFIER_MODEL_PATH": os.path.join(workdir, "no_model.npz"),
+    })
+    sys.path.insert(0, SRC)
+    sys.path.insert(0, HERE)
+    started = time.perf_counter()
+    import createEmail
+    import_seconds = time.perf_counter() - started
+    import llm_client
+    import synthetic_eml
+
+    templates = synthetic_eml.load_templates()
+    corpus = [raw for _, raw, _ in synthetic_eml.generate(count, seed, templates=templates)]
+    llm_client.set_client(llm_client.LLMClient(
+        backend=llm_client.FakeBackend(latency=latency, responder=_fake_responder(templates)),
+        requests_per_minute=1e9))
+    started = time.perf_counter()
+    createEmail.warm_up()
+    warm_up_seconds = time.perf_counter() - started
+
+    timer = StageTimer()
+    _instrument(timer)
+    errors = 0
+    started = time.perf_counter()
+    try:
+        for raw in corpus:
+            try:
+                createEmail.process_email_with_llm(raw, createEmail.DEFAULT_REQUEST_TYPE_DEFS,
+                                                   createEmail.DEFAULT_EXTRACTION_FIELDS, createEmail.DEFAULT_RULES)
+            except Exception as e:
+                errors += 1
+                print(f"Benchmark email failed: {e}", file=sys.stderr)
+        seconds = time.perf_counter() - started
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS.
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_rss_mb = peak_rss / (1024 * 1024) if sys.platform == "darwin" else peak_rss / 1024
+    return {
+        "emails": count,
+        "errors": errors,
+        "corpus_mb": round(sum(len(raw) for raw in corpus) / (1024 * 1024), 3),
+        "seconds": round(seconds, 4),
+        "emails_per_second": round(count / seconds, 2) if seconds else None,
+        "peak_rss_mb": round(peak_rss_mb, 1),
+        "startup": {"import_seconds": round(import_seconds, 4), "warm_up_seconds": round(warm_up_seconds, 4)},
+        "stages": timer.summary(count),
+    }
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list:
+    """Regressions of `report` against `baseline` (same sizes only), as readable strings."""
+    regressions = []
+    baseline_runs = {run["emails"]: run for run in baseline.get("runs", [])}
+    for run in report["runs"]:
+        old = baseline_runs.get(run["emails"])
+        if old is None:
+            continue
+        if old["emails_per_second"] and run["emails_per_second"] < old["emails_per_second"] * (1 - tolerance):
+            regressions.append(f"{run['emails']} emails: throughput {run['emails_per_second']}/s "
+                               f"(baseline {old['emails_per_second']}/s)")
+        old_import = old.get("startup", {}).get("import_seconds")
+        if old_import and run["startup"]["import_seconds"] > old_import * (1 + tolerance):
+            regressions.append(f"{run['emails']} emails: import {run['startup']['import_seconds']}s "
+                               f"(baseline {old_import}s)")
+        for stage in STAGES:
+            new_time = run["stages"][stage]["per_email_ms"]
+            old_time = old["stages"].get(stage, {}).get("per_email_ms")
+            if new_time is not None and old_time and new_time > old_time * (1 + tolerance):
+                regressions.append(f"{run['emails']} emails: {stage} {new_time} ms per email (baseline {old_time} ms)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the email pipeline end to end with a fake LLM.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 100, 10000])
+    parser.add_argument("--latency", type=float, default=0.2, help="fake LLM latency in seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    parser.add_argument("--baseline", help="earlier report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative slowdown (default 0.2)")
+    parser.add_argument("--single", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single is not None:
+        # Child process: one size, measurements as JSON on the last stdout line.
+        run = run_size(args.single, args.latency, args.seed)
+        print(json.dumps(run))
+        return
+
+    runs = []
+    for size in args.sizes:
+        completed = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--single", str(size), "--latency", str(args.latency),
+             "--seed", str(args.seed)],
+            stdout=subprocess.PIPE, text=True, check=True)
+        runs.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {"latency": args.latency, "seed": args.seed, "tesseract": shutil.which("tesseract") is not None,
+                   "pdftoppm": shutil.which("pdftoppm") is not None},
+        "runs": runs,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Per-page OCR latency of each engine in ocr_engine.py (tesserocr vs pytesseract).
+
+Pages are rendered from the labeled samples in try.py (see synthetic_eml.make_jpeg)
+and OCRed --repeat times by every engine that can be opened here. Reported per engine:
+    open_ms        creating the engine (tesserocr loads the language data here)
+    first_page_ms  the first page, cold
+    mean_ms, p50_ms, p95_ms   the remaining pages
+    preprocess_ms  mean time of ocr_engine.preprocess per page (not part of the page times)
+Engines that cannot be opened (library or tesseract binary missing) are reported
+with their error. The report is printed as JSON (and written to --output).
+
+Usage (from code/test):
+    python benchmark_ocr.py [--pages 20] [--repeat 3] [--no-preprocess] [--output ocr_report.json]
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SRC = os.path.abspath(os.path.join(HERE, "..", "src"))
+
+
+def _pages(count: int) -> list:
+    import synthetic_eml
+    from PIL import Image
+
+    templates = synthetic_eml.load_templates()
+    rng = random.Random(0)
+    pages = []
+    for index in range(count):
+        text = synthetic_eml.vary_text(templates[index % len(templates)]["email_text"], index, rng)
+        pages.append(Image.open(io.BytesIO(synthetic_eml.make_jpeg(text.split("\n")))))
+    return pages
+
+
+def _milliseconds(samples: list) -> dict:
+    ordered = sorted(samples)
+    if not ordered:
+        return {"mean_ms": None, "p50_ms": None, "p95_ms": None}
+    return {
+        "mean_ms": round(1000 * sum(ordered) / len(ordered), 3),
+        "p50_ms": round(1000 * ordered[len(ordered) // 2], 3),
+        "p95_ms": round(1000 * ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3),
+    }
+
+
+def run_engine(name: str, pages: list, repeat: int, preprocess: bool) -> dict:
+    import ocr_engine
+
+    started = time.perf_counter()
+    try:
+        engine = ocr_engine.ENGINES[name]()
+        open_seconds = time.perf_counter() - started
+        prepared, preprocess_seconds = [], []
+        for page in pages:
+            started = time.perf_counter()
+            prepared.append(ocr_engine.preprocess(page) if preprocess else page)
+            preprocess_seconds.append(time.perf_counter() - started)
+        samples = []
+        for _ in range(repeat):
+            for image in prepared:
+                started = time.perf_counter()
+                engine.image_to_string(image)
+                samples.append(time.perf_counter() - started)
+    except Exception as e:
+        return {"available": False, "error": f"{type(e).__name__}: {e}"}
+    return dict({
+        "available": True,
+        "pages": len(samples),
+        "open_ms": round(1000 * open_seconds, 3),
+        "first_page_ms": round(1000 * samples[0], 3),
+        "preprocess_ms": round(1000 * sum(preprocess_seconds) / len(preprocess_seconds), 3),
+    }, **_milliseconds(samples[1:]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare per-page OCR latency of the OCR engines.")
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-preprocess", action="store_true", help="OCR the rendered pages as they are")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    sys.path.insert(0, SRC)
+    sys.path.insert(0, HERE)
+    import ocr_engine
+
+    pages = _pages(args.pages)
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {"pages": args.pages, "repeat": args.repeat, "preprocess": not args.no_preprocess,
+                   "lang": ocr_engine.OCR_LANG, "binarize": ocr_engine.OCR_BINARIZE},
+        "engines": {name: run_engine(name, pages, args.repeat, not args.no_preprocess)
+                    for name in ocr_engine.ENGINES},
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
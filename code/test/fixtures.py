@@ -0,0 +1,54 @@
+"""
+Shared set-up for the tests that run the pipeline: every store in a temporary
+directory (opened afresh) and the LLM replaced by llm_client.FakeBackend.
+"""
+import os
+import sys
+from email.message import EmailMessage
+
+SRC = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+sys.path.insert(0, SRC)
+
+
+def isolate_stores(directory: str):
+    """Point every store at `directory` and drop the process-wide instances opened before."""
+    os.environ.update({
+        "RESULTS_STORE_PATH": os.path.join(directory, "results.sqlite3"),
+        "RESULT_CACHE_PATH": os.path.join(directory, "result_cache.sqlite3"),
+        "NEAR_DUP_INDEX_PATH": os.path.join(directory, "near_duplicates.sqlite3"),
+        "OCR_CACHE_PATH": os.path.join(directory, "ocr_cache.sqlite3"),
+        "SEMANTIC_CACHE_PATH": os.path.join(directory, "semantic_cache.sqlite3"),
+        "PRECLASSIFIER_MODEL_PATH": os.path.join(directory, "no_model.npz"),
+    })
+    import near_duplicates
+    import ocr
+    import preclassifier
+    import result_cache
+    import results_store
+    import semantic_cache
+
+    near_duplicates._index = None
+    ocr._cache = None
+    result_cache._cache = None
+    results_store._store = None
+    semantic_cache._cache = None
+    preclassifier._model, preclassifier._model_loaded = None, False
+
+
+def use_fake_llm(responder):
+    """Answer every LLM call with `responder(prompt) -> str`; returns the backend (see its `calls`)."""
+    import llm_client
+
+    backend = llm_client.FakeBackend(responder=responder)
+    llm_client.set_client(llm_client.LLMClient(backend=backend, requests_per_minute=1e9))
+    return backend
+
+
+def make_email(subject: str, body: str, index: int = 0) -> bytes:
+    message = EmailMessage()
+    message["From"] = f"loan.services{index}@example.com"
+    message["To"] = "commercial.lending@example.com"
+    message["Subject"] = subject
+    message["Message-ID"] = f"<test-{index}@example.com>"
+    message.set_content(body)
+    return message.as_bytes()
@@ -0,0 +1,194 @@
+"""
+Synthetic .eml corpus generator for the benchmarks (see benchmark.py).
+
+Emails are built from the labeled samples in try.py: the sample email text is
+varied (sender bank, deal name, dates, amount) so every email is unique, and
+PDF (with a text layer), JPEG (rendered text, needs Pillow) and TXT attachments
+are added in configurable proportions. A share of the corpus is re-sent as exact
+copies and as forwards of earlier emails to exercise duplicate detection.
+
+Usage:
+    python synthetic_eml.py <out_dir> [--count N] [--seed S] [--duplicate-rate R] [--forward-rate R]
+"""
+import argparse
+import ast
+import io
+import json
+import os
+import random
+import re
+from email.message import EmailMessage
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+TRY_PATH = os.path.join(REPO_ROOT, "try.py")
+
+BANKS = ["JPMORGAN CHASE BANK, N.A.", "WELLS FARGO BANK, N.A.", "BANK OF AMERICA, N.A.", "CITIBANK",
+         "HSBC BANK", "BNP PARIBAS", "BARCLAYS BANK PLC", "DEUTSCHE BANK AG", "MUFG BANK, LTD.", "SOCIETE GENERALE"]
+COMPANIES = ["ABC Corp", "XYZ Ltd.", "DEF Finance", "GHI Holdings", "JKL Energy", "MNO Logistics", "PQR Retail",
+             "STU Pharma", "VWX Shipping", "YZA Renewables"]
+MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+
+_DATE = re.compile(r"\b\d{1,2}-[A-Z][a-z]{2}-\d{4}\b")
+_AMOUNT = re.compile(r"USD [\d,]+\.\d{2}")
+_DEAL = re.compile(r"deal '([^']+)'")
+_SENDER = re.compile(r"\A[^\n]+")
+
+
+def load_templates(path: str = TRY_PATH) -> list:
+    """[{"email_text", "output"}] from the labeled samples in try.py."""
+    # The `data` literal is read without running try.py (which writes loan_samples.xlsx).
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    data = next(ast.literal_eval(node.value) for node in tree.body
+                if isinstance(node, ast.Assign) and any(getattr(target, "id", None) == "data" for target in node.targets))
+    templates = []
+    for sample in data:
+        sample_input = json.loads(sample["input"])
+        templates.append({"email_text": sample_input["Email content"], "output": json.loads(sample["output"])})
+    return templates
+
+
+def _date(rng: random.Random) -> str:
+    return f"{rng.randint(1, 28):02d}-{rng.choice(MONTHS)}-{rng.randint(2022, 2026)}"
+
+
+def vary_text(text: str, index: int, rng: random.Random) -> str:
+    """The template text with a new sender, deal name, dates and amount."""
+    company = rng.choice(COMPANIES)
+    text = _SENDER.sub(rng.choice(BANKS), text, count=1)
+    text = _DEAL.sub(f"deal '{company} Facility {index:06d}'", text)
+    text = _DATE.sub(lambda _: _date(rng), text)
+    text = _AMOUNT.sub(lambda _: f"USD {rng.randint(10, 99_999) * 1000:,}.00", text)
+    return text
+
+
+def make_pdf(lines: list) -> bytes:
+    """A one page PDF whose text layer holds `lines` (Helvetica, no dependencies)."""
+    def escape(line):
+        return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+    content = "BT /F1 11 Tf 14 TL 50 780 Td " + " ".join(f"({escape(line)}) '" for line in lines) + " ET"
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        "<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] /Contents 4 0 R "
+        "/Resources << /Font << /F1 5 0 R >> >> >>",
+        f"<< /Length {len(content)} >>\nstream\n{content}\nendstream",
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1"))
+    xref = out.tell()
+    out.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1"))
+    for offset in offsets:
+        out.write(f"{offset:010d} 00000 n \n".encode("latin-1"))
+    out.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1"))
+    return out.getvalue()
+
+
+def make_jpeg(lines: list):
+    """A scanned-looking JPEG of `lines`, or None without Pillow."""
+    try:
+        from PIL import Image, ImageDraw
+    except ImportError:
+        return None
+    image = Image.new("L", (1000, 40 + 24 * len(lines)), color=255)
+    draw = ImageDraw.Draw(image)
+    for row, line in enumerate(lines):
+        draw.text((30, 20 + 24 * row), line, fill=0)
+    out = io.BytesIO()
+    image.save(out, format="JPEG", quality=85)
+    return out.getvalue()
+
+
+def make_email(template: dict, index: int, rng: random.Random, pdf_rate: float = 0.5, jpeg_rate: float = 0.2,
+               txt_rate: float = 0.3) -> bytes:
+    text = vary_text(template["email_text"], index, rng)
+    lines = text.split("\n")
+    subject = next((line.split(":", 1)[1].strip() for line in lines if line.lower().startswith("subject:")),
+                   "Loan servicing request")
+    message = EmailMessage()
+    message["From"] = f"loan.services{index % 50}@example.com"
+    message["To"] = "commercial.lending@example.com"
+    message["Subject"] = subject
+    message["Message-ID"] = f"<synthetic-{index}@example.com>"
+    message.set_content(text)
+    # Attachments restate the notice, like the scanned / exported copies banks attach.
+    if rng.random() < pdf_rate:
+        message.add_attachment(make_pdf(lines), maintype="application", subtype="pdf", filename=f"notice_{index}.pdf")
+    if rng.random() < jpeg_rate:
+        jpeg = make_jpeg(lines)
+        if jpeg is not None:
+            message.add_attachment(jpeg, maintype="image", subtype="jpeg", filename=f"scan_{index}.jpg")
+    if rng.random() < txt_rate:
+        message.add_attachment(text.encode("utf-8"), maintype="text", subtype="plain", filename=f"details_{index}.txt")
+    return message.as_bytes()
+
+
+def forward_of(raw_email: bytes, index: int) -> bytes:
+    """A forward of `raw_email` with new headers and the original body quoted."""
+    from email import policy
+    from email.parser import BytesParser
+
+    original = BytesParser(policy=policy.default).parsebytes(raw_email)
+    body = original.get_body(preferencelist=("plain",))
+    quoted = "\n".join(f"> {line}" for line in (body.get_content() if body else "").splitlines())
+    message = EmailMessage()
+    message["From"] = "operations.desk@example.com"
+    message["To"] = "commercial.lending@example.com"
+    message["Subject"] = f"Fwd: {original['Subject']}"
+    message["Message-ID"] = f"<synthetic-fwd-{index}@example.com>"
+    message.set_content(f"Please action the request below.\n\n---------- Forwarded message ---------\n"
+                        f"From: {original['From']}\nSubject: {original['Subject']}\n\n{quoted}\n")
+    return message.as_bytes()
+
+
+def generate(count: int, seed: int = 0, duplicate_rate: float = 0.05, forward_rate: float = 0.05,
+             templates: list = None, **attachment_rates):
+    """Yield (name, raw email bytes, template index) for `count` emails."""
+    templates = templates or load_templates()
+    rng = random.Random(seed)
+    sent = []
+    for index in range(count):
+        roll = rng.random()
+        if sent and roll < duplicate_rate:
+            raw, template_index = rng.choice(sent)
+        elif sent and roll < duplicate_rate + forward_rate:
+            original, template_index = rng.choice(sent)
+            raw = forward_of(original, index)
+        else:
+            template_index = rng.randrange(len(templates))
+            raw = make_email(templates[template_index], index, rng, **attachment_rates)
+            sent.append((raw, template_index))
+        yield f"e{index:06d}.eml", raw, template_index
+
+
+def write_corpus(out_dir: str, count: int, seed: int = 0, **options) -> int:
+    os.makedirs(out_dir, exist_ok=True)
+    written = 0
+    for name, raw, _ in generate(count, seed, **options):
+        with open(os.path.join(out_dir, name), "wb") as f:
+            f.write(raw)
+        written += 1
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic corpus of loan servicing emails.")
+    parser.add_argument("out_dir")
+    parser.add_argument("--count", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--duplicate-rate", type=float, default=0.05)
+    parser.add_argument("--forward-rate", type=float, default=0.05)
+    args = parser.parse_args()
+    written = write_corpus(args.out_dir, args.count, args.seed, duplicate_rate=args.duplicate_rate,
+                           forward_rate=args.forward_rate)
+    print(f"Wrote {written} emails to {args.out_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Tests for batch.py: an email whose raw bytes were processed before is answered
+from the result cache without being parsed or OCRed in the worker.
+
+Usage (from code/test):
+    python -m unittest test_batch
+"""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import fixtures
+
+ANSWER = {
+    "extracted_fields": {"Amount": "USD 1,000.00"},
+    "request type": {
+        "Primary Request Type": "Money-Movement-inbound",
+        "Request Type": [{"Money-Movement-inbound": {"Confidence score": 0.9, "Reason": "Repayment",
+                                                     "request sub type": "Principal"}}],
+    },
+}
+
+
+class ExactDuplicateBatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="batch-test-")
+        fixtures.isolate_stores(self.directory)
+        self.backend = fixtures.use_fake_llm(lambda prompt: json.dumps(ANSWER))
+        self.mailbox = os.path.join(self.directory, "emails")
+        os.mkdir(self.mailbox)
+        for index, body in enumerate(("A repayment of USD 1,000.00 is due.", "Please update the signatories.")):
+            with open(os.path.join(self.mailbox, f"{index}.eml"), "wb") as f:
+                f.write(fixtures.make_email(f"Notice {index}", body, index))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _run(self) -> list:
+        import batch
+
+        # Workers are forked per run; drop the stores this process opened so they are not inherited.
+        fixtures.isolate_stores(self.directory)
+        return list(batch.run_batch(self.mailbox, workers=1, llm_workers=1))
+
+    def test_known_email_is_not_parsed(self):
+        import batch
+        import createEmail
+
+        self._run()
+        parsed = []
+        parse_email = createEmail.EmailProcessor.parse_email
+        createEmail.EmailProcessor.parse_email = lambda processor: parsed.append(processor) or parse_email(processor)
+        try:
+            prepared = batch._prepare(os.path.join(self.mailbox, "0.eml"))
+        finally:
+            createEmail.EmailProcessor.parse_email = parse_email
+        self.assertEqual(parsed, [])
+        self.assertEqual(set(prepared) - {"metrics"}, {"hash", "known_result"})
+
+    def test_rerun_answers_every_email_as_duplicate(self):
+        first = self._run()
+        calls = self.backend.calls
+        second = self._run()
+        self.assertEqual([item["error"] for item in first + second], [None] * 4)
+        self.assertFalse(any(item["duplicate"] for item in first))
+        self.assertTrue(all(item["duplicate"] for item in second))
+        self.assertEqual(self.backend.calls, calls)
+        by_name = {item["name"]: item["result"] for item in first}
+        for item in second:
+            self.assertEqual(item["result"], by_name[item["name"]])
+
+    def test_missing_ocr_libraries_do_not_break_the_workers(self):
+        import sys
+
+        # Workers are forked from this process, so they cannot import these either.
+        blocked = {name: sys.modules.get(name) for name in ("pdf2image", "pytesseract", "tesserocr")}
+        sys.modules.update(dict.fromkeys(blocked))
+        try:
+            items = self._run()
+        finally:
+            for name, module in blocked.items():
+                if module is None:
+                    sys.modules.pop(name, None)
+                else:
+                    sys.modules[name] = module
+        self.assertEqual([item["error"] for item in items], [None, None])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+"""
+Tests for near_duplicates.py: empty and very short texts have no signature and
+never match, a forward of a long email does; through the pipeline, a forward
+that restates the amount keeps its own rule-extracted value.
+
+Usage (from code/test):
+    python -m unittest test_near_duplicates
+"""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import fixtures
+from near_duplicates import NearDuplicateIndex
+
+NOTICE = """JPMORGAN CHASE BANK, N.A.
+To: Commercial Lending Operations
+Date: 15-Dec-2023
+
+Please be advised that the borrower has requested a principal repayment on the term
+loan facility. The payment will be made from the operating account held with us and
+should be applied against the outstanding principal balance of the tranche A loans.
+Kindly confirm receipt of the funds and update the loan servicing records, including
+the revised amortization schedule, once the payment has been applied. Reach out to
+the agency desk with any questions regarding the allocation among the lenders.
+Amount: USD {amount}
+"""
+
+
+class NearDuplicateIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="near-duplicates-test-")
+        self.index = NearDuplicateIndex(os.path.join(self.directory, "near_duplicates.sqlite3"))
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.directory)
+
+    def test_empty_text_has_no_signature_and_never_matches(self):
+        self.assertIsNone(self.index.signature(""))
+        self.index.add("a", text="")
+        self.assertIsNone(self.index.query(text=""))
+
+    def test_short_texts_do_not_match_each_other(self):
+        self.index.add("a", text="Please see attached.")
+        self.assertIsNone(self.index.query(text="Please see attached."))
+        self.assertIsNone(self.index.query(text="Thanks"))
+
+    def test_forward_of_a_long_email_matches(self):
+        self.index.add("a", text=NOTICE.format(amount="5,000,000.00"))
+        forward = "---------- Forwarded message ---------\n" + NOTICE.format(amount="5,000,000.00")
+        match = self.index.query(text=forward, exclude="b")
+        self.assertEqual(match[0], "a")
+        self.assertGreaterEqual(match[1], self.index.threshold)
+
+
+class NearDuplicateHitTest(unittest.TestCase):
+
+    def setUp(self):
+        import createEmail
+
+        self.createEmail = createEmail
+        self.directory = tempfile.mkdtemp(prefix="near-duplicate-hit-test-")
+        fixtures.isolate_stores(self.directory)
+        self.backend = fixtures.use_fake_llm(lambda prompt: json.dumps({
+            "extracted_fields": {"Transactor": "ABC Corp"},
+            "request type": {
+                "Primary Request Type": "Money-Movement-inbound",
+                "Request Type": [{"Money-Movement-inbound": {"Confidence score": 0.95, "Reason": "Repayment",
+                                                             "request sub type": "Principal"}}],
+            },
+        }))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _process(self, body: str, index: int) -> tuple:
+        raw = fixtures.make_email("Principal repayment", body, index)
+        result = self.createEmail.process_email_with_llm(raw, self.createEmail.DEFAULT_REQUEST_TYPE_DEFS,
+                                                          ["Amount", "Transactor"])
+        return result, self.createEmail.get_results_store().get(self.createEmail.EmailProcessor(raw).get_email_hash())
+
+    def test_forward_keeps_its_own_rule_fields(self):
+        self._process(NOTICE.format(amount="5,000,000.00"), 1)
+        forward = NOTICE.format(amount="6,000,000.00").replace("Please be advised", "FYI, please be advised")
+        result, stored = self._process(forward, 2)
+
+        self.assertEqual(self.backend.calls, 1)
+        self.assertTrue(stored["is_duplicate"])
+        self.assertEqual(result["extracted_fields"], {"Amount": "USD 6,000,000.00", "Transactor": "ABC Corp"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+"""
+Tests for the OCR cache keys in ocr.py: text cached by one engine or with one
+set of preprocessing settings is not returned for another.
+
+Usage (from code/test):
+    python -m unittest test_ocr
+"""
+import io
+import shutil
+import tempfile
+import unittest
+
+import fixtures
+import ocr
+import ocr_engine
+
+
+class NamedEngine:
+
+    def __init__(self, name: str):
+        self.name = name
+        self.lang = "eng"
+        self.calls = 0
+
+    def image_to_string(self, image) -> str:
+        self.calls += 1
+        return f"text from {self.name}"
+
+
+def _png() -> bytes:
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new("L", (8, 8), 255).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class OcrCacheKeyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="ocr-test-")
+        fixtures.isolate_stores(self.directory)
+        self.binarize = ocr_engine.OCR_BINARIZE
+        self.image = _png()
+
+    def tearDown(self):
+        ocr_engine.OCR_BINARIZE = self.binarize
+        ocr_engine.set_engine(None)
+        ocr.get_ocr_cache().close()
+        shutil.rmtree(self.directory)
+
+    def test_same_engine_and_settings_hit(self):
+        engine = NamedEngine("first")
+        ocr_engine.set_engine(engine)
+        self.assertEqual(ocr.ocr_image(self.image), "text from first")
+        self.assertEqual(ocr.ocr_image(self.image), "text from first")
+        self.assertEqual(engine.calls, 1)
+
+    def test_switching_engine_misses(self):
+        ocr_engine.set_engine(NamedEngine("first"))
+        ocr.ocr_image(self.image)
+        ocr_engine.set_engine(NamedEngine("second"))
+        self.assertEqual(ocr.ocr_image(self.image), "text from second")
+
+    def test_changing_preprocessing_misses(self):
+        engine = NamedEngine("first")
+        ocr_engine.set_engine(engine)
+        ocr.ocr_image(self.image)
+        ocr_engine.OCR_BINARIZE = not ocr_engine.OCR_BINARIZE
+        ocr.ocr_image(self.image)
+        self.assertEqual(engine.calls, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
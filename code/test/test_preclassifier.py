@@ -0,0 +1,65 @@
+"""
+Tests for the local pre-classifier path of createEmail: a confident local
+classification skips the classification call, and the fields the rules did not
+find are filled by the extraction-only LLM call.
+
+Usage (from code/test):
+    python -m unittest test_preclassifier
+"""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import fixtures
+
+INBOUND = "Please be advised that a principal repayment of USD {amount} is due for the deal 'ABC Corp Loan'."
+ADJUSTMENT = "We request an adjustment to the fee schedule and the margin of the facility agreement."
+
+
+class PreClassifierHitTest(unittest.TestCase):
+
+    def setUp(self):
+        import createEmail
+        import metrics
+        import preclassifier
+        import prompt_builder
+
+        self.createEmail = createEmail
+        self.metrics = metrics
+        self.extraction_instructions = prompt_builder.EXTRACTION_INSTRUCTIONS
+        self.directory = tempfile.mkdtemp(prefix="preclassifier-test-")
+        fixtures.isolate_stores(self.directory)
+        self.prompts = []
+        fixtures.use_fake_llm(self._respond)
+        texts = [INBOUND.format(amount=f"{index},000.00") for index in range(1, 6)] + [ADJUSTMENT] * 5
+        labels = ["Money-Movement-inbound|Principal"] * 5 + ["Adjustment|"] * 5
+        preclassifier._model = preclassifier.PreClassifier.train(texts, labels, n_features=2 ** 10)
+        preclassifier._model_loaded = True
+        os.environ["PRECLASSIFIER_THRESHOLD"] = "0.5"
+
+    def tearDown(self):
+        del os.environ["PRECLASSIFIER_THRESHOLD"]
+        shutil.rmtree(self.directory)
+
+    def _respond(self, prompt: str) -> str:
+        self.prompts.append(prompt)
+        return json.dumps({"extracted_fields": {"Amount": "USD 7,000.00", "Transactor": "ABC Corp"}})
+
+    def test_hit_extracts_the_fields_the_rules_missed(self):
+        raw = fixtures.make_email("Principal repayment notice", INBOUND.format(amount="7,000.00"))
+        result = self.createEmail.process_email_with_llm(raw, self.createEmail.DEFAULT_REQUEST_TYPE_DEFS,
+                                                          ["Amount", "Transactor"])
+        stored = self.createEmail.get_results_store().get(self.createEmail.EmailProcessor(raw).get_email_hash())
+
+        self.assertEqual(stored["meta"]["source"], "local-classifier")
+        self.assertEqual(result["request type"]["Primary Request Type"], "Money-Movement-inbound")
+        self.assertEqual(len(self.prompts), 1)
+        self.assertTrue(self.prompts[0].startswith(self.extraction_instructions))
+        self.assertEqual(result["extracted_fields"], {"Amount": "USD 7,000.00", "Transactor": "ABC Corp"})
+        self.assertIn('email_pipeline_preclassifier_total{outcome="hit"}', self.metrics.render_prometheus())
+
+
+if __name__ == "__main__":
+    unittest.main()
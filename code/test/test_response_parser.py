@@ -0,0 +1,66 @@
+"""
+Tests for response_parser.py: a response streamed in chunks of any size parses to the
+same object as the whole text, and values still being written are never shown.
+
+Usage (from code/test):
+    python -m unittest test_response_parser
+"""
+import json
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")))
+
+from response_parser import IncrementalJSONParser, parse_json_tolerant  # noqa: E402
+
+RESULT = {
+    "extracted_fields": {"Amount": "USD 5,000.00", "Deal Name": "CANTOR FITZGERALD LP, {TERM}",
+                         "Expiration Date": None, "flags": [True, False, 1.5, {"k": []}]},
+    "request type": {"Primary Request Type": "Fee Payment",
+                     "Request Type": [{"Fee Payment": {"Confidence score": 0.9,
+                                                       "Reason": "Mentions the ongoing fee, [see below]",
+                                                       "request sub type": "Ongoing Fee"}}]},
+}
+# As the model writes it: fenced, with Python literals.
+RESPONSE = ("Here is the result:\n```json\n"
+            + json.dumps(RESULT, indent=2).replace("null", "None").replace("true", "True")
+            + "\n```\n")
+
+
+class IncrementalJSONParserTest(unittest.TestCase):
+
+    def test_any_chunking_gives_the_one_shot_result(self):
+        self.assertEqual(parse_json_tolerant(RESPONSE), RESULT)
+        rng = random.Random(7)
+        for _ in range(100):
+            parser = IncrementalJSONParser()
+            position = 0
+            while position < len(RESPONSE):
+                size = rng.randint(1, 12)
+                parser.feed(RESPONSE[position:position + size])
+                position += size
+            self.assertEqual(parser.buffer, RESPONSE)
+            self.assertEqual(parser.value, RESULT)
+
+    def test_partial_strings_are_never_shown(self):
+        parser = IncrementalJSONParser()
+        shown = []
+        for char in RESPONSE:
+            value = parser.feed(char)
+            if value is not None:
+                shown.append(json.dumps(value))
+        self.assertTrue(shown)
+        for value in shown:
+            self.assertNotIn('"Fee Pay"', value)
+            self.assertNotIn('"USD 5,0"', value)
+
+    def test_truncated_text(self):
+        self.assertEqual(parse_json_tolerant('{"a": [1, 2', partial_strings=False), {"a": [1, 2]})
+        self.assertEqual(parse_json_tolerant('{"a": 1, "b"'), {"a": 1})
+        self.assertEqual(parse_json_tolerant('{"a": None, "b": True,}'), {"a": None, "b": True})
+
+
+if __name__ == "__main__":
+    unittest.main()
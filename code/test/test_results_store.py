@@ -0,0 +1,66 @@
+"""
+Tests for results_store.migrate_csv: legacy Info cells (the repr of a
+GenerateContentResponse, or the model's text) are stored in the current result
+shape; unreadable rows are kept and reported.
+
+Usage (from code/test):
+    python -m unittest test_results_store
+"""
+import csv
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import fixtures
+import results_store
+
+LEGACY_CSV = os.path.join(fixtures.SRC, "service_requests.csv")
+
+
+class MigrateCsvTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="results-store-test-")
+        self.store = results_store.SQLiteResultsStore(os.path.join(self.directory, "results.sqlite3"))
+        # The shipped file has the model's text under the same hash as the response repr.
+        csv.field_size_limit(sys.maxsize)
+        with open(LEGACY_CSV, newline="", encoding="utf-8") as f:
+            rows = list(csv.DictReader(f))
+        rows[2]["256RSAHash"] = "plain-text-row"
+        self.csv_path = os.path.join(self.directory, "service_requests.csv")
+        with open(self.csv_path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.directory)
+
+    def test_legacy_answers_are_classified(self):
+        report = results_store.migrate_csv(self.csv_path, self.store)
+        self.assertEqual(report, {"imported": 3, "unclassified": 1})
+
+        response = self.store.get("2c28884a41c993d247924e9d7e3f4b6ac4981679b8311b30da84d8244528505a")
+        self.assertEqual((response["request_type"], response["sub_type"], response["confidence"]),
+                         ("Money-Movement-outbound", "Foreign currency", 0.7))
+        self.assertEqual(json.loads(response["info"])["extracted_fields"]["Amount"], "20,000,000.00")
+        self.assertNotIn("parse_error", response["meta"])
+
+        text = self.store.get("plain-text-row")
+        self.assertEqual((text["request_type"], text["sub_type"]), ("Money-Movement-inbound", "Principal + Interest"))
+
+        empty = self.store.get("csdvcdsvdgsw214124g12416")
+        self.assertIsNone(empty["request_type"])
+        self.assertTrue(empty["meta"]["parse_error"])
+
+    def test_rerun_skips_imported_rows(self):
+        results_store.migrate_csv(self.csv_path, self.store)
+        self.assertEqual(results_store.migrate_csv(self.csv_path, self.store), {"imported": 0, "unclassified": 0})
+
+
+if __name__ == "__main__":
+    unittest.main()
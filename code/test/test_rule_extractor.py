@@ -0,0 +1,75 @@
+"""
+Tests for rule_extractor.py: the standard fields of the try.py samples are found,
+and letterheads / currencies are not read into arbitrary lower-case text.
+
+Usage (from code/test):
+    python -m unittest test_rule_extractor
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")))
+
+from rule_extractor import RuleExtractor, extract_fields  # noqa: E402
+
+FIELDS = ["source bank", "amount", "date", "effective date", "deal name", "expiration date"]
+
+NOTICE = """JPMORGAN CHASE BANK, N.A.
+To: Commercial Lending Operations
+Date: 15-Dec-2023
+Subject: Adjustment for the deal 'ABC Corp Loan Adjustment 2023'
+
+Effective date: 18-Dec-2023
+Amount: USD 5,000,000.00
+Expiration Date: 31-Dec-2024
+"""
+
+
+class RuleExtractorTest(unittest.TestCase):
+
+    def test_standard_fields(self):
+        self.assertEqual(extract_fields(NOTICE, FIELDS), {
+            "source bank": "JPMORGAN CHASE BANK, N.A.",
+            "date": "15-Dec-2023",
+            "deal name": "ABC Corp Loan Adjustment 2023",
+            "effective date": "18-Dec-2023",
+            "amount": "USD 5,000,000.00",
+            "expiration date": "31-Dec-2024",
+        })
+
+    def test_keywords_are_case_insensitive(self):
+        text = "WELLS FARGO BANK\nTO: ops\nDATE: 05-Jan-2024\nAMOUNT DUE: $ 1,250.50\nDeal Name: XYZ Project\n"
+        self.assertEqual(extract_fields(text, FIELDS), {
+            "source bank": "WELLS FARGO BANK",
+            "date": "05-Jan-2024",
+            "amount": "$ 1,250.50",
+            "deal name": "XYZ Project",
+        })
+
+    def test_generic_field_line(self):
+        self.assertEqual(extract_fields("Hello\nfacility ID:  FAC-123 \n", ["Facility Id"]), {"Facility Id": "FAC-123"})
+
+    def test_source_bank_needs_upper_case_letterhead(self):
+        self.assertEqual(extract_fields("Hi team,\nTo: ops", FIELDS), {})
+        self.assertEqual(extract_fields("Jpmorgan Chase\nTo: ops", FIELDS), {})
+
+    def test_currency_needs_iso_code_or_symbol(self):
+        self.assertEqual(extract_fields("Amount: abc 5", FIELDS), {})
+        self.assertEqual(extract_fields("Amount: usd 5", FIELDS), {})
+        self.assertEqual(extract_fields("Amount: EUR 5", FIELDS), {"amount": "EUR 5"})
+
+    def test_dates_must_look_like_dates(self):
+        self.assertEqual(extract_fields("Date: tomorrow\nEffective date: soon", FIELDS), {})
+
+    def test_first_occurrence_wins(self):
+        text = "Date: 01-Jan-2024\nDate: 02-Jan-2024\n"
+        self.assertEqual(RuleExtractor(("date",)).extract(text), {"date": "01-Jan-2024"})
+
+    def test_no_fields_or_text(self):
+        self.assertEqual(extract_fields(NOTICE, []), {})
+        self.assertEqual(extract_fields("", FIELDS), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
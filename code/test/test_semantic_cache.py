@@ -0,0 +1,159 @@
+"""
+Tests for semantic_cache.py: templated variations hit, other emails miss, and
+classifications of any shape (list of sub types) are stored. Through the
+pipeline (fake LLM), a hit reuses the classification and sends only the
+missing fields to an extraction-only LLM call.
+
+Usage (from code/test):
+    python -m unittest test_semantic_cache
+"""
+import json
+import os
+import re
+import shutil
+import tempfile
+import unittest
+
+import fixtures
+from semantic_cache import SemanticCache
+
+NOTICE = """WELLS FARGO BANK, N.A.
+To: Commercial Lending Operations
+Subject: Principal repayment notice
+
+Please be advised that a principal repayment of USD {amount} is due on {date} for the
+deal '{deal}'. Kindly arrange for the funds to be credited to the agent account before
+the payment date. Contact the loan servicing desk with any questions.
+"""
+
+OTHER = """Hello,
+We would like to request a change to the borrower's mailing address and the
+authorized signatories on file for the revolving credit facility. The updated
+documents are attached for your review.
+"""
+
+
+class SemanticCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="semantic-cache-test-")
+        self.path = os.path.join(self.directory, "semantic_cache.sqlite3")
+        self.cache = SemanticCache(self.path)
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.directory)
+
+    def _add_notice(self, sub_type="Principal"):
+        text = NOTICE.format(amount="5,000,000.00", date="15-Dec-2023", deal="ABC Corp Loan 2023")
+        self.cache.add("h1", ("Money Movement - Inbound", sub_type, 0.95, {"deal name": "ABC Corp Loan 2023"}),
+                       text=text)
+
+    def test_templated_variation_hits(self):
+        self._add_notice()
+        hit = self.cache.query(NOTICE.format(amount="120,000.00", date="02-Mar-2024", deal="XYZ Project Finance"))
+        self.assertIsNotNone(hit)
+        self.assertEqual(hit["email_hash"], "h1")
+        self.assertEqual((hit["request_type"], hit["sub_type"]), ("Money Movement - Inbound", "Principal"))
+        self.assertEqual(hit["extracted_fields"], {"deal name": "ABC Corp Loan 2023"})
+        self.assertGreaterEqual(hit["similarity"], self.cache.threshold)
+
+    def test_other_email_misses(self):
+        self._add_notice()
+        self.assertIsNone(self.cache.query(OTHER))
+
+    def test_empty_cache_and_excluded_email_miss(self):
+        self.assertIsNone(self.cache.query(OTHER))
+        self._add_notice()
+        text = NOTICE.format(amount="5,000,000.00", date="15-Dec-2023", deal="ABC Corp Loan 2023")
+        self.assertIsNone(self.cache.query(text, exclude="h1"))
+
+    def test_list_of_sub_types_is_stored_joined(self):
+        self._add_notice(sub_type=["Principal", "Interest"])
+        self.assertEqual(len(self.cache), 1)
+        hit = self.cache.query(NOTICE.format(amount="1.00", date="01-Jan-2024", deal="Other"))
+        self.assertEqual(hit["sub_type"], "Principal, Interest")
+
+    def test_rows_are_shared_through_the_file(self):
+        other = SemanticCache(self.path)
+        try:
+            self._add_notice()
+            self.assertEqual(other.query(NOTICE.format(amount="9.00", date="09-Sep-2024", deal="Z"))["email_hash"],
+                             "h1")
+        finally:
+            other.close()
+
+
+class SemanticCacheHitTest(unittest.TestCase):
+
+    def setUp(self):
+        import createEmail
+        import prompt_builder
+
+        self.createEmail = createEmail
+        self.extraction_instructions = prompt_builder.EXTRACTION_INSTRUCTIONS
+        self.directory = tempfile.mkdtemp(prefix="semantic-hit-test-")
+        fixtures.isolate_stores(self.directory)
+        self.prompts = []
+        self.sub_type = "Principal"
+        fixtures.use_fake_llm(self._respond)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _respond(self, prompt: str) -> str:
+        self.prompts.append(prompt)
+        match = re.search(r"USD [\d,.]*\d", prompt)
+        amount = match.group(0) if match else None
+        if prompt.startswith(self.extraction_instructions):
+            return json.dumps({"extracted_fields": {"Amount": amount, "Transactor": "ABC Corp"}})
+        fields = dict.fromkeys(self.createEmail.DEFAULT_EXTRACTION_FIELDS)
+        fields.update({"Amount": amount, "Transactor": "ABC Corp"})
+        return json.dumps({
+            "extracted_fields": fields,
+            "request type": {
+                "Primary Request Type": "Money-Movement-inbound",
+                "Request Type": [{"Money-Movement-inbound": {"Confidence score": 0.95, "Reason": "Repayment notice",
+                                                             "request sub type": self.sub_type}}],
+            },
+        })
+
+    def _process(self, index: int, **values) -> tuple:
+        raw = fixtures.make_email("Principal repayment notice", NOTICE.format(**values), index)
+        result = self.createEmail.process_email_with_llm(raw, self.createEmail.DEFAULT_REQUEST_TYPE_DEFS,
+                                                          self.createEmail.DEFAULT_EXTRACTION_FIELDS)
+        email_hash = self.createEmail.EmailProcessor(raw).get_email_hash()
+        return result, self.createEmail.get_results_store().get(email_hash)
+
+    def test_hit_reuses_classification_and_extracts_missing_fields(self):
+        self._process(1, amount="5,000,000.00", date="15-Dec-2023", deal="ABC Corp Loan 2023")
+        result, stored = self._process(2, amount="120,000.00", date="02-Mar-2024", deal="XYZ Project Finance")
+
+        self.assertEqual(len(self.prompts), 2)
+        self.assertTrue(self.prompts[1].startswith(self.extraction_instructions))
+        self.assertEqual(stored["meta"]["source"], "semantic-cache")
+        self.assertEqual(result["request type"]["Primary Request Type"], "Money-Movement-inbound")
+        fields = result["extracted_fields"]
+        self.assertEqual(fields["Amount"], "USD 120,000.00")
+        self.assertEqual(fields["deal name"], "XYZ Project Finance")
+        self.assertEqual(fields["source bank"], "WELLS FARGO BANK, N.A.")
+        # Filled by the rules: not asked again.
+        self.assertNotIn("deal name", self.prompts[1].split("Email Content:")[0])
+
+    def test_miss_asks_for_the_classification(self):
+        self._process(1, amount="5,000,000.00", date="15-Dec-2023", deal="ABC Corp Loan 2023")
+        raw = fixtures.make_email("Address change", OTHER, 3)
+        self.createEmail.process_email_with_llm(raw, self.createEmail.DEFAULT_REQUEST_TYPE_DEFS, ["Amount"])
+        self.assertEqual(len(self.prompts), 2)
+        self.assertFalse(self.prompts[1].startswith(self.extraction_instructions))
+
+    def test_list_of_sub_types_is_saved(self):
+        self.sub_type = ["Principal", "Interest"]
+        result, stored = self._process(1, amount="5,000,000.00", date="15-Dec-2023", deal="ABC Corp Loan 2023")
+        self.assertIsNotNone(stored)
+        self.assertEqual(stored["sub_type"], "Principal, Interest")
+        self.assertEqual(len(self.createEmail.get_semantic_cache()), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
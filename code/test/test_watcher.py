@@ -0,0 +1,174 @@
+"""
+Tests for watcher.py: resuming from the checkpoint after a crash between storing a
+result and marking the message done (Maildir and mbox), and Maildir deliveries
+picked up from the inotify event file names without listing the directories again.
+
+Usage (from code/test):
+    python -m unittest test_watcher
+"""
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import fixtures
+import watcher
+
+ANSWER = {
+    "extracted_fields": {"Amount": "USD 1,000.00"},
+    "request type": {
+        "Primary Request Type": "Money-Movement-inbound",
+        "Request Type": [{"Money-Movement-inbound": {"Confidence score": 0.9, "Reason": "Repayment",
+                                                     "request sub type": "Principal"}}],
+    },
+}
+
+BODIES = ("A repayment of USD 1,000.00 is due on the facility.",
+          "Please update the authorized signatories on file.",
+          "The interest payment for the quarter was received.")
+
+
+class _Crash(BaseException):
+    """Stands in for the process dying: not caught by the watcher's error handling."""
+
+
+class RecordingWatcher(watcher.Watcher):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.items = []
+
+    def _finish(self, key, position, item):
+        self.items.append(item)
+        super()._finish(key, position, item)
+
+
+class WatcherTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="watcher-test-")
+        fixtures.isolate_stores(self.directory)
+        self.backend = fixtures.use_fake_llm(lambda prompt: json.dumps(ANSWER))
+        self.state_path = os.path.join(self.directory, "watcher.sqlite3")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _watcher(self, path: str, **kwargs) -> RecordingWatcher:
+        checkpoints = watcher.Checkpoints(self.state_path)
+        self.addCleanup(checkpoints.close)
+        return RecordingWatcher(path, workers=1, poll_interval=0.05, checkpoints=checkpoints, **kwargs)
+
+    def _crash_after_storing(self, path: str):
+        """Process every message, dying after each result is stored but before it is marked done."""
+        crashed = self._watcher(path)
+        mark = crashed.checkpoints.mark
+
+        def mark_until_done(source, key, state, *args, **kwargs):
+            if state == watcher.DONE:
+                raise _Crash()
+            mark(source, key, state, *args, **kwargs)
+
+        crashed.checkpoints.mark = mark_until_done
+        for key, position, opener in crashed._next_messages(len(BODIES)):
+            with self.assertRaises(_Crash):
+                crashed._process(key, position, opener)
+        return self.backend.calls
+
+    def _assert_resumed(self, path: str, calls: int):
+        resumed = self._watcher(path)
+        resumed.run(once=True)
+        self.assertEqual(len(resumed.items), len(BODIES))
+        self.assertEqual([item["result"] for item in resumed.items], ["already stored"] * len(BODIES))
+        self.assertEqual(self.backend.calls, calls)
+        # Done now: a further run reads nothing again.
+        again = self._watcher(path)
+        again.run(once=True)
+        self.assertEqual(again.items, [])
+
+
+class CheckpointResumeTest(WatcherTestCase):
+
+    def test_maildir_resumes_without_reprocessing(self):
+        maildir = os.path.join(self.directory, "Maildir")
+        for subdir in ("tmp", "new", "cur"):
+            os.makedirs(os.path.join(maildir, subdir))
+        for index, body in enumerate(BODIES):
+            with open(os.path.join(maildir, "new", f"17000000{index}.M1P1.host"), "wb") as f:
+                f.write(fixtures.make_email(f"Notice {index}", body, index))
+
+        calls = self._crash_after_storing(maildir)
+        self.assertEqual(calls, len(BODIES))
+        self._assert_resumed(maildir, calls)
+
+    def test_mbox_resumes_without_reprocessing(self):
+        mbox = os.path.join(self.directory, "inbox.mbox")
+        with open(mbox, "wb") as f:
+            for index, body in enumerate(BODIES):
+                f.write(b"From loan.services@example.com Mon Jan  1 00:00:00 2024\n")
+                f.write(fixtures.make_email(f"Notice {index}", body, index) + b"\n")
+        calls = self._crash_after_storing(mbox)
+        self.assertEqual(calls, len(BODIES))
+        # Nothing was marked done, so the checkpointed offset did not move.
+        checkpoints = watcher.Checkpoints(self.state_path)
+        self.addCleanup(checkpoints.close)
+        self.assertEqual(checkpoints.offset(os.path.abspath(mbox))[1], 0)
+        self._assert_resumed(mbox, calls)
+
+
+class InotifyDeliveryTest(WatcherTestCase):
+
+    def test_delivery_is_taken_from_the_event(self):
+        maildir = os.path.join(self.directory, "Maildir")
+        for subdir in ("tmp", "new", "cur"):
+            os.makedirs(os.path.join(maildir, subdir))
+        watching = self._watcher(maildir)
+        try:
+            watcher._Inotify(watching.source.watch_paths()).close()
+        except (OSError, AttributeError) as e:
+            self.skipTest(f"inotify unavailable: {e}")
+        listings = []
+        list_directories = watching.source._list
+        watching.source._list = lambda: listings.append(1) or list_directories()
+
+        stop = threading.Event()
+        thread = threading.Thread(target=watching.run, args=(stop,))
+        thread.start()
+        try:
+            time.sleep(0.2)
+            for index, body in enumerate(BODIES):
+                tmp = os.path.join(maildir, "tmp", f"17000000{index}.M1P1.host")
+                with open(tmp, "wb") as f:
+                    f.write(fixtures.make_email(f"Notice {index}", body, index))
+                os.rename(tmp, os.path.join(maildir, "new", os.path.basename(tmp)))
+            deadline = time.time() + 10
+            while len(watching.items) < len(BODIES) and time.time() < deadline:
+                time.sleep(0.05)
+        finally:
+            stop.set()
+            watching._wake.set()
+            thread.join()
+        self.assertEqual(len(watching.items), len(BODIES))
+        self.assertEqual([item["error"] for item in watching.items], [None] * len(BODIES))
+        # Listed once at startup; the deliveries came from the event file names.
+        self.assertEqual(len(listings), 1)
+
+    def test_lost_events_list_the_directories_again(self):
+        maildir = os.path.join(self.directory, "Maildir")
+        for subdir in ("tmp", "new", "cur"):
+            os.makedirs(os.path.join(maildir, subdir))
+        source = watcher.MaildirSource(maildir)
+        source.evented = True
+        self.assertEqual(source.scan(), [])
+        with open(os.path.join(maildir, "new", "1700000000.M1P1.host"), "wb") as f:
+            f.write(fixtures.make_email("Notice", BODIES[0]))
+        self.assertEqual(source.scan(), [])
+        source.notify([(None, None)])
+        self.assertEqual(source.scan(), ["1700000000.M1P1.host"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -10,12 +10,22 @@ setup(
     long_description_content_type="text/markdown",
     packages=find_packages(),
     install_requires=[
-        # Add your dependencies here, e.g., 'requests', 'numpy'
+        "google-generativeai>=0.3",
+        "numpy>=1.21",
+        "python-dotenv>=0.19",
     ],
+    extras_require={
+        "ocr": ["pypdf>=3.0", "pdf2image>=1.16", "pytesseract>=0.3.8", "Pillow>=9.0"],
+        "api": ["fastapi>=0.95", "uvicorn>=0.20", "python-multipart>=0.0.6"],
+        "ui": ["streamlit>=1.20", "requests>=2.25", "pandas>=1.3"],
+        "parquet": ["pyarrow>=10.0"],
+        "train": ["pandas>=1.3", "openpyxl>=3.0"],
+        "profile": ["pyinstrument>=4.0"],
+    },
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: MIT License",
         "Operating System :: OS Independent",
     ],
-    python_requires=">=3.6",
+    python_requires=">=3.9",
 )
\ No newline at end of file